@@ -0,0 +1,102 @@
+"""
+    Async database layer throughput: seeds one category with --products products and sends --requests requests to
+    GET /api/category/{id}?with_counts=true at every --concurrency, in-process through httpx's ASGI transport, with the
+    catalog cache off unless --cache, so every request runs its query. It also times one trivial statement through an
+    AsyncSession (aiosqlite runs each connection on its own thread, every statement is a hop there and back to the
+    event loop) against the same statement on a plain sqlite3 connection, the per-statement cost the async layer adds.
+
+        python -m bench.async_throughput --concurrency 10,50
+        python -m bench.async_throughput --cache
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from bench.harness import create_database, seed, load_app, Recorder, run_workers, summarize
+
+STATEMENTS = 2000  # timed one after the other for the per-statement cost
+
+
+async def _statement_cost(workdir: str) -> dict:
+    from sqlalchemy import text
+    from src.config.db_setup import session_local
+
+    async with session_local() as db:
+        await db.execute(text("SELECT 1"))
+        started = time.perf_counter()
+        for _ in range(STATEMENTS):
+            await db.execute(text("SELECT 1"))
+        async_us = (time.perf_counter() - started) / STATEMENTS * 1e6
+
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    started = time.perf_counter()
+    for _ in range(STATEMENTS):
+        con.execute("SELECT 1").fetchall()
+    sync_us = (time.perf_counter() - started) / STATEMENTS * 1e6
+    con.close()
+    return {"async_session_us": round(async_us, 1), "sqlite3_us": round(sync_us, 1)}
+
+
+async def _run(workdir: str, env: dict, category_id: str, requests: int, levels: list[int]) -> dict:
+    import httpx
+    app = load_app(workdir, env)
+    url = f"/api/category/{category_id}"
+    results = {}
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        statement_cost = await _statement_cost(workdir)
+        limits = httpx.Limits(max_connections=None)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", limits=limits, timeout=120) as c:
+            await c.get(url, params={"with_counts": True})
+            for concurrency in levels:
+                recorder = Recorder()
+                queue = asyncio.Queue()
+                for _ in range(requests):
+                    queue.put_nowait(None)
+
+                async def client():
+                    while not queue.empty():
+                        queue.get_nowait()
+                        await recorder.request(c, "GET", url, label="GET /api/category/{category_id}",
+                                               params={"with_counts": True})
+
+                started = time.perf_counter()
+                await asyncio.gather(*[client() for _ in range(concurrency)])
+                results[str(concurrency)] = {"outcome": recorder.outcome(), "elapsed": time.perf_counter() - started}
+    return {"levels": results, "statement_cost": statement_cost}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=20, help="products in the category")
+    parser.add_argument("--requests", type=int, default=1000, help="requests at every concurrency")
+    parser.add_argument("--concurrency", default="10,50", help="comma separated requests in flight")
+    parser.add_argument("--cache", action="store_true", help="keep the catalog cache on")
+    args = parser.parse_args()
+
+    workdir = create_database()
+    seed(workdir, users=1, products=args.products, stock=10)
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    category_id = con.execute("select id from categories").fetchone()[0]
+    con.close()
+
+    env = {} if args.cache else {"CATALOG_CACHE_MAX_BYTES": "0"}
+    levels = [int(level) for level in args.concurrency.split(",")]
+    (outcome,), _ = run_workers(_run, [(workdir, env, category_id, args.requests, levels)])
+
+    report = {"products": args.products, "cache": args.cache, "statement_cost": outcome["statement_cost"],
+              "concurrency": {level: summarize([result["outcome"]], result["elapsed"])
+                              for level, result in outcome["levels"].items()}}
+    print(json.dumps(report, indent=2))
+    failed = sum(count for level in report["concurrency"].values() for status, count in level["statuses"].items()
+                 if not status.endswith(" 200"))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
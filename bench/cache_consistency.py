@@ -0,0 +1,160 @@
+"""
+    Multi-worker cache consistency test: several worker processes, each running the app in-process against one shared
+    SQLite file with its own user and catalog caches, as uvicorn --workers does. The first worker is an admin that
+    changes a product's price and toggles another user's admin flag every --gap seconds, the others keep reading that
+    product and that user's admin check, both served from their caches. For every write it reports how long each
+    reader went on seeing the old value, and fails if any reader saw it for longer than CACHE_SYNC_INTERVAL plus
+    --slack, or never saw the new one.
+
+        python -m bench.cache_consistency --workers 4 --rounds 5
+        python -m bench.cache_consistency --backend memory  # per-process caches only, expected to fail
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from uuid import UUID
+
+from bench.harness import create_database, seed, load_app, auth_headers, run_workers
+
+READY, DONE = "reader-ready-", "admin-done"  # files in the scratch directory the workers signal each other with
+
+
+def _env(workdir: str, backend: str, interval: float) -> dict:
+    return {"CACHE_BACKEND": backend, "CACHE_BACKEND_PATH": os.path.join(workdir, "cache_invalidations.db"),
+            "CACHE_SYNC_INTERVAL": str(interval)}
+
+
+async def _admin(workdir: str, env: dict, product_id: str, admin_email: str, user_id: str, readers: int, rounds: int,
+                 gap: float) -> dict:
+    import httpx
+    app = load_app(workdir, env)
+    headers = auth_headers(admin_email)
+    writes = []
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as c:
+            product = (await c.get(f"/api/product/{product_id}")).json()
+            # the first write waits for every reader to have both values in its caches
+            while sum(name.startswith(READY) for name in os.listdir(".")) < readers:
+                await asyncio.sleep(0.1)
+            for i in range(1, rounds + 1):
+                price = 10.0 + i
+                before = time.time()
+                r = await c.put(f"/api/admin/product/update/{product_id}", headers=headers, json={
+                    "name": product["name"], "description": product["description"], "price": price,
+                    "stock": product["stock"], "category_id": product["category_id"]})
+                writes.append({"channel": "catalog", "value": price, "before": before, "at": time.time(),
+                               "status": r.status_code})
+                before = time.time()
+                r = await c.put(f"/api/admin/user/update_admin/{user_id}", headers=headers,
+                                params={"is_admin": i % 2 == 1})
+                writes.append({"channel": "user", "value": i % 2 == 1, "before": before, "at": time.time(),
+                               "status": r.status_code})
+                await asyncio.sleep(gap)
+    open(DONE, "w").close()
+    return {"writes": writes}
+
+
+async def _reader(workdir: str, env: dict, product_id: str, user_email: str, tail: float, poll: float) -> dict:
+    import httpx
+    app = load_app(workdir, env)
+    headers = auth_headers(user_email)
+    seen = {"catalog": [], "user": []}  # (time, value) whenever the value read differs from the one before
+
+    def observe(channel: str, value) -> None:
+        if not seen[channel] or seen[channel][-1][1] != value:
+            seen[channel].append((time.time(), value))
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as c:
+            until, ready = None, False
+            # reads on for `tail` seconds after the last write, anything not seen by then counts as never seen
+            while until is None or time.time() < until:
+                observe("catalog", (await c.get(f"/api/product/{product_id}")).json()["price"])
+                observe("user", (await c.get("/api/admin/is_user_admin", headers=headers)).status_code == 200)
+                if not ready:
+                    open(f"{READY}{os.getpid()}", "w").close()
+                    ready = True
+                if until is None and os.path.exists(DONE):
+                    until = time.time() + tail
+                await asyncio.sleep(poll)
+    return {"seen": seen}
+
+
+async def _worker(role: str, *args) -> dict:
+    return await (_admin if role == "admin" else _reader)(*args)
+
+
+def _staleness(write: dict, next_write: dict | None, seen: list) -> float | None:
+    """
+        Seconds from the write returning until the reader first read its value, None if the reader didn't before the
+        next write of the channel. Every write changes the value, so a change to it after the write started is the
+        write showing up, a read that raced the response counts as no staleness at all.
+    """
+    for at, value in seen:
+        if next_write is not None and at >= next_write["before"]:
+            break
+        if value == write["value"] and at >= write["before"]:
+            return max(at - write["at"], 0.0)
+    return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="processes in total, one of them the admin")
+    parser.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite")
+    parser.add_argument("--interval", type=float, default=0.5, help="CACHE_SYNC_INTERVAL of every worker")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--gap", type=float, default=2.0, help="seconds between two rounds of writes")
+    parser.add_argument("--poll", type=float, default=0.02, help="seconds between two reads of a reader")
+    parser.add_argument("--slack", type=float, default=0.5, help="allowed on top of the interval")
+    args = parser.parse_args()
+
+    workdir = create_database()
+    seeded = seed(workdir, users=2, products=1, stock=100)
+    product_id, (admin_email, user_email) = seeded["product_ids"][0], seeded["emails"]
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    with con:
+        con.execute("update users set is_admin = 1 where email = ?", (admin_email,))
+    user_id = str(UUID(con.execute("select id from users where email = ?", (user_email,)).fetchone()[0]))
+    con.close()
+
+    env = _env(workdir, args.backend, args.interval)
+    readers = args.workers - 1
+    outcomes, elapsed = run_workers(_worker, [
+        ("admin", workdir, env, product_id, admin_email, user_id, readers, args.rounds, args.gap),
+        *[("reader", workdir, env, product_id, user_email, 4 * args.interval + args.slack, args.poll)] * readers])
+
+    writes = next(outcome["writes"] for outcome in outcomes if "writes" in outcome)
+    seen = [outcome["seen"] for outcome in outcomes if "seen" in outcome]
+    bound = args.interval + args.slack
+    report = {"backend": args.backend, "workers": args.workers, "bound_seconds": bound, "seconds": round(elapsed, 2),
+              "failed_writes": [write for write in writes if write["status"] != 204], "channels": {}}
+    stale = 0
+    for channel in ("catalog", "user"):
+        delays, missed = [], 0
+        channel_writes = [write for write in writes if write["channel"] == channel]
+        for write, next_write in zip(channel_writes, channel_writes[1:] + [None]):
+            for reader_seen in seen:
+                delay = _staleness(write, next_write, reader_seen[channel])
+                if delay is None:
+                    missed += 1
+                else:
+                    delays.append(delay)
+        over = sum(delay > bound for delay in delays)
+        stale += missed + over
+        report["channels"][channel] = {"observations": len(delays) + missed, "never_seen": missed, "over_bound": over,
+                                       "max_seconds": round(max(delays, default=0), 3),
+                                       "mean_seconds": round(sum(delays) / len(delays), 3) if delays else None}
+    print(json.dumps(report, indent=2))
+    return 1 if stale or report["failed_writes"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+"""
+    Mixed read/write throughput with the untuned SQLite defaults (rollback journal, synchronous=FULL, no mmap, small
+    page cache, a new connection per session) against the db_setup defaults (WAL, synchronous=NORMAL, mmap, a bigger
+    cache and a connection pool). Every profile gets its own fresh database.
+
+        python -m bench.db_tuning --workers 4 --users 200 --iterations 20 --write-ratio 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+
+from bench.harness import create_database, seed, load_app, auth_headers, Recorder, run_workers, summarize
+
+PROFILES = {
+    "before": {"SQLITE_JOURNAL_MODE": "DELETE", "SQLITE_SYNCHRONOUS": "FULL", "SQLITE_MMAP_SIZE": "0",
+               "SQLITE_CACHE_SIZE": "-2000", "DB_POOL_SIZE": "0"},
+    "after": {},
+}
+
+
+async def _shoppers(workdir: str, env: dict, users: list[tuple[str, str]], iterations: int, write_ratio: float,
+                    concurrency: int) -> dict:
+    import httpx
+    app = load_app(workdir, env)
+    recorder = Recorder()
+    in_flight = asyncio.Semaphore(concurrency)
+    rng = random.Random(len(users))
+
+    async def shop(c, email, cart_item_id):
+        headers = auth_headers(email)
+        for _ in range(iterations):
+            async with in_flight:
+                if rng.random() < write_ratio:
+                    await recorder.request(c, "PUT", f"/api/cart/update_cart_item/{cart_item_id}",
+                                           label="update_cart_item", params={"quantity": rng.randint(1, 3)},
+                                           headers=headers)
+                elif rng.random() < 0.5:
+                    await recorder.request(c, "GET", "/api/cart/get_cart_items", headers=headers)
+                else:
+                    await recorder.request(c, "GET", "/api/order/all", headers=headers)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            await asyncio.gather(*(shop(c, email, cart_item_id) for email, cart_item_id in users))
+    return recorder.outcome()
+
+
+def run_profile(env: dict, args) -> dict:
+    workdir = create_database(env)
+    seeded = seed(workdir, users=args.users, products=args.products, stock=1_000_000, cart_items=True)
+    users = list(zip(seeded["emails"], seeded["cart_item_ids"]))
+    outcomes, elapsed = run_workers(_shoppers, [(workdir, env, users[i::args.workers], args.iterations,
+                                                 args.write_ratio, args.concurrency) for i in range(args.workers)])
+    return summarize(outcomes, elapsed)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=200, help="shoppers in total, split across the workers")
+    parser.add_argument("--products", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=20, help="requests per shopper")
+    parser.add_argument("--write-ratio", type=float, default=0.2)
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight per worker")
+    parser.add_argument("--profile", choices=sorted(PROFILES), action="append",
+                        help="run only these profiles (default: all)")
+    args = parser.parse_args()
+
+    report = {name: run_profile(PROFILES[name], args) for name in args.profile or PROFILES}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+    Export memory check: fills a scratch database with --rows products, then streams /api/product/export through the
+    app and reports rows/s and the worker's resident memory along the export. The response is consumed by calling the
+    ASGI app directly and dropping every chunk on arrival, httpx's ASGI transport would hold the whole body in memory
+    and measure itself. Anonymous memory (the heap: rows, encoded chunks) is reported apart from file-backed memory,
+    which is the database file SQLite maps in and is capped by SQLITE_MMAP_SIZE rather than by the export. Fails if
+    the anonymous peak grows by more than --max-growth-mb over what the worker had before the export started.
+
+        python -m bench.export_memory --rows 5000000
+        python -m bench.export_memory --rows 1000000 --format csv --gzip
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from bench.harness import create_database, load_app, run_workers
+
+INSERT_BATCH = 50_000
+SAMPLES = 10  # resident memory readings reported along the export
+
+
+def _rss_mb() -> tuple[float, float]:
+    """(anonymous, file-backed) resident memory of this process."""
+    with open("/proc/self/status") as status:
+        fields = dict(line.split(":", 1) for line in status)
+    return int(fields["RssAnon"].split()[0]) / 1024, int(fields["RssFile"].split()[0]) / 1024
+
+
+def _product_id() -> str:
+    # the id column is declared UUID, which SQLite gives NUMERIC affinity: a hex id of digits and one "e" is stored as
+    # a number, and with a large exponent as Inf, so a few million random ids collide. A leading letter keeps it text.
+    return "a" + uuid4().hex[1:]
+
+
+def _fill(workdir: str, rows: int) -> None:
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    con.execute("PRAGMA synchronous = OFF")
+    category_id = uuid4().hex
+    started = datetime.now() - timedelta(seconds=rows)
+    with con:
+        con.execute("insert into categories (id, name, description) values (?, ?, ?)",
+                    (category_id, "Export", "Export bench category"))
+        for first in range(0, rows, INSERT_BATCH):
+            timestamps = [(started + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S.%f")
+                          for i in range(first, min(first + INSERT_BATCH, rows))]
+            con.executemany("insert into products (id, name, description, price, stock, category_id, created_at, "
+                            "updated_at) values (?, ?, ?, ?, ?, ?, ?, ?)",
+                            [(_product_id(), f"Export item {first + i}", "Seeded for the export bench",
+                              round(1 + (first + i) % 1000 / 10, 2), 10, category_id, timestamp, timestamp)
+                             for i, timestamp in enumerate(timestamps)])
+    con.close()
+
+
+async def _export(workdir: str, rows: int, file_format: str, gzip: bool) -> dict:
+    app = load_app(workdir)
+    headers = [(b"host", b"bench")] + ([(b"accept-encoding", b"gzip")] if gzip else [])
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/api/product/export", "raw_path": b"/api/product/export", "root_path": "",
+             "query_string": f"format={file_format}".encode(), "headers": headers,
+             "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+    progress = {"status": None, "bytes": 0, "lines": 0, "samples": [], "peak_anon": 0.0, "peak_file": 0.0}
+    sample_every = max(rows // SAMPLES, 1)
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()  # the client never disconnects
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            progress["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            body = message.get("body", b"")
+            progress["bytes"] += len(body)
+            before = progress["lines"]
+            progress["lines"] += body.count(b"\n")
+            anon, file = _rss_mb()
+            progress["peak_anon"], progress["peak_file"] = max(progress["peak_anon"], anon), \
+                max(progress["peak_file"], file)
+            if not gzip and progress["lines"] // sample_every > before // sample_every:
+                progress["samples"].append({"rows": progress["lines"], "anon_mb": round(anon, 1),
+                                            "file_mb": round(file, 1)})
+
+    async with app.router.lifespan_context(app):
+        anon_before, file_before = _rss_mb()
+        started = time.perf_counter()
+        await app(scope, receive, send)
+        elapsed = time.perf_counter() - started
+    return {"status": progress["status"], "seconds": elapsed, "bytes": progress["bytes"], "lines": progress["lines"],
+            "anon_before_mb": anon_before, "file_before_mb": file_before, "peak_anon_mb": progress["peak_anon"],
+            "peak_file_mb": progress["peak_file"], "samples": progress["samples"],
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}  # kilobytes on Linux
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5_000_000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="ask for a gzip response (rows are then not counted)")
+    parser.add_argument("--max-growth-mb", type=float, default=100.0)
+    args = parser.parse_args()
+
+    workdir = create_database()
+    started = time.perf_counter()
+    _fill(workdir, args.rows)
+    fill_seconds = time.perf_counter() - started
+
+    (outcome,), _ = run_workers(_export, [(workdir, args.rows, args.format, args.gzip)])
+    rows = args.rows if args.gzip else outcome["lines"] - (args.format == "csv")
+    growth = max(outcome["peak_anon_mb"] - outcome["anon_before_mb"], 0.0)
+    report = {"rows": args.rows, "format": args.format, "gzip": args.gzip, "status": outcome["status"],
+              "fill_seconds": round(fill_seconds, 1), "export_seconds": round(outcome["seconds"], 1),
+              "rows_exported": rows, "rows_per_s": round(rows / outcome["seconds"]),
+              "mb_per_s": round(outcome["bytes"] / 2 ** 20 / outcome["seconds"], 1),
+              "anon_before_mb": round(outcome["anon_before_mb"], 1), "peak_anon_mb": round(outcome["peak_anon_mb"], 1),
+              "anon_growth_mb": round(growth, 1), "file_before_mb": round(outcome["file_before_mb"], 1),
+              "peak_file_mb": round(outcome["peak_file_mb"], 1), "peak_rss_mb": round(outcome["peak_rss_mb"], 1),
+              "samples": outcome["samples"]}
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if outcome["status"] != 200:
+        failures.append(f"export returned {outcome['status']}")
+    if rows != args.rows:
+        failures.append(f"{rows} of {args.rows} rows exported")
+    if growth > args.max_growth_mb:
+        failures.append(f"anonymous memory grew by {growth:.1f} MB during the export, over {args.max_growth_mb} MB")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""Shared plumbing for the load tests: scratch databases, seeded rows and worker processes running the app."""
+import asyncio
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(workdir: str, env: dict | None = None):
+    # the app opens ./ecom2.db and reads its settings at import, so both are set before importing it. Every virtual
+    # user connects from the same address, so the per-client rate limits are off unless a bench turns them on
+    os.environ.update({"LOG_STDERR": "0", "RATE_LIMIT_ENABLED": "0", **(env or {})})
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    from main import app
+    return app
+
+
+def auth_headers(email: str) -> dict:
+    from src.utils.jwt_handler import get_jwt_token
+    return {"Authorization": f"Bearer {get_jwt_token(data={'sub': email})}"}
+
+
+def _create_schema(workdir: str, env: dict | None) -> None:
+    app = load_app(workdir, env)
+
+    async def run_lifespan():
+        async with app.router.lifespan_context(app):
+            pass
+
+    asyncio.run(run_lifespan())
+
+
+def create_database(env: dict | None = None) -> str:
+    """Create the schema in a fresh scratch directory, from a child process so this one never imports the app."""
+    workdir = tempfile.mkdtemp(prefix="ecom-bench-")
+    process = multiprocessing.get_context("spawn").Process(target=_create_schema, args=(workdir, env))
+    process.start()
+    process.join()
+    if process.exitcode:
+        raise RuntimeError(f"creating the database in {workdir} failed")
+    return workdir
+
+
+def seed(workdir: str, users: int, products: int, stock: int, cart_items: bool = False) -> dict:
+    """
+        Insert a category, `products` products and `users` users straight into the scratch database.
+        With cart_items every user also gets a cart holding one unit of one of the products.
+    """
+    from src.utils.password_handler import hash_password
+    password = hash_password("bench-password")
+    category_id = uuid4()
+    product_ids = [uuid4() for _ in range(products)]
+    user_ids = [uuid4() for _ in range(users)]
+    emails = [f"buyer{i}@example.com" for i in range(users)]
+    # distinct timestamps written the way SQLAlchemy stores a DateTime on SQLite, so created_at orders like real rows
+    started = datetime.now() - timedelta(seconds=max(products, users))
+    timestamps = [(started + timedelta(seconds=i, microseconds=i)).strftime("%Y-%m-%d %H:%M:%S.%f")
+                  for i in range(max(products, users))]
+
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    with con:
+        con.execute("insert into categories (id, name, description) values (?, ?, ?)",
+                    (category_id.hex, "Bench", "Load test category"))
+        con.executemany("insert into products (id, name, description, price, stock, category_id, created_at, "
+                        "updated_at) values (?, ?, ?, ?, ?, ?, ?, ?)",
+                        [(product_id.hex, f"Bench item {i}", "Seeded for a load test", 9.99, stock, category_id.hex,
+                          timestamps[i], timestamps[i]) for i, product_id in enumerate(product_ids)])
+        con.executemany("insert into users (id, username, email, password, is_admin, created_at, updated_at) "
+                        "values (?, ?, ?, ?, 0, ?, ?)",
+                        [(user_id.hex, email.split("@")[0], email, password, timestamps[i], timestamps[i])
+                         for i, (user_id, email) in enumerate(zip(user_ids, emails))])
+        cart_item_ids = []
+        if cart_items:
+            carts = [(uuid4(), user_id) for user_id in user_ids]
+            cart_item_ids = [uuid4() for _ in carts]
+            con.executemany("insert into carts (id, user_id) values (?, ?)",
+                            [(cart_id.hex, user_id.hex) for cart_id, user_id in carts])
+            con.executemany("insert into cart_items (id, cart_id, product_id, quantity) values (?, ?, ?, 1)",
+                            [(cart_item_id.hex, cart_id.hex, product_ids[i % products].hex)
+                             for i, (cart_item_id, (cart_id, _)) in enumerate(zip(cart_item_ids, carts))])
+    con.close()
+    return {"product_ids": [str(product_id) for product_id in product_ids], "emails": emails,
+            "cart_item_ids": [str(cart_item_id) for cart_item_id in cart_item_ids]}
+
+
+class Recorder:
+    """Latency and status counts of every request a worker sends."""
+
+    def __init__(self):
+        self.statuses = Counter()
+        self.latencies = []
+        self.routes: dict[str, list[float]] = defaultdict(list)
+
+    async def request(self, c, method: str, url: str, label: str | None = None, **kwargs):
+        label = label or url.split("?")[0].split("/")[-1]
+        started = time.perf_counter()
+        r = await c.request(method, url, **kwargs)
+        latency = time.perf_counter() - started
+        self.latencies.append(latency)
+        self.routes[label].append(latency)
+        self.statuses[f"{label} {r.status_code}"] += 1
+        return r
+
+    def outcome(self) -> dict:
+        return {"statuses": dict(self.statuses), "latencies": self.latencies, "routes": dict(self.routes)}
+
+
+def _worker(target, args: tuple, barrier, results) -> None:
+    barrier.wait()
+    try:
+        results.put(asyncio.run(target(*args)))
+    except BaseException as e:
+        results.put({"error": repr(e)})
+        raise
+
+
+def run_workers(target, worker_args: list[tuple]) -> tuple[list[dict], float]:
+    """Run `target(*args)` in one spawned process per entry of worker_args, all released at once."""
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(len(worker_args) + 1)
+    results = ctx.Queue()
+    workers = [ctx.Process(target=_worker, args=(target, args, barrier, results)) for args in worker_args]
+    for worker in workers:
+        worker.start()
+    barrier.wait()
+    started = time.perf_counter()
+    outcomes = [results.get() for _ in workers]
+    elapsed = time.perf_counter() - started
+    for worker in workers:
+        worker.join()
+
+    errors = [outcome["error"] for outcome in outcomes if "error" in outcome]
+    if errors:
+        raise RuntimeError(f"workers crashed: {errors}")
+    return outcomes, elapsed
+
+
+def summarize(outcomes: list[dict], elapsed: float) -> dict:
+    statuses = Counter()
+    for outcome in outcomes:
+        statuses.update(outcome["statuses"])
+    return {**_latency_summary([latency for outcome in outcomes for latency in outcome["latencies"]], elapsed),
+            "statuses": dict(sorted(statuses.items()))}
+
+
+def summarize_routes(outcomes: list[dict], elapsed: float) -> dict:
+    """Throughput and latency percentiles per request label."""
+    routes = defaultdict(list)
+    for outcome in outcomes:
+        for label, latencies in outcome["routes"].items():
+            routes[label].extend(latencies)
+    return {label: _latency_summary(latencies, elapsed) for label, latencies in sorted(routes.items())}
+
+
+def _latency_summary(latencies: list[float], elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    if not latencies:
+        return {"requests": 0, "seconds": round(elapsed, 3)}
+
+    def percentile(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 1)
+
+    return {"requests": len(latencies), "seconds": round(elapsed, 3), "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": percentile(0.50), "p95_ms": percentile(0.95), "p99_ms": percentile(0.99)}
@@ -0,0 +1,111 @@
+"""
+    Retry storm against the idempotent writes: every virtual user adds a cart item and checks out, and every request
+    is sent --retries extra times at once, as a mobile client does after a timeout. Run once without and once with
+    an Idempotency-Key per logical request, reporting the SQL statements sent, the statuses and what ended up in the
+    carts and orders. Each mode gets its own fresh database. With --workers every worker process sends all the
+    requests with the same keys, as retries landing on different uvicorn workers do, and the keys are shared through
+    IDEMPOTENCY_BACKEND=sqlite: units_ordered has to stay at one per user.
+
+        python -m bench.idempotency --users 20 --retries 3
+        python -m bench.idempotency --users 20 --retries 1 --workers 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import Counter
+
+from bench.harness import create_database, seed, load_app, auth_headers, run_workers
+
+
+async def _storm(workdir: str, env: dict, emails: list[str], product_ids: list[str], retries: int,
+                 with_keys: bool) -> dict:
+    import httpx
+    from sqlalchemy import event
+    app = load_app(workdir, env)
+    from src.config.db_setup import engine
+
+    statements = Counter()
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements[statement.split(None, 1)[0].upper()] += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count)
+    statuses = Counter()
+
+    async def send_with_retries(c, label: str, i: int, url: str, headers: dict, **kwargs):
+        if with_keys:
+            # one key per logical request, the same in every worker process
+            headers = {**headers, "Idempotency-Key": f"{label}-{i}"}
+        for r in await asyncio.gather(*(c.post(url, headers=headers, **kwargs) for _ in range(retries + 1))):
+            statuses[f"{label} {r.status_code}{' replayed' if 'idempotent-replayed' in r.headers else ''}"] += 1
+
+    async def shopper(c, i: int):
+        headers = auth_headers(emails[i])
+        await send_with_retries(c, "add_cart_item", i, "/api/cart/add_cart_item", headers,
+                                json={"product_id": product_ids[i % len(product_ids)], "quantity": 1})
+        await send_with_retries(c, "create_order", i, "/api/order/create_order", headers)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as c:
+            started = time.perf_counter()
+            await asyncio.gather(*(shopper(c, i) for i in range(len(emails))))
+            elapsed = time.perf_counter() - started
+    return {"seconds": elapsed, "statements": statements, "statuses": statuses}
+
+
+def _run_mode(args, with_keys: bool) -> dict:
+    env = {"IDEMPOTENCY_BACKEND": "sqlite" if args.workers > 1 else "memory"}
+    workdir = create_database(env)
+    env["IDEMPOTENCY_BACKEND_PATH"] = os.path.join(workdir, "idempotency_keys.db")
+    seeded = seed(workdir, users=args.users, products=args.products, stock=1_000_000, cart_items=True)
+    storm_args = (workdir, env, seeded["emails"], seeded["product_ids"], args.retries, with_keys)
+    if args.workers > 1:
+        outcomes, _ = run_workers(_storm, [storm_args] * args.workers)
+    else:
+        outcomes = [asyncio.run(_storm(*storm_args))]
+
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    ordered = con.execute("select count(*), coalesce(sum(quantity), 0) from order_items").fetchone()
+    con.close()
+    statements, statuses = Counter(), Counter()
+    for outcome in outcomes:
+        statements.update(outcome["statements"])
+        statuses.update(outcome["statuses"])
+    return {"seconds": round(max(outcome["seconds"] for outcome in outcomes), 2), "statements": dict(statements),
+            "statuses": dict(sorted(statuses.items())), "order_lines": ordered[0], "units_ordered": ordered[1]}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--products", type=int, default=20)
+    parser.add_argument("--retries", type=int, default=3, help="extra copies of every request")
+    parser.add_argument("--workers", type=int, default=1, help="processes that each send every request")
+    parser.add_argument("--mode", choices=["without_keys", "with_keys"], action="append",
+                        help="run only these modes (default: both), each needs a process of its own")
+    args = parser.parse_args()
+
+    modes = args.mode or ["without_keys", "with_keys"]
+    if len(modes) > 1:
+        # the app is imported once per process, so every mode runs in a child of its own
+        import subprocess
+        report = {}
+        for mode in modes:
+            output = subprocess.run([sys.executable, "-m", "bench.idempotency", "--mode", mode, "--users",
+                                     str(args.users), "--products", str(args.products), "--retries",
+                                     str(args.retries), "--workers", str(args.workers)],
+                                    capture_output=True, text=True, check=True).stdout
+            report.update(json.loads(output))
+    else:
+        report = {modes[0]: _run_mode(args, modes[0] == "with_keys")}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+    Logging overhead per request: the same catalog-heavy mix with no sinks at all, the old synchronous plain text file
+    sink, the enqueued JSON sink logging every request and the enqueued JSON sink with the default per-route sampling.
+    Every profile gets its own fresh database, overhead_us is the extra time per request over the "none" profile.
+
+        python -m bench.logging_overhead --users 50 --iterations 100
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import sqlite3
+import sys
+
+from bench.harness import create_database, seed, load_app, auth_headers, Recorder, run_workers, summarize
+
+PROFILES = {
+    "none": {"LOG_FILE": ""},
+    "sync text": {"LOG_ENQUEUE": "0", "LOG_JSON": "0", "LOG_SAMPLE_RATES": ""},
+    "enqueued json": {"LOG_SAMPLE_RATES": ""},
+    "enqueued json sampled": {},
+}
+
+
+async def _browsers(workdir: str, env: dict, emails: list[str], product_ids: list[str], iterations: int,
+                    concurrency: int) -> dict:
+    import httpx
+    app = load_app(workdir, {"LOG_ROTATION": "1 GB", **env})
+    recorder = Recorder()
+    in_flight = asyncio.Semaphore(concurrency)
+    rng = random.Random(len(emails))
+
+    async def browse(c, email):
+        headers = auth_headers(email)
+        for _ in range(iterations):
+            async with in_flight:
+                roll = rng.random()
+                if roll < 0.4:
+                    await recorder.request(c, "GET", f"/api/product/{rng.choice(product_ids)}", label="product")
+                elif roll < 0.6:
+                    await recorder.request(c, "GET", "/api/product/all", params={"limit": 20,
+                                                                                "min_price": rng.randint(0, 5)})
+                elif roll < 0.7:
+                    await recorder.request(c, "GET", "/api/category/all")
+                elif roll < 0.9:
+                    await recorder.request(c, "GET", "/api/cart/get_cart_items", headers=headers)
+                else:
+                    await recorder.request(c, "GET", "/api/admin/is_user_admin", headers=headers)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            await asyncio.gather(*(browse(c, email) for email in emails))
+    return recorder.outcome()
+
+
+def _log_bytes(workdir: str) -> int:
+    return sum(os.path.getsize(path) for path in glob.glob(os.path.join(workdir, "app.log*")))
+
+
+def run_profile(env: dict, args) -> dict:
+    workdir = create_database(env)
+    seeded = seed(workdir, users=args.users, products=args.products, stock=100, cart_items=True)
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    with con:
+        con.execute("update users set is_admin = 1")
+    con.close()
+
+    logged_before = _log_bytes(workdir)
+    emails = seeded["emails"]
+    outcomes, elapsed = run_workers(_browsers, [(workdir, env, emails[i::args.workers], seeded["product_ids"],
+                                                 args.iterations, args.concurrency) for i in range(args.workers)])
+    return {**summarize(outcomes, elapsed), "log_bytes": _log_bytes(workdir) - logged_before}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50, help="browsers in total, split across the workers")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=100, help="requests per browser")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight per worker")
+    parser.add_argument("--profile", choices=sorted(PROFILES), action="append",
+                        help="run only these profiles (default: all)")
+    args = parser.parse_args()
+
+    report = {name: run_profile(PROFILES[name], args) for name in args.profile or PROFILES}
+    baseline = report.get("none")
+    for result in report.values():
+        if baseline and result.get("requests"):
+            result["overhead_us"] = round((result["seconds"] / result["requests"]
+                                           - baseline["seconds"] / baseline["requests"]) * 1e6, 1)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
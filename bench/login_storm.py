@@ -0,0 +1,75 @@
+"""
+    Login storm: one client reads GET /api/product/{id} back to back for --seconds on its own, then for --seconds more
+    while --logins clients log in back to back (bcrypt on every request), all in one process on one event loop. Reports
+    the reader's latency in both phases and the logins served, so a slow hash blocking the loop shows up as the
+    reader's storm latency climbing to a whole hash per request.
+
+        python -m bench.login_storm --logins 4 --seconds 10
+        python -m bench.login_storm --executor process
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from bench.harness import create_database, seed, load_app, Recorder, run_workers, summarize
+
+
+async def _storm(workdir: str, env: dict, product_id: str, emails: list[str], logins: int, seconds: float) -> dict:
+    import httpx
+    app = load_app(workdir, env)
+    phases = {}
+
+    async def read(c, recorder: Recorder, until: float):
+        while time.perf_counter() < until:
+            await recorder.request(c, "GET", f"/api/product/{product_id}", label="GET /api/product/{product_id}")
+
+    async def log_in(c, recorder: Recorder, email: str, until: float):
+        while time.perf_counter() < until:
+            await recorder.request(c, "POST", "/api/auth/login", label="POST /api/auth/login",
+                                   data={"username": email, "password": "bench-password"})
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as c:
+            reader = Recorder()
+            started = time.perf_counter()
+            await read(c, reader, started + seconds)
+            phases["idle"] = {"reader": reader.outcome(), "elapsed": time.perf_counter() - started}
+
+            reader, storm = Recorder(), Recorder()
+            started = time.perf_counter()
+            until = started + seconds
+            await asyncio.gather(read(c, reader, until),
+                                 *[log_in(c, storm, emails[i % len(emails)], until) for i in range(logins)])
+            elapsed = time.perf_counter() - started
+            phases["storm"] = {"reader": reader.outcome(), "logins": storm.outcome(), "elapsed": elapsed}
+    return phases
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=4, help="clients logging in back to back during the storm")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of each phase")
+    parser.add_argument("--executor", choices=["thread", "process"], default="thread",
+                        help="PASSWORD_HASH_EXECUTOR")
+    parser.add_argument("--workers", type=int, default=4, help="PASSWORD_HASH_WORKERS")
+    args = parser.parse_args()
+
+    workdir = create_database()
+    seeded = seed(workdir, users=args.logins, products=1, stock=10)
+    env = {"PASSWORD_HASH_EXECUTOR": args.executor, "PASSWORD_HASH_WORKERS": str(args.workers)}
+    (phases,), _ = run_workers(_storm, [(workdir, env, seeded["product_ids"][0], seeded["emails"], args.logins,
+                                         args.seconds)])
+
+    report = {"executor": args.executor, "hash_workers": args.workers, "logins": args.logins,
+              "idle_reader": summarize([phases["idle"]["reader"]], phases["idle"]["elapsed"]),
+              "storm_reader": summarize([phases["storm"]["reader"]], phases["storm"]["elapsed"]),
+              "storm_logins": summarize([phases["storm"]["logins"]], phases["storm"]["elapsed"])}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""
+    Metrics overhead per request: the logging_overhead browsing mix with the metrics middleware and engine events
+    turned off and on, logging off in both so only the metrics differ. Every profile gets its own fresh database.
+
+        python -m bench.metrics_overhead --users 50 --iterations 100
+"""
+import argparse
+import json
+import sys
+
+from bench.logging_overhead import run_profile
+
+PROFILES = {
+    "off": {"LOG_FILE": "", "METRICS_ENABLED": "0"},
+    "on": {"LOG_FILE": ""},
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50, help="browsers in total, split across the workers")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=100, help="requests per browser")
+    parser.add_argument("--concurrency", type=int, default=16, help="requests in flight per worker")
+    parser.add_argument("--rounds", type=int, default=3, help="runs of every profile, the fastest one is reported")
+    args = parser.parse_args()
+
+    report = {name: max((run_profile(env, args) for _ in range(args.rounds)), key=lambda result: result["rps"])
+              for name, env in PROFILES.items()}
+    report["on"]["overhead_us"] = round((report["on"]["seconds"] / report["on"]["requests"]
+                                         - report["off"]["seconds"] / report["off"]["requests"]) * 1e6, 1)
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+    Keyset pagination check: pages /api/product/all through to the end in every sort order, both directions, and fails
+    unless every product comes back exactly once and in order. Every product gets the same created_at second, half of
+    them without microseconds as raw SQL writes them, and the database is rewound to before the migration that
+    normalises those, so the check covers a database upgraded from an older version too. The products also share one
+    price, the id breaks both ties.
+
+        python -m bench.pagination --products 100 --limit 7
+"""
+import argparse
+import os
+import sqlite3
+import sys
+
+from bench.harness import create_database, seed, load_app, run_workers
+
+SORTS = [(sort_by, order) for sort_by in ("created_at", "price", "name") for order in ("asc", "desc")]
+NORMALISE_MIGRATION = 5
+
+
+async def _page_through(workdir: str, limit: int, products: int) -> dict:
+    import httpx
+    app = load_app(workdir)
+
+    pages = {}
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            for sort_by, order in SORTS:
+                items, cursor = [], None
+                while True:
+                    params = {"sort_by": sort_by, "order": order, "limit": limit}
+                    if cursor is not None:
+                        params["cursor"] = cursor
+                    r = await c.get("/api/product/all", params=params)
+                    if r.status_code != 200:
+                        items.append({"error": f"{r.status_code} {r.text}"})
+                        break
+                    page = r.json()
+                    items.extend(page["items"])
+                    cursor = page["next_cursor"]
+                    if cursor is None:
+                        break
+                    if len(items) > products:
+                        items.append({"error": "pagination doesn't end, a cursor keeps returning rows already seen"})
+                        break
+                pages[f"{sort_by} {order}"] = items
+    return pages
+
+
+def _check(name: str, items: list[dict], product_ids: set[str]) -> list[str]:
+    errors = [item["error"] for item in items if "error" in item]
+    if errors:
+        return [f"{name}: {error}" for error in errors]
+
+    sort_by, order = name.split()
+    failures = []
+    ids = [item["id"] for item in items]
+    if len(ids) != len(set(ids)):
+        failures.append(f"{name}: {len(ids) - len(set(ids))} products returned more than once")
+    if set(ids) != product_ids:
+        failures.append(f"{name}: {len(product_ids - set(ids))} of {len(product_ids)} products never returned")
+    keys = [(item[sort_by], item["id"].replace("-", "")) for item in items]
+    if keys != sorted(keys, reverse=order == "desc"):
+        failures.append(f"{name}: products out of order")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100)
+    parser.add_argument("--limit", type=int, default=7, help="page size, small enough for many pages")
+    args = parser.parse_args()
+
+    workdir = create_database()
+    seeded = seed(workdir, users=1, products=args.products, stock=10)
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    with con:
+        con.execute("update products set created_at = '2025-01-01 12:00:00' || "
+                    "case when rowid % 2 = 0 then '' else '.000000' end")
+        con.execute("delete from schema_migrations where version >= ?", (NORMALISE_MIGRATION,))
+    con.close()
+
+    (pages,), _ = run_workers(_page_through, [(workdir, args.limit, args.products)])
+    product_ids = set(seeded["product_ids"])
+    failures = []
+    for name, items in pages.items():
+        failures.extend(_check(name, items, product_ids))
+        print(f"{name}: {len(items)} of {len(product_ids)} products")
+
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
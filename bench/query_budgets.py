@@ -0,0 +1,111 @@
+"""
+    Query-budget check: every route has to declare a budget with @query_budget, and the query-plan tour is driven
+    with QUERY_BUDGET_MODE=raise so any request sending more statements than its route allows, or repeating one
+    statement more often than allowed, fails the run. The tour runs again with --scale times the categories: every
+    category read has to send as many statements as before, whatever the number of categories, and may only read
+    the columns in CATEGORY_READ_COLUMNS.
+
+        python -m bench.query_budgets
+"""
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+
+from bench.harness import load_app, run_workers
+from bench.query_plans import prepare_database, tour, walk_tour
+
+CATEGORY_READS = {"category all", "category all with counts", "category by id", "category export",
+                  "admin categories", "admin categories with counts", "admin category by id"}
+# the category projections plus what with_counts aggregates, no category read loads whole products
+CATEGORY_READ_COLUMNS = {("categories", "id"), ("categories", "name"), ("categories", "description"),
+                         ("products", "id"), ("products", "stock"), ("products", "category_id")}
+COLUMN_REFERENCE = re.compile(r"\b(categories|products)\.(\w+)")
+
+
+async def _budget_tour(workdir: str, product_ids: list[str], category_id: str, emails: list[str],
+                       cart_item_ids: list[str]) -> dict:
+    import httpx
+    from fastapi.routing import APIRoute
+    from sqlalchemy import event
+    # every request pays for the user lookup, as it does on a cold token cache
+    app = load_app(workdir, {"QUERY_BUDGET_MODE": "raise", "USER_CACHE_TTL": "0"})
+    from src.config.db_setup import engine, read_engine
+
+    undeclared = [f"{','.join(sorted(route.methods))} {route.path}" for route in app.routes
+                  if isinstance(route, APIRoute) and not hasattr(route.endpoint, "query_budget")]
+
+    step = None
+    counts: dict[str, Counter] = {}
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        if step is not None:
+            counts[step][statement] += 1
+
+    for instrumented in {engine, read_engine}:
+        event.listen(instrumented.sync_engine, "before_cursor_execute", count)
+
+    def on_step(name):
+        nonlocal step
+        step = name
+        if name is not None:
+            counts[name] = Counter()
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            failures = await walk_tour(c, tour(product_ids, category_id, cart_item_ids), emails, on_step)
+    return {"undeclared": undeclared, "failures": failures,
+            "steps": {name: {"statements": step_counts.total(), "most_repeated": max(step_counts.values(), default=0),
+                             "columns": sorted({column for statement in step_counts
+                                                for column in COLUMN_REFERENCE.findall(statement)})}
+                      for name, step_counts in counts.items()}}
+
+
+def _run_tour(products: int, categories: int) -> dict:
+    workdir, seeded, category_id = prepare_database(products, categories)
+    (outcome,), _ = run_workers(_budget_tour, [(workdir, seeded["product_ids"], category_id, seeded["emails"],
+                                                seeded["cart_item_ids"])])
+    return outcome
+
+
+def _category_failures(outcome: dict, scaled: dict, scale: int) -> list[str]:
+    failures = []
+    for name in sorted(CATEGORY_READS):
+        statements, scaled_statements = outcome["steps"][name]["statements"], scaled["steps"][name]["statements"]
+        if statements != scaled_statements:
+            failures.append(f"{name}: {statements} statements, {scaled_statements} with {scale}x the categories")
+        extra = {tuple(column) for column in outcome["steps"][name]["columns"]} - CATEGORY_READ_COLUMNS
+        if extra:
+            failures.append(f"{name}: reads {', '.join(f'{table}.{column}' for table, column in sorted(extra))}")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--categories", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=10, help="categories of the second tour, times --categories")
+    parser.add_argument("--verbose", action="store_true", help="print the statement counts of every step")
+    args = parser.parse_args()
+
+    outcome = _run_tour(args.products, args.categories)
+    scaled = _run_tour(args.products, args.categories * args.scale)
+    category_failures = _category_failures(outcome, scaled, args.scale)
+    if args.verbose:
+        print(json.dumps(outcome["steps"], indent=2))
+    print(f"{len(outcome['steps'])} requests checked, {len(outcome['failures'])} failed, "
+          f"{len(outcome['undeclared'])} routes without a budget")
+    print(f"{len(CATEGORY_READS)} category reads checked against {args.categories} and "
+          f"{args.categories * args.scale} categories, {len(category_failures)} failed")
+
+    for route in outcome["undeclared"]:
+        print(f"FAIL: {route} declares no query budget", file=sys.stderr)
+    for failure in outcome["failures"] + scaled["failures"] + category_failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if outcome["failures"] or scaled["failures"] or outcome["undeclared"] or category_failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,199 @@
+"""
+    Query-plan regression check: drives every router through a seeded database, runs EXPLAIN QUERY PLAN on each
+    distinct statement the app sent and fails when one of them scans a whole table that isn't in ALLOWED_SCANS.
+
+        python -m bench.query_plans
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import sys
+from uuid import UUID, uuid4
+
+from bench.harness import create_database, seed, load_app, auth_headers, run_workers
+
+# step -> tables it may read in full, everything else has to go through an index
+ALLOWED_SCANS = {
+    "category all": {"categories"},  # lists every category
+    "category all with counts": {"categories"},
+    "admin categories": {"categories"},
+    "admin categories with counts": {"categories"},
+    "product export": {"products"},  # exports stream whole tables
+    "category export": {"categories"},
+    "order export": {"orders"},
+    "admin import products": {"categories"},  # loads every category once to resolve the rows' category names
+}
+FULL_SCAN = re.compile(r"^SCAN (\w+)(?: LEFT-JOIN)?$")
+
+
+def tour(product_ids: list[str], category_id: str, cart_item_ids: list[str]) -> list[tuple]:
+    """(step, user index, method, url, request kwargs). User 0 is the admin, the others are shoppers."""
+    first, second, third = product_ids[:3]
+    return [
+        ("login", None, "POST", "/api/auth/login",
+         {"data": {"username": "buyer1@example.com", "password": "bench-password"}}),
+        ("register", None, "POST", "/api/auth/register",
+         {"json": {"username": "newcomer", "email": "newcomer@example.com", "password": "secret1"}}),
+        ("me", 1, "GET", "/api/user/me", {}),
+        ("product all", None, "GET", "/api/product/all", {"params": {"limit": 5}}),
+        ("product all by category", None, "GET", "/api/product/all",
+         {"params": {"category_id": category_id, "limit": 5}}),
+        ("product all by price", None, "GET", "/api/product/all",
+         {"params": {"sort_by": "price", "order": "desc", "min_price": 1, "max_price": 100, "in_stock": True}}),
+        ("product all by category and name", None, "GET", "/api/product/all",
+         {"params": {"category_id": category_id, "sort_by": "name"}}),
+        ("product search", None, "GET", "/api/product/search", {"params": {"q": "bench it"}}),
+        ("product by id", None, "GET", f"/api/product/{first}", {}),
+        ("category all", None, "GET", "/api/category/all", {}),
+        ("category all with counts", None, "GET", "/api/category/all", {"params": {"with_counts": True}}),
+        ("category by id", None, "GET", f"/api/category/{category_id}", {"params": {"with_counts": True}}),
+        ("get cart", 1, "GET", "/api/cart/get_cart", {}),
+        ("get cart items", 1, "GET", "/api/cart/get_cart_items", {}),
+        ("update cart item", 1, "PUT", f"/api/cart/update_cart_item/{cart_item_ids[1]}", {"params": {"quantity": 2}}),
+        ("add cart item", 1, "POST", "/api/cart/add_cart_item", {"json": {"product_id": second, "quantity": 1}}),
+        ("batch cart items", 1, "POST", "/api/cart/batch_cart_items", {"json": {"operations": [
+            {"op": "add", "product_id": third, "quantity": 1},
+            {"op": "update", "cart_item_id": cart_item_ids[1], "quantity": 1},
+        ]}}),
+        ("create order", 1, "POST", "/api/order/create_order", {}),
+        ("orders", 1, "GET", "/api/order/all", {}),
+        ("remove cart item", 2, "DELETE", f"/api/cart/remove_cart_item/{cart_item_ids[2]}", {}),
+        ("remove cart", 3, "DELETE", "/api/cart/remove_cart", {}),
+        ("add cart", 3, "POST", "/api/cart/add_cart", {}),
+        ("admin is admin", 0, "GET", "/api/admin/is_user_admin", {}),
+        ("admin categories", 0, "GET", "/api/admin/categories", {}),
+        ("admin categories with counts", 0, "GET", "/api/admin/categories", {"params": {"with_counts": True}}),
+        ("admin category by id", 0, "GET", f"/api/admin/category/{category_id}", {"params": {"with_counts": True}}),
+        ("admin add category", 0, "POST", "/api/admin/add_category",
+         {"json": {"name": "Plans", "description": "Query plan check"}}),
+        ("admin add product", 0, "POST", "/api/admin/product/add_product",
+         {"json": {"name": "Plan item", "description": "Added by the plan check", "price": 5, "stock": 5,
+                   "category_id": category_id, "image_url": "http://example.com/i.png"}}),
+        ("admin update product", 0, "PUT", f"/api/admin/product/update/{second}",
+         {"json": {"name": "Renamed", "description": "Updated by the plan check", "price": 6, "stock": 50,
+                   "category_id": category_id, "image_url": "http://example.com/i.png"}}),
+        ("admin import products", 0, "POST", "/api/admin/product/import",
+         {"headers": {"Content-Type": "application/x-ndjson"}, "content": json.dumps(
+             {"sku": "PLAN-1", "name": "Imported", "description": "Imported by the plan check", "price": 3,
+              "stock": 3, "category_id": category_id}) + "\n"}),
+        ("admin remove product", 0, "DELETE", f"/api/admin/product/remove/{product_ids[-1]}", {}),
+        ("admin orders by status", 0, "GET", "/api/admin/order/all", {"params": {"status": "pending", "limit": 1}}),
+        ("admin update order status", 0, "PUT", "/api/admin/order/update_status/{order_id}",
+         {"params": {"new_status": "shipped"}}),
+        ("admin update admin flag", 0, "PUT", "/api/admin/user/update_admin/{user_id}",
+         {"params": {"is_admin": False}}),
+        ("product export", None, "GET", "/api/product/export", {}),
+        ("category export", None, "GET", "/api/category/export", {}),
+        ("order export", 0, "GET", "/api/admin/order/export", {}),
+        ("update password", 4, "PUT", "/api/user/update",
+         {"json": {"old_password": "bench-password", "new_password": "secret2", "confirm_password": "secret2"}}),
+    ]
+
+
+async def walk_tour(c, steps: list[tuple], emails: list[str], on_step) -> list[str]:
+    """Send every request of the tour, calling on_step(name) before each one and on_step(None) at the end."""
+    failures, ids = [], {}
+    for name, user, method, url, kwargs in steps:
+        on_step(name)
+        headers = {**(auth_headers(emails[user]) if user is not None else {}), **kwargs.pop("headers", {})}
+        try:
+            r = await c.request(method, url.format(**ids), headers=headers, **kwargs)
+        except Exception as e:
+            failures.append(f"{name}: {method} {url} raised {e}")
+            continue
+        finally:
+            c.cookies.clear()
+        if r.status_code >= 400:
+            failures.append(f"{name}: {method} {url} returned {r.status_code} {r.text[:200]}")
+        if name == "orders":
+            ids["order_id"] = r.json()[0]["id"]
+            ids["user_id"] = r.json()[0]["user_id"]
+    on_step(None)
+    return failures
+
+
+async def _explain_tour(workdir: str, product_ids: list[str], category_id: str, emails: list[str],
+                        cart_item_ids: list[str]) -> dict:
+    import httpx
+    from sqlalchemy import event
+    app = load_app(workdir)
+    from src.config.db_setup import engine, read_engine
+
+    step = None
+    statements = {}
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if step is not None and re.match(r"\s*(SELECT|UPDATE|DELETE|WITH)\b", statement, re.IGNORECASE):
+            statements.setdefault((step, statement), parameters[0] if executemany else parameters)
+
+    for instrumented in {engine, read_engine}:
+        event.listen(instrumented.sync_engine, "before_cursor_execute", capture)
+
+    def on_step(name):
+        nonlocal step
+        step = name
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            failures = await walk_tour(c, tour(product_ids, category_id, cart_item_ids), emails, on_step)
+
+    plans = []
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    for (name, statement), parameters in statements.items():
+        details = [row[3] for row in con.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())]
+        scanned = {match.group(1) for match in map(FULL_SCAN.match, details) if match}
+        unexpected = scanned - ALLOWED_SCANS.get(name, set())
+        plans.append({"step": name, "statement": " ".join(statement.split()), "plan": details,
+                      "full_scans": sorted(unexpected)})
+    con.close()
+    return {"failures": failures, "plans": plans}
+
+
+def prepare_database(products: int, categories: int, env: dict | None = None) -> tuple[str, dict, str]:
+    """A scratch database for the tour: user 0 is an admin and the products are spread over `categories`."""
+    workdir = create_database(env)
+    seeded = seed(workdir, users=5, products=products, stock=100, cart_items=True)
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    with con:
+        con.execute("update users set is_admin = 1 where email = ?", (seeded["emails"][0],))
+        category_id = con.execute("select id from categories").fetchone()[0]
+        # with every product in one category the stats make a category index look useless and the planner scans
+        others = [uuid4().hex for _ in range(categories - 1)]
+        con.executemany("insert into categories (id, name) values (?, ?)",
+                        [(other, f"Bench {i}") for i, other in enumerate(others)])
+        con.executemany("update products set category_id = ? where rowid % ? = ?",
+                        [(other, categories, i + 1) for i, other in enumerate(others)])
+        con.execute("ANALYZE")
+    con.close()
+    return workdir, seeded, str(UUID(category_id))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000, help="enough rows for the planner to prefer indexes")
+    parser.add_argument("--categories", type=int, default=20, help="the products are spread over this many")
+    parser.add_argument("--verbose", action="store_true", help="print every plan, not only the failing ones")
+    args = parser.parse_args()
+
+    workdir, seeded, category_id = prepare_database(args.products, args.categories)
+    (outcome,), _ = run_workers(_explain_tour, [(workdir, seeded["product_ids"], category_id, seeded["emails"],
+                                                 seeded["cart_item_ids"])])
+
+    regressions = [plan for plan in outcome["plans"] if plan["full_scans"]]
+    for plan in outcome["plans"] if args.verbose else regressions:
+        print(json.dumps(plan, indent=2))
+    print(f"{len(outcome['plans'])} statements checked, {len(regressions)} with unexpected full scans")
+
+    for failure in outcome["failures"]:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    for plan in regressions:
+        print(f"FAIL: {plan['step']}: full scan of {', '.join(plan['full_scans'])}", file=sys.stderr)
+    return 1 if outcome["failures"] or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
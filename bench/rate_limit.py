@@ -0,0 +1,108 @@
+"""
+    Admission control overhead and behaviour. First the cost of the checks themselves: the login buckets (per IP and
+    per route), the create_order bucket (per user, which decodes the bearer token) and a free concurrency slot, with
+    one client and with many distinct ones. Then a login storm from a single address against the app with the limits
+    on, which should turn the excess into fast 429s instead of a bcrypt queue.
+
+        python -m bench.rate_limit --clients 10000 --storm 300
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+
+from bench.harness import create_database, seed, load_app
+
+
+def _request(ip: str, headers: dict | None = None):
+    from starlette.requests import Request
+    return Request({"type": "http", "method": "POST", "path": "/", "client": (ip, 5000),
+                    "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]})
+
+
+async def _per_call_us(check, requests: list, calls: int) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        await check(requests[i % len(requests)])
+    return round((time.perf_counter() - started) / calls * 1e6, 2)
+
+
+async def check_costs(clients: int, calls: int) -> dict:
+    from src.utils import rate_limit
+    from src.utils.jwt_handler import get_jwt_token
+
+    # buckets big enough that nothing is rejected, only the bookkeeping is timed
+    rate_limit.rate_limits.update({"bench_login": [("ip", 1e9, 1e9), ("route", 1e9, 1e9)],
+                                   "bench_order": [("user", 1e9, 1e9)]})
+    login, order = rate_limit.rate_limit("bench_login"), rate_limit.rate_limit("bench_order")
+    ips = [f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}" for i in range(clients)]
+    users = [_request(ips[i], {"Authorization": f"Bearer {get_jwt_token(data={'sub': f'user{i}@example.com'})}"})
+             for i in range(min(clients, 1000))]
+
+    slot = rate_limit.ConcurrencyLimit("bench", limit=8, queue_size=0, queue_timeout=1)
+
+    async def hold_slot(_):
+        holder = slot()
+        await holder.__anext__()
+        await holder.aclose()
+
+    return {
+        "login_one_client_us": await _per_call_us(login, [_request(ips[0])], calls),
+        f"login_{clients}_clients_us": await _per_call_us(login, [_request(ip) for ip in ips], calls),
+        "create_order_per_user_us": await _per_call_us(order, users, calls),
+        "concurrency_slot_us": await _per_call_us(hold_slot, [None], calls),
+    }
+
+
+async def login_storm(workdir: str, emails: list[str], requests: int, concurrency: int) -> dict:
+    import httpx
+    app = load_app(workdir, {"RATE_LIMIT_ENABLED": "1"})
+    latencies = defaultdict(list)
+    retry_after = Counter()
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def login(c, i):
+        async with in_flight:
+            started = time.perf_counter()
+            r = await c.post("/api/auth/login", data={"username": emails[i % len(emails)],
+                                                      "password": "bench-password"})
+            latencies[r.status_code].append(time.perf_counter() - started)
+            if "retry-after" in r.headers:
+                retry_after[r.headers["retry-after"]] += 1
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            await asyncio.gather(*(login(c, i) for i in range(requests)))
+    return {"seconds": round(time.perf_counter() - started, 2), "retry_after": dict(retry_after),
+            "statuses": {status_code: {"count": len(values),
+                                       "p50_ms": round(statistics.median(values) * 1000, 2),
+                                       "max_ms": round(max(values) * 1000, 2)}
+                         for status_code, values in sorted(latencies.items())}}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=10000, help="distinct client addresses for the bucket check")
+    parser.add_argument("--calls", type=int, default=50000, help="checks timed per measurement")
+    parser.add_argument("--storm", type=int, default=300, help="login requests in the storm, 0 skips it")
+    parser.add_argument("--concurrency", type=int, default=32, help="storm requests in flight")
+    args = parser.parse_args()
+
+    workdir = create_database()
+    seeded = seed(workdir, users=10, products=1, stock=1)
+    # the limiter reads its settings at import, so the app is loaded with the limits on before anything is timed
+    load_app(workdir, {"RATE_LIMIT_ENABLED": "1"})
+    report = {"checks": asyncio.run(check_costs(args.clients, args.calls))}
+    if args.storm:
+        report["login_storm"] = asyncio.run(login_storm(workdir, seeded["emails"], args.storm, args.concurrency))
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+    Load benchmark: seeds a scratch database, then replays shopper and admin scenarios against the app, in-process
+    through httpx's ASGI transport or over HTTP against a local uvicorn, and reports throughput and p50/p95/p99
+    latency per scenario and per route as JSON. Runs are seeded, so two commits can be compared on equal terms:
+
+        python -m bench.scenarios --output before.json
+        git checkout <other commit> && python -m bench.scenarios --output after.json
+
+    Scenarios: browse, search, cart_edits, checkout, login_storm, admin_bulk (all of them by default).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from uuid import UUID
+
+from bench.harness import ROOT, create_database, seed, load_app, auth_headers, Recorder, run_workers, summarize, \
+    summarize_routes
+
+SEARCH_TERMS = ["bench", "item", "bench item", "item 4", "item 17", "seeded", "load test", "item 123"]
+
+
+async def browse(c, recorder: Recorder, rng: random.Random, user: dict):
+    params = {"limit": 20, "sort_by": rng.choice(["created_at", "price", "name"])}
+    r = await recorder.request(c, "GET", "/api/product/all", label="GET /api/product/all", params=params)
+    cursor = r.json().get("next_cursor") if r.status_code == 200 else None
+    if cursor is not None:
+        await recorder.request(c, "GET", "/api/product/all", label="GET /api/product/all?cursor",
+                               params={**params, "cursor": cursor})
+    await recorder.request(c, "GET", f"/api/product/{rng.choice(user['product_ids'])}",
+                           label="GET /api/product/{product_id}")
+    await recorder.request(c, "GET", "/api/category/all", label="GET /api/category/all",
+                           params={"with_counts": rng.random() < 0.5})
+
+
+async def search(c, recorder: Recorder, rng: random.Random, user: dict):
+    await recorder.request(c, "GET", "/api/product/search", label="GET /api/product/search",
+                           params={"q": rng.choice(SEARCH_TERMS), "limit": 20})
+
+
+async def cart_edits(c, recorder: Recorder, rng: random.Random, user: dict):
+    headers = user["headers"]
+    await recorder.request(c, "POST", "/api/cart/add_cart_item", label="POST /api/cart/add_cart_item",
+                           headers=headers, json={"product_id": rng.choice(user["product_ids"]), "quantity": 1})
+    r = await recorder.request(c, "GET", "/api/cart/get_cart_items", label="GET /api/cart/get_cart_items",
+                               headers=headers)
+    items = r.json() if r.status_code == 200 else []
+    if items:
+        await recorder.request(c, "PUT", f"/api/cart/update_cart_item/{items[-1]['id']}",
+                               label="PUT /api/cart/update_cart_item/{cart_item_id}", headers=headers,
+                               params={"quantity": rng.randint(1, 3)})
+    if len(items) > 1:
+        await recorder.request(c, "DELETE", f"/api/cart/remove_cart_item/{items[-1]['id']}",
+                               label="DELETE /api/cart/remove_cart_item/{cart_item_id}", headers=headers)
+
+
+async def checkout(c, recorder: Recorder, rng: random.Random, user: dict):
+    headers = user["headers"]
+    # the seeded cart is checked out on the first pass, every later pass starts a new one
+    await recorder.request(c, "POST", "/api/cart/add_cart", label="POST /api/cart/add_cart", headers=headers)
+    await recorder.request(c, "POST", "/api/cart/add_cart_item", label="POST /api/cart/add_cart_item",
+                           headers=headers, json={"product_id": rng.choice(user["product_ids"]),
+                                                  "quantity": rng.randint(1, 2)})
+    await recorder.request(c, "POST", "/api/order/create_order", label="POST /api/order/create_order",
+                           headers=headers)
+    await recorder.request(c, "GET", "/api/order/all", label="GET /api/order/all", headers=headers)
+
+
+async def login_storm(c, recorder: Recorder, rng: random.Random, user: dict):
+    await recorder.request(c, "POST", "/api/auth/login", label="POST /api/auth/login",
+                           data={"username": user["email"], "password": "bench-password"})
+
+
+async def admin_bulk(c, recorder: Recorder, rng: random.Random, user: dict):
+    headers = user["admin_headers"]
+    rows = "".join(json.dumps({"sku": f"BULK-{rng.randint(0, 999)}", "name": f"Bulk item {i}",
+                               "description": "Upserted by the admin bulk scenario", "price": rng.randint(1, 99),
+                               "stock": rng.randint(1, 500), "category_id": user["category_id"]}) + "\n"
+                   for i in range(100))
+    await recorder.request(c, "POST", "/api/admin/product/import", label="POST /api/admin/product/import",
+                           headers={**headers, "Content-Type": "application/x-ndjson"}, content=rows)
+    product_id = rng.choice(user["product_ids"])
+    await recorder.request(c, "PUT", f"/api/admin/product/update/{product_id}",
+                           label="PUT /api/admin/product/update/{product_id}", headers=headers,
+                           json={"name": f"Edited {rng.randint(0, 99)}", "description": "Edited by the bulk scenario",
+                                 "price": rng.randint(1, 99), "stock": 1_000_000, "category_id": user["category_id"]})
+    r = await recorder.request(c, "GET", "/api/admin/order/all", label="GET /api/admin/order/all", headers=headers,
+                               params={"status": "pending", "limit": 20})
+    for order in (r.json()["items"] if r.status_code == 200 else [])[:5]:
+        await recorder.request(c, "PUT", f"/api/admin/order/update_status/{order['id']}",
+                               label="PUT /api/admin/order/update_status/{order_id}", headers=headers,
+                               params={"new_status": "shipped"})
+
+
+# name -> (virtual user step, iterations per virtual user unless --iterations is given)
+SCENARIOS = {
+    "browse": (browse, 20),
+    "search": (search, 40),
+    "cart_edits": (cart_edits, 10),
+    "checkout": (checkout, 5),
+    "login_storm": (login_storm, 2),
+    "admin_bulk": (admin_bulk, 2),
+}
+
+
+async def _virtual_users(workdir: str, base_url: str | None, scenario: str, users: list[dict], iterations: int,
+                         concurrency: int, seed_value: int) -> dict:
+    import httpx
+    step = SCENARIOS[scenario][0]
+    recorder = Recorder()
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def run_user(c, user, rng):
+        user = {**user, "headers": auth_headers(user["email"]), "admin_headers": auth_headers(user["admin_email"])}
+        for _ in range(iterations):
+            async with in_flight:
+                await step(c, recorder, rng, user)
+
+    async def run_all(c):
+        await asyncio.gather(*(run_user(c, user, random.Random(f"{seed_value}-{scenario}-{user['email']}"))
+                               for user in users))
+
+    if base_url is not None:
+        sys.path.insert(0, ROOT)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as c:
+            await run_all(c)
+        return recorder.outcome()
+
+    app = load_app(workdir)
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            await run_all(c)
+    return recorder.outcome()
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_uvicorn(workdir: str, server_workers: int) -> tuple[subprocess.Popen, str]:
+    port = _free_port()
+    env = {**os.environ, "PYTHONPATH": ROOT, "LOG_STDERR": "0", "RATE_LIMIT_ENABLED": "0"}
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                               "--workers", str(server_workers), "--no-access-log", "--log-level", "warning"],
+                              cwd=workdir, env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn exited with {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return server, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn didn't start listening within 60s")
+
+
+def prepare(args) -> tuple[str, list[dict]]:
+    workdir = create_database()
+    seeded = seed(workdir, users=args.users, products=args.products, stock=1_000_000, cart_items=True)
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    with con:
+        admin_email = seeded["emails"][0]
+        con.execute("update users set is_admin = 1 where email = ?", (admin_email,))
+        category_id = con.execute("select id from categories").fetchone()[0]
+        con.execute("ANALYZE")
+    con.close()
+
+    users = [{"email": email, "admin_email": admin_email, "product_ids": seeded["product_ids"],
+              "category_id": str(UUID(category_id))} for email in seeded["emails"]]
+    return workdir, users
+
+
+def _revision() -> str:
+    def git(*command: str) -> str:
+        return subprocess.run(["git", *command], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    dirty = git("status", "--porcelain", "--untracked-files=no")
+    return f"{git('rev-parse', '--short', 'HEAD')}{'-dirty' if dirty else ''}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=list(SCENARIOS), action="append",
+                        help="run only these scenarios (default: all, in the order listed above)")
+    parser.add_argument("--server", choices=["asgi", "uvicorn"], default="asgi",
+                        help="asgi runs the app inside every client worker, uvicorn puts a real server in between")
+    parser.add_argument("--server-workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--workers", type=int, default=2, help="client processes")
+    parser.add_argument("--users", type=int, default=40, help="virtual users in total, split across the workers")
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--iterations", type=int, help="passes per virtual user, overrides the scenario default")
+    parser.add_argument("--concurrency", type=int, default=16, help="virtual users in flight per worker")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    workdir, users = prepare(args)
+    server, base_url = start_uvicorn(workdir, args.server_workers) if args.server == "uvicorn" else (None, None)
+    report = {"revision": _revision(), "server": args.server, "workers": args.workers, "users": args.users,
+              "concurrency": args.concurrency, "products": args.products, "seed": args.seed, "scenarios": {}}
+    try:
+        for scenario in args.scenario or SCENARIOS:
+            iterations = args.iterations or SCENARIOS[scenario][1]
+            outcomes, elapsed = run_workers(_virtual_users, [
+                (workdir, base_url, scenario, users[i::args.workers], iterations, args.concurrency, args.seed)
+                for i in range(args.workers)])
+            report["scenarios"][scenario] = {"iterations": iterations, **summarize(outcomes, elapsed),
+                                             "routes": summarize_routes(outcomes, elapsed)}
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+    Product search latency: fills a scratch database with --products products, whose descriptions are --words words
+    drawn from a --vocabulary word vocabulary, plus one common word in a tenth of them. It then lets the app build its
+    search index at startup and times the index itself (search_index.search on a session, no HTTP, no catalog cache)
+    for a few query shapes, each run --repeats times with different words, and a single-product upsert.
+
+        python -m bench.search_latency --products 1000000
+        python -m bench.search_latency --products 100000 --index like  # the fallback for databases without FTS5
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import string
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from bench.harness import create_database, load_app, run_workers, summarize_routes
+
+INSERT_BATCH = 50_000
+COMMON_WORD = "standard"  # in every tenth description
+
+
+def _product_id() -> str:
+    # the id column is declared UUID, which SQLite gives NUMERIC affinity: a hex id of digits and one "e" is stored as
+    # a number, and with a large exponent as Inf, so a few million random ids collide. A leading letter keeps it text.
+    return "a" + uuid4().hex[1:]
+
+
+def _vocabulary(rng: random.Random, size: int) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(string.ascii_lowercase, k=rng.randint(5, 10))))
+    return sorted(words)
+
+
+def _fill(workdir: str, products: int, words: int, vocabulary: list[str], rng: random.Random,
+          samples: int) -> list[list[str]]:
+    """Insert the products and return the description words of `samples` of them, spread over the table."""
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    con.execute("PRAGMA synchronous = OFF")
+    category_id = uuid4().hex
+    started = datetime.now() - timedelta(seconds=products)
+    sample_every = max(products // samples, 1)
+    sampled = []
+    with con:
+        # the app backfills the index from the products table when it finds no index at startup
+        con.execute("drop table if exists products_fts")
+        con.execute("insert into categories (id, name, description) values (?, ?, ?)",
+                    (category_id, "Search", "Search bench category"))
+        for first in range(0, products, INSERT_BATCH):
+            rows = []
+            for i in range(first, min(first + INSERT_BATCH, products)):
+                description = rng.choices(vocabulary, k=words) + ([COMMON_WORD] if i % 10 == 0 else [])
+                if i % sample_every == 0 and len(sampled) < samples:
+                    sampled.append(description)
+                timestamp = (started + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S.%f")
+                rows.append((_product_id(), f"{' '.join(rng.choices(vocabulary, k=2)).title()} {i}",
+                             " ".join(description), 10.0, 10, category_id, timestamp, timestamp))
+            con.executemany("insert into products (id, name, description, price, stock, category_id, created_at, "
+                            "updated_at) values (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    con.close()
+    return sampled
+
+
+async def _measure(workdir: str, env: dict, queries: dict[str, list[str]], limit: int) -> dict:
+    app = load_app(workdir, env)
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup = time.perf_counter() - started
+        from sqlalchemy import select
+        from src.config.db_setup import session_local
+        from src.models.app_model import Product
+        from src.utils.search_index import search_index
+
+        routes, elapsed, returned = {}, {}, {}
+        async with session_local() as db:
+            for label, label_queries in queries.items():
+                latencies, found = [], 0
+                label_started = time.perf_counter()
+                for query in label_queries:
+                    query_started = time.perf_counter()
+                    found += len(await search_index.search(db, query, limit=limit, offset=0))
+                    latencies.append(time.perf_counter() - query_started)
+                routes[label], elapsed[label] = latencies, time.perf_counter() - label_started
+                returned[label] = round(found / len(label_queries), 1)
+
+            products = (await db.execute(select(Product.id, Product.name, Product.description)
+                                         .limit(len(next(iter(queries.values())))))).all()
+            latencies = []
+            label_started = time.perf_counter()
+            for product in products:
+                upsert_started = time.perf_counter()
+                await search_index.upsert_many(db, [product])
+                latencies.append(time.perf_counter() - upsert_started)
+            routes["single-product upsert"] = latencies
+            elapsed["single-product upsert"] = time.perf_counter() - label_started
+            await db.rollback()
+    return {"index": type(search_index).__name__, "startup_seconds": startup, "routes": routes, "elapsed": elapsed,
+            "returned": returned}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--words", type=int, default=12, help="words per description")
+    parser.add_argument("--vocabulary", type=int, default=20_000)
+    parser.add_argument("--repeats", type=int, default=50, help="queries of every shape")
+    parser.add_argument("--limit", type=int, default=21, help="the search route asks for a page and one more")
+    parser.add_argument("--index", choices=["fts", "like"], default=None, help="SEARCH_INDEX, by dialect if unset")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = _vocabulary(rng, args.vocabulary)
+    workdir = create_database()
+    started = time.perf_counter()
+    sampled = _fill(workdir, args.products, args.words, vocabulary, rng, args.repeats)
+    fill_seconds = time.perf_counter() - started
+
+    # two words of one description, so the term + prefix query has a product to find
+    words = [rng.sample(description[:args.words], 2) for description in sampled]
+    queries = {
+        "one term": [first for first, _ in words],
+        "term + 3-char prefix": [f"{first} {second[:3]}" for first, second in words],
+        "4-char prefix": [first[:4] for first, _ in words],
+        f"common term ({COMMON_WORD}, a tenth of the products)": [COMMON_WORD] * args.repeats,
+    }
+    env = {"SEARCH_INDEX": args.index} if args.index else {}
+    (outcome,), _ = run_workers(_measure, [(workdir, env, queries, args.limit)])
+
+    report = {"products": args.products, "index": outcome["index"], "fill_seconds": round(fill_seconds, 1),
+              "startup_seconds": round(outcome["startup_seconds"], 1), "shapes": {}}
+    for label, latencies in outcome["routes"].items():
+        summary = summarize_routes([{"routes": {label: latencies}}], outcome["elapsed"][label])[label]
+        report["shapes"][label] = {"queries": summary["requests"], "p50_ms": summary["p50_ms"],
+                                   "p95_ms": summary["p95_ms"], "p99_ms": summary["p99_ms"],
+                                   "mean_results": outcome["returned"].get(label)}
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+    Per-row cost of turning a product list query into a JSON body: Product entities through FastAPI's response_model
+    path (what the list routes used to do) against column rows through the precompiled TypeAdapter (what they do now).
+    Both the query and the serialization are timed, on an in-memory SQLite database, and then the serialization alone.
+
+        python -m bench.serialization --rows 1 50 200 1000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+from uuid import uuid4
+
+from bench.harness import ROOT
+
+
+def _run(coroutine):
+    # serialize_response never awaits anything for an async route, so there is no need for an event loop per call
+    try:
+        coroutine.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("serialize_response suspended")
+
+
+def _database(count: int):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import Session
+    from sqlalchemy.pool import StaticPool
+    from src.models.app_model import Category, Product
+
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    Category.__table__.create(engine)
+    Product.__table__.create(engine)
+    with Session(engine) as session:
+        category = Category(id=uuid4(), name="Bench", description="Serialization bench")
+        session.add(category)
+        session.add_all(Product(id=uuid4(), sku=f"SKU-{i}", name=f"Bench item {i}", description="Seeded for a bench",
+                                price=9.99 + i, stock=i, category_id=category.id, image_url="http://example.com/i.png",
+                                created_at=datetime.now(), updated_at=datetime.now()) for i in range(count))
+        session.commit()
+    return engine
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1, 50, 200, 1000], help="list sizes to time")
+    parser.add_argument("--seconds", type=float, default=1.0, help="rough time budget per measurement")
+    args = parser.parse_args()
+
+    # the models import the app's engine setup, which only needs a working directory of its own
+    os.chdir(tempfile.mkdtemp(prefix="ecom-bench-"))
+    sys.path.insert(0, ROOT)
+    from fastapi.responses import JSONResponse
+    from fastapi.routing import serialize_response
+    from fastapi.utils import create_model_field
+    from sqlalchemy import select
+    from sqlalchemy.orm import Session
+    from src.models.app_model import Product
+    from src.routers.product_router import PRODUCT_COLUMNS
+    from src.schemas.product_schema import ProductOut
+    from src.utils.serialization import dump_json, rows_as_dicts
+
+    field = create_model_field(name="Response_all_products", type_=list[ProductOut], mode="serialization")
+
+    def response_model_body(content) -> bytes:
+        return JSONResponse(_run(serialize_response(field=field, response_content=content))).body
+
+    def type_adapter_body(rows) -> bytes:
+        return dump_json(list[ProductOut], rows_as_dicts(rows))
+
+    def per_row_us(call, count: int) -> float:
+        call()
+        runs = max(1, int(args.seconds / max(timeit.timeit(call, number=1), 1e-6)))
+        return round(min(timeit.repeat(call, number=runs, repeat=3)) / runs / count * 1e6, 2)
+
+    report = {}
+    for count in args.rows:
+        engine = _database(count)
+
+        def entities():
+            with Session(engine) as session:
+                return session.scalars(select(Product)).all()
+
+        def rows():
+            with Session(engine) as session:
+                return session.execute(select(*PRODUCT_COLUMNS)).all()
+
+        loaded_entities, loaded_rows = entities(), rows()
+        assert json.loads(response_model_body(loaded_entities)) == json.loads(type_adapter_body(loaded_rows))
+        before = per_row_us(lambda: response_model_body(entities()), count)
+        after = per_row_us(lambda: type_adapter_body(rows()), count)
+        serialize_before = per_row_us(lambda: response_model_body(loaded_entities), count)
+        serialize_after = per_row_us(lambda: type_adapter_body(loaded_rows), count)
+        report[count] = {"entities_response_model_us": before, "rows_type_adapter_us": after,
+                         "speedup": round(before / after, 1),
+                         "serialize_only": {"response_model_us": serialize_before, "type_adapter_us": serialize_after,
+                                            "speedup": round(serialize_before / serialize_after, 1)}}
+        engine.dispose()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
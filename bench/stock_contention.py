@@ -0,0 +1,87 @@
+"""
+    Flash-sale load test: several worker processes, each running the app in-process against one shared SQLite file,
+    hammer a single product with add-to-cart + checkout. Fails if stock goes negative, if more is sold than was in
+    stock, or if stock that could have been sold is left over. Throughput is reported, and only fails the run when a
+    floor is asked for with --min-rps, since it depends on the machine more than on the code.
+
+        python -m bench.stock_contention --workers 4 --users 400 --stock 100
+        python -m bench.stock_contention --min-rps 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+
+from bench.harness import create_database, seed, load_app, auth_headers, Recorder, run_workers, summarize
+
+
+async def _buyers(workdir: str, product_id: str, emails: list[str], quantity: int, concurrency: int) -> dict:
+    import httpx
+    app = load_app(workdir)
+    recorder = Recorder()
+    in_flight = asyncio.Semaphore(concurrency)
+
+    async def buy(c, email):
+        async with in_flight:
+            headers = auth_headers(email)
+            await recorder.request(c, "POST", "/api/cart/add_cart", headers=headers)
+            r = await recorder.request(c, "POST", "/api/cart/add_cart_item", headers=headers,
+                                       json={"product_id": product_id, "quantity": quantity})
+            if r.status_code == 201:
+                await recorder.request(c, "POST", "/api/order/create_order", headers=headers)
+
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+            await asyncio.gather(*(buy(c, email) for email in emails))
+    return recorder.outcome()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=400, help="buyers in total, split across the workers")
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--quantity", type=int, default=1, help="units every buyer tries to buy")
+    parser.add_argument("--concurrency", type=int, default=16, help="buyers in flight per worker")
+    parser.add_argument("--min-rps", type=float, default=None, help="fail below this throughput, off by default")
+    args = parser.parse_args()
+
+    workdir = create_database()
+    seeded = seed(workdir, users=args.users, products=1, stock=args.stock)
+    product_id, emails = seeded["product_ids"][0], seeded["emails"]
+    outcomes, elapsed = run_workers(_buyers, [(workdir, product_id, emails[i::args.workers], args.quantity,
+                                               args.concurrency) for i in range(args.workers)])
+
+    con = sqlite3.connect(os.path.join(workdir, "ecom2.db"))
+    final_stock = con.execute("select stock from products").fetchone()[0]
+    sold = con.execute("select coalesce(sum(quantity), 0) from order_items").fetchone()[0]
+    holds_left = con.execute("select count(*) from stock_reservations").fetchone()[0]
+    con.close()
+
+    sellable = min(args.stock, args.users * args.quantity) // args.quantity * args.quantity
+    report = {"workers": args.workers, "concurrency": args.concurrency, "users": args.users,
+              "initial_stock": args.stock, "final_stock": final_stock, "sold": sold, "holds_left": holds_left,
+              **summarize(outcomes, elapsed)}
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if final_stock < 0:
+        failures.append(f"stock went negative ({final_stock})")
+    if sold + final_stock != args.stock:
+        failures.append(f"sold {sold} + left {final_stock} != initial stock {args.stock}")
+    if sold != sellable:
+        failures.append(f"sold {sold}, expected {sellable}")
+    if holds_left:
+        failures.append(f"{holds_left} reservations left behind")
+    if args.min_rps is not None and report.get("rps", 0) < args.min_rps:
+        failures.append(f"{report.get('rps', 0)} req/s is below --min-rps {args.min_rps}")
+    for failure in failures:
+        print(f"FAIL: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,48 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI, Request, status
+from fastapi.responses import JSONResponse
 
-from src.config.db_setup import Base, engine
-from src.routers import auth_router, admin_router, category_router, product_router, user_router, cart_router, order_router
+from src.config.db_setup import engine, read_engine
+from src.config.migrations import migrate
+from src.routers import auth_router, admin_router, category_router, product_router, user_router, cart_router, order_router, \
+    metrics_router
+from src.utils.password_handler import PasswordHasherBusy, shutdown_hash_executor
+from src.utils.looger_handler import logger, RequestLogMiddleware
+from src.utils.idempotency import IdempotencyMiddleware, idempotency_store
+from src.utils.metrics import MetricsMiddleware
+from src.utils.query_budget import QueryBudgetMiddleware
+from src.utils.jobs import run_job_queue, stop_job_queue, JOB_WORKERS
+from src.utils.reservations import run_reservation_sweeper, InsufficientStock
+from src.utils.search_index import search_index
+from src.utils.cache_backend import cache_backend, run_cache_sync, CACHE_BACKEND
+from src.utils.serialization import GZIP_MINIMUM_SIZE, GZIP_COMPRESS_LEVEL, GZipETagMiddleware
 
 
-Base.metadata.create_all(bind=engine)
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    await migrate(engine)
+    async with engine.begin() as conn:
+        await search_index.setup(conn)
+    reservation_sweeper = asyncio.create_task(run_reservation_sweeper())
+    job_queue = asyncio.create_task(run_job_queue()) if JOB_WORKERS > 0 else None
+    cache_sync = asyncio.create_task(run_cache_sync()) if CACHE_BACKEND != "memory" else None
+    yield
+    for task in (reservation_sweeper, cache_sync):
+        if task is not None:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    if job_queue is not None:
+        stop_job_queue()
+        await job_queue
+    shutdown_hash_executor()
+    cache_backend.close()
+    idempotency_store.close()
+    await engine.dispose()
+    await read_engine.dispose()
+    await logger.complete()
+
 
 app = FastAPI(title="🛍️ E-Commerce API", description=("Welcome to the **E-Commerce API**! 🚀\n\n"
                                                       "This API powers a full-featured e-commerce platform, providing:\n"
@@ -21,8 +59,30 @@ app = FastAPI(title="🛍️ E-Commerce API", description=("Welcome to the **E-C
               docs_url="/docs",
               redoc_url="/redoc",
               openapi_url="/openapi.json",
+              lifespan=lifespan,
               )
 
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(_: Request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": str(exc)},
+                        headers={"Retry-After": "1"})
+
+
+@app.exception_handler(InsufficientStock)
+async def insufficient_stock_handler(_: Request, exc: InsufficientStock):
+    logger.warning(str(exc))
+    return JSONResponse(status_code=status.HTTP_409_CONFLICT, content={"detail": "Product doesn't have enough stock!"})
+
+
+# inside gzip so a stored response doesn't depend on the Accept-Encoding of the request that produced it
+app.add_middleware(IdempotencyMiddleware)
+if GZIP_MINIMUM_SIZE > 0:
+    app.add_middleware(GZipETagMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+app.add_middleware(QueryBudgetMiddleware)
+app.add_middleware(RequestLogMiddleware)
+app.add_middleware(MetricsMiddleware)
+
 app.include_router(auth_router.auth_routes)
 app.include_router(admin_router.admin_routes)
 app.include_router(category_router.category_routes)
@@ -30,3 +90,4 @@ app.include_router(product_router.product_routes)
 app.include_router(user_router.user_routes)
 app.include_router(cart_router.cart_routes)
 app.include_router(order_router.order_routes)
+app.include_router(metrics_router.metrics_routes)
@@ -1,18 +1,129 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base, Session
+import asyncio
+import random
+import time
+from os import getenv
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
 
-DATABASE_URL = "sqlite:///./ecom2.db"
+from fastapi import Request, Response
+from sqlalchemy import event, make_url
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+DATABASE_URL = getenv("DATABASE_URL", "sqlite+aiosqlite:///./ecom2.db")
+# reads go here, by default a read-only pool on the same file for SQLite and the primary for anything else
+DATABASE_REPLICA_URL = getenv("DATABASE_REPLICA_URL", "")
+READ_YOUR_WRITES_SECONDS = int(getenv("READ_YOUR_WRITES_SECONDS", "5"))
+READ_YOUR_WRITES_COOKIE = "read_primary_until"
+DB_POOL_SIZE = int(getenv("DB_POOL_SIZE", "5"))  # 0 opens a new connection per session
+DB_MAX_OVERFLOW = int(getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_PRE_PING = getenv("DB_POOL_PRE_PING", "false").lower() == "true"
+DB_POOL_RECYCLE = int(getenv("DB_POOL_RECYCLE", "-1"))
+DB_WRITE_RETRIES = int(getenv("DB_WRITE_RETRIES", "3"))
+DB_WRITE_RETRY_BACKOFF = float(getenv("DB_WRITE_RETRY_BACKOFF", "0.02"))
 
-session_local = sessionmaker(autoflush=False, autocommit=False, bind=engine)
+# applied in this order to every new SQLite connection, busy_timeout first so switching journal_mode can wait
+SQLITE_PRAGMAS = {
+    "busy_timeout": int(getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "journal_mode": getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "mmap_size": int(getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "cache_size": int(getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative values are KiB
+}
+
+
+def create_engine_from_env(url: str) -> AsyncEngine:
+    url = make_url(url)
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        pass  # a private in-memory database lives on its single StaticPool connection
+    elif DB_POOL_SIZE <= 0:
+        options["poolclass"] = NullPool
+    else:
+        # aiosqlite defaults to NullPool, which reconnects (and re-runs the pragmas) on every session
+        options.update(poolclass=AsyncAdaptedQueuePool, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                       pool_timeout=DB_POOL_TIMEOUT)
+    new_engine = create_async_engine(url, **options)
+
+    if url.get_backend_name() == "sqlite":
+        # a read-only connection can't switch the journal mode, the primary already did
+        pragmas = {name: value for name, value in SQLITE_PRAGMAS.items()
+                   if not (name == "journal_mode" and url.query.get("mode") == "ro")}
+
+        @event.listens_for(new_engine.sync_engine, "connect")
+        def apply_sqlite_pragmas(dbapi_connection, _):
+            cursor = dbapi_connection.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name}={value}")
+            cursor.close()
+
+    return new_engine
+
+
+def replica_url(url: str) -> str | None:
+    if DATABASE_REPLICA_URL:
+        return DATABASE_REPLICA_URL
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        return None
+    return url.set(database=f"file:{url.database}", query={"mode": "ro", "uri": "true"}).render_as_string()
+
+
+engine = create_engine_from_env(DATABASE_URL)
+REPLICA_URL = replica_url(DATABASE_URL)
+read_engine = create_engine_from_env(REPLICA_URL) if REPLICA_URL else engine
+
+session_local = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+read_session_local = async_sessionmaker(bind=read_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
 
-def get_db() -> Session:
-    db = session_local()
-    try:
+def dialect_insert(db: AsyncSession):
+    # INSERT construct with on_conflict_do_update() for the dialect behind this session
+    return postgresql_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+
+
+T = TypeVar("T")
+
+
+def is_transient_error(e: DBAPIError) -> bool:
+    # SQLite lock timeouts, PostgreSQL serialization failures and deadlocks
+    code = getattr(e.orig, "sqlstate", None) or getattr(e.orig, "pgcode", None)
+    return code in ("40001", "40P01") or "database is locked" in str(e.orig)
+
+
+async def run_with_retry(db: AsyncSession, operation: Callable[[], Awaitable[T]]) -> T:
+    """
+        Run `operation` (a whole transaction on `db`), rolling back and running it again with jittered backoff
+        when it fails on a transient lock error, at most DB_WRITE_RETRIES extra times.
+    """
+    for attempt in range(DB_WRITE_RETRIES + 1):
+        try:
+            return await operation()
+        except DBAPIError as e:
+            await db.rollback()
+            if attempt == DB_WRITE_RETRIES or not is_transient_error(e):
+                raise
+            await asyncio.sleep(DB_WRITE_RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+async def get_write_db(response: Response) -> AsyncIterator[AsyncSession]:
+    # only reaches the client when the route succeeds, error responses are built from scratch
+    if READ_YOUR_WRITES_SECONDS > 0:
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, str(int(time.time()) + READ_YOUR_WRITES_SECONDS),
+                            max_age=READ_YOUR_WRITES_SECONDS, httponly=True, samesite="lax")
+    async with session_local() as db:
+        yield db
+
+
+async def get_read_db(request: Request) -> AsyncIterator[AsyncSession]:
+    """Replica session, or a primary one for a client that wrote within the last READ_YOUR_WRITES_SECONDS."""
+    read_primary_until = request.cookies.get(READ_YOUR_WRITES_COOKIE, "")
+    use_primary = read_primary_until.isdigit() and int(read_primary_until) >= time.time()
+    async with (session_local if use_primary else read_session_local)() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,132 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import Column, Connection, DateTime, Integer, MetaData, String, Table, inspect, select, text, update, \
+    insert, bindparam
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config.db_setup import Base
+from src.models.app_model import Product, Order, CartItem, Job, StockReservation
+from src.utils.looger_handler import logger
+from src.utils.reservations import RESERVATION_TTL
+
+schema_migrations = Table(
+    "schema_migrations", MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def _create_indexes(conn: Connection, table) -> None:
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _baseline(conn: Connection) -> None:
+    # the create_all the app used to run at startup: builds a fresh database, only adds missing tables to an old one
+    Base.metadata.create_all(conn)
+
+
+def _product_sku_and_keyset_indexes(conn: Connection) -> None:
+    # databases created before sku and the keyset pagination indexes existed
+    if "sku" not in {column["name"] for column in inspect(conn).get_columns("products")}:
+        conn.execute(text("ALTER TABLE products ADD COLUMN sku VARCHAR"))
+        conn.execute(text("CREATE UNIQUE INDEX uq_products_sku ON products (sku)"))
+    _create_indexes(conn, Product.__table__)
+
+
+def _hot_filter_indexes(conn: Connection) -> None:
+    # orders by user, cart lines by cart, and the admin order views by status + date
+    _create_indexes(conn, Order.__table__)
+    _create_indexes(conn, CartItem.__table__)
+
+
+def _jobs_table(conn: Connection) -> None:
+    Job.__table__.create(conn, checkfirst=True)
+    _create_indexes(conn, Job.__table__)
+
+
+def _sqlite_datetime_microseconds(conn: Connection) -> None:
+    # SQLite keeps DateTime as text and SQLAlchemy binds it with microseconds, so a row written without them (raw SQL,
+    # datetime('now')) sorts before every same-second cursor and keyset pagination skips it
+    if conn.dialect.name != "sqlite":
+        return
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if isinstance(column.type, DateTime):
+                conn.execute(text(f"UPDATE {table.name} SET {column.name} = replace({column.name}, 'T', ' ') || "
+                                  f"'.000000' WHERE length({column.name}) = 19"))
+
+
+def _cart_items_to_stock_reservations(conn: Connection) -> None:
+    # before stock reservations, adding to the cart decremented Product.stock right away. A database that had no
+    # stock_reservations table before this upgrade still carries those decrements for its cart lines: give the stock
+    # back and hold it for the lines instead, so they stay claimed for one RESERVATION_TTL like a line added just now
+    if "stock_reservations" in conn.info["tables_before_upgrade"]:
+        return
+    cart_items = conn.execute(
+        select(CartItem.id, CartItem.product_id, CartItem.quantity).filter(CartItem.product_id.is_not(None))
+    ).all()
+    if not cart_items:
+        return
+
+    restored = defaultdict(int)
+    for cart_item in cart_items:
+        restored[cart_item.product_id] += cart_item.quantity
+    products = Product.__table__
+    conn.execute(update(products).where(products.c.id == bindparam("product_id"))
+                 .values(stock=products.c.stock + bindparam("quantity")),
+                 [{"product_id": product_id, "quantity": quantity} for product_id, quantity in restored.items()])
+    expires_at = datetime.now() + RESERVATION_TTL
+    conn.execute(insert(StockReservation), [
+        {"cart_item_id": cart_item.id, "product_id": cart_item.product_id, "quantity": cart_item.quantity,
+         "expires_at": expires_at} for cart_item in cart_items
+    ])
+    logger.info(f"Restored the stock of {len(restored)} products held by {len(cart_items)} cart lines as reservations")
+
+
+# append only: a released version must never change, fix mistakes with a new one
+MIGRATIONS: list[tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "baseline schema", _baseline),
+    (2, "products.sku and keyset pagination indexes", _product_sku_and_keyset_indexes),
+    (3, "indexes on orders.user_id, orders(status, created_at) and cart_items.cart_id", _hot_filter_indexes),
+    (4, "jobs table for the background job queue", _jobs_table),
+    (5, "DateTime values stored without microseconds on SQLite", _sqlite_datetime_microseconds),
+    (6, "stock decremented by cart lines added before stock reservations becomes holds",
+     _cart_items_to_stock_reservations),
+]
+
+
+def _lock(conn: Connection) -> None:
+    # one process migrates at a time, the others wait for it and then find nothing left to apply
+    if conn.dialect.name == "sqlite":
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+    elif conn.dialect.name == "postgresql":
+        conn.exec_driver_sql("SELECT pg_advisory_xact_lock(20250101)")
+
+
+def _upgrade(conn: Connection) -> list[tuple[int, str]]:
+    _lock(conn)
+    # what the database looked like before any of this run's migrations, the baseline creates every missing table
+    conn.info["tables_before_upgrade"] = set(inspect(conn).get_table_names())
+    schema_migrations.create(conn, checkfirst=True)
+    applied = set(conn.scalars(select(schema_migrations.c.version)))
+    upgraded = []
+    for version, description, upgrade in MIGRATIONS:
+        if version in applied:
+            continue
+        upgrade(conn)
+        conn.execute(schema_migrations.insert().values(version=version, description=description,
+                                                       applied_at=datetime.now()))
+        upgraded.append((version, description))
+    return upgraded
+
+
+async def migrate(engine: AsyncEngine) -> None:
+    """Apply every migration the database hasn't seen yet, each one recorded in schema_migrations."""
+    async with engine.begin() as conn:
+        upgraded = await conn.run_sync(_upgrade)
+    for version, description in upgraded:
+        logger.info(f"Applied schema migration {version}: {description}")
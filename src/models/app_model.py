@@ -1,5 +1,6 @@
 from datetime import datetime
-from sqlalchemy import Integer, Column, UUID, String, Boolean, DateTime, Enum as sql_enum, Float, ForeignKey
+from sqlalchemy import Integer, Column, UUID, String, Boolean, DateTime, Enum as sql_enum, Float, ForeignKey, Index, \
+    JSON
 from sqlalchemy.orm import relationship
 from enum import Enum
 from uuid import uuid4
@@ -14,6 +15,12 @@ class OrderStatusEnum(str, Enum):
     CANCELLED = "cancelled"
 
 
+class JobStatusEnum(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    FAILED = "failed"
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -38,13 +45,14 @@ class Category(Base):
     description = Column(String, nullable=True)
 
     # relationship
-    products = relationship("Product", back_populates="category", lazy="joined")
+    products = relationship("Product", back_populates="category", lazy="select")
 
 
 class Product(Base):
     __tablename__ = "products"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    sku = Column(String, unique=True, nullable=True)
     name = Column(String, nullable=False)
     description = Column(String, nullable=True)
     price = Column(Float, nullable=False)
@@ -57,12 +65,22 @@ class Product(Base):
     # relationship
     category = relationship("Category", back_populates="products")
 
+    # keyset pagination indexes, one per sort order with and without the category filter
+    __table_args__ = (
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_created_at_id", "created_at", "id"),
+        Index("ix_products_name_id", "name", "id"),
+        Index("ix_products_category_price_id", "category_id", "price", "id"),
+        Index("ix_products_category_created_at_id", "category_id", "created_at", "id"),
+        Index("ix_products_category_name_id", "category_id", "name", "id"),
+    )
+
 
 class Order(Base):
     __tablename__ = "orders"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"))
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), index=True)
     total_price = Column(Float, nullable=False)
     status = Column(sql_enum(OrderStatusEnum), default=OrderStatusEnum.PENDING, nullable=False)
     created_at = Column(DateTime, default=datetime.now)
@@ -70,6 +88,26 @@ class Order(Base):
 
     # relationship
     user = relationship("User", back_populates="orders", lazy="select")
+    items = relationship("OrderItem", back_populates="order", lazy="selectin")
+
+    # admin order views filter by status and page by date
+    __table_args__ = (
+        Index("ix_orders_status_created_at_id", "status", "created_at", "id"),
+    )
+
+
+class OrderItem(Base):
+    __tablename__ = "order_items"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    order_id = Column(UUID(as_uuid=True), ForeignKey("orders.id", ondelete="CASCADE"), nullable=False, index=True)
+    # snapshot of what was bought, the product itself may change or disappear later
+    product_id = Column(UUID(as_uuid=True), ForeignKey("products.id", ondelete="SET NULL"), nullable=True)
+    unit_price = Column(Float, nullable=False)
+    quantity = Column(Integer, nullable=False)
+
+    # relationship
+    order = relationship("Order", back_populates="items")
 
 
 class Cart(Base):
@@ -87,10 +125,45 @@ class CartItem(Base):
     __tablename__ = "cart_items"
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
-    cart_id = Column(UUID(as_uuid=True), ForeignKey("carts.id", ondelete="CASCADE"))
+    cart_id = Column(UUID(as_uuid=True), ForeignKey("carts.id", ondelete="CASCADE"), index=True)
     product_id = Column(UUID(as_uuid=True), ForeignKey("products.id", ondelete="CASCADE"))
     quantity = Column(Integer, nullable=False, default=1)
 
     # relationship ->
     cart = relationship("Cart", back_populates="cart_items")
     product = relationship("Product", lazy="joined")
+
+
+class StockReservation(Base):
+    __tablename__ = "stock_reservations"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    cart_item_id = Column(UUID(as_uuid=True), ForeignKey("cart_items.id", ondelete="CASCADE"), unique=True,
+                          nullable=False)
+    product_id = Column(UUID(as_uuid=True), ForeignKey("products.id", ondelete="CASCADE"), nullable=False)
+    quantity = Column(Integer, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # covers the "active holds per product" sum without touching the table
+        Index("ix_stock_reservations_product_expires", "product_id", "expires_at", "quantity"),
+        Index("ix_stock_reservations_expires_at", "expires_at"),
+    )
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(sql_enum(JobStatusEnum), default=JobStatusEnum.PENDING, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    # when a pending job is due, or when the lease of a running one runs out and another worker may take it over
+    run_at = Column(DateTime, nullable=False, default=datetime.now)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
@@ -1,49 +1,136 @@
-from fastapi import APIRouter, status, HTTPException, Depends
+from datetime import datetime
+from os import getenv
+from fastapi import APIRouter, status, HTTPException, Depends, Request, Query
+from pydantic import ValidationError
+from sqlalchemy import select, tuple_
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
-from src.models.app_model import Category, Product, OrderStatusEnum, Order
-from src.schemas.categories import CategoryCreate, CategoryOut
-from src.schemas.product_schema import ProductCreate
+from src.models.app_model import Category, Product, OrderStatusEnum, Order, User
+from src.schemas.categories import CategoryCreate, CategoryOut, CategoryWithCounts
+from src.schemas.order_schema import OrderPage
+from src.schemas.product_schema import ProductCreate, ProductImportReport, ProductImportError
 from src.utils.looger_handler import logger
-from src.config.db_setup import get_db
+from src.config.db_setup import get_read_db, get_write_db, dialect_insert
 from src.routers.auth_router import is_admin_user
+from src.routers.category_router import CATEGORY_COLUMNS, category_counts_query
 from src.schemas.user_schema import UserOut
+from src.utils.user_cache import user_cache
+from src.utils.search_index import search_index
+from src.utils.catalog_cache import catalog_cache
+from src.utils.cache_backend import invalidate, cache_sync_stats
+from src.utils.product_import import iter_import_rows
+from src.utils.export import export_response, ExportFormatEnum
+from src.utils.pagination import encode_cursor, decode_cursor, InvalidCursor
+from src.utils.query_budget import query_budget
+from src.utils.serialization import json_response, rows_as_dicts
+from src.utils.rate_limit import admission_stats
+from src.utils.idempotency import idempotency_store
+from src.utils.jobs import notify, queue_stats
+from src.utils.order_jobs import enqueue_status_changed
 
 admin_routes = APIRouter(prefix="/api/admin", tags=["Admin routes"], dependencies=[Depends(is_admin_user)])
 
+PRODUCT_IMPORT_BATCH_SIZE = int(getenv("PRODUCT_IMPORT_BATCH_SIZE", "1000"))
+PRODUCT_IMPORT_MAX_ERRORS = 100
+
 
 # check is user admin?
 @admin_routes.get("/is_user_admin", status_code=status.HTTP_200_OK)
+@query_budget(1)
 async def check_admin(current_user: UserOut = Depends(is_admin_user)) -> bool:
     return current_user.is_admin
 
 
+# user routes ->
+@admin_routes.put("/user/update_admin/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+@query_budget(2)
+async def update_admin_flag(user_id: UUID, is_admin: bool, db: AsyncSession = Depends(get_write_db)):
+    is_user_exist = await db.scalar(select(User).filter(User.id == user_id))  # type:ignore
+    if is_user_exist is None:
+        logger.warning(f"User {user_id} doesn't exist!")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+
+    try:
+        is_user_exist.is_admin = is_admin
+        await db.commit()
+        await invalidate("user", is_user_exist.email)
+        logger.info(f"Admin flag of user {is_user_exist.username} has been set to {is_admin}")
+    except SQLAlchemyError as e:
+        logger.error(f"Failed to update admin flag of user {user_id}: {str(e)}")
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to update user {user_id}: {e}")
+
+
+@admin_routes.get("/user_cache_stats", status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def get_user_cache_stats() -> dict:
+    return user_cache.stats()
+
+
+@admin_routes.get("/catalog_cache_stats", status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def get_catalog_cache_stats() -> dict:
+    return catalog_cache.stats()
+
+
+@admin_routes.get("/cache_sync_stats", status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def get_cache_sync_stats() -> dict:
+    return cache_sync_stats()
+
+
+@admin_routes.get("/admission_stats", status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def get_admission_stats() -> dict:
+    return admission_stats()
+
+
+@admin_routes.get("/idempotency_stats", status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def get_idempotency_stats() -> dict:
+    return await idempotency_store.stats()
+
+
+@admin_routes.get("/job_stats", status_code=status.HTTP_200_OK)
+@query_budget(2)
+async def get_job_stats(db: AsyncSession = Depends(get_read_db)) -> dict:
+    return await queue_stats(db)
+
+
 # category routes ->
 @admin_routes.post("/add_category", status_code=status.HTTP_201_CREATED)
-async def add_new_category(category_data: CategoryCreate, db: Session = Depends(get_db)):
+@query_budget(3)
+async def add_new_category(category_data: CategoryCreate, db: AsyncSession = Depends(get_write_db)):
     new_category = Category(**category_data.model_dump())
 
     try:
         db.add(new_category)
-        db.commit()
-        db.refresh(new_category)
+        await db.commit()
+        await db.refresh(new_category)
+        await invalidate("catalog")
         logger.info(f"New Category {category_data.name} has been created successfully!")
     except Exception as e:
         logger.error(f"Failed to create new category {category_data.name}")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create new category {e}")
 
 
-@admin_routes.get("/categories", response_model=list[CategoryOut], status_code=status.HTTP_200_OK)
-async def get_categories(db: Session = Depends(get_db)):
-    categories = db.query(Category).all()
-    return categories
+@admin_routes.get("/categories", response_model=list[CategoryWithCounts] | list[CategoryOut],
+                  status_code=status.HTTP_200_OK)
+@query_budget(2)
+async def get_categories(with_counts: bool = False, db: AsyncSession = Depends(get_read_db)):
+    query = category_counts_query() if with_counts else select(*CATEGORY_COLUMNS)
+    categories = (await db.execute(query)).all()
+    return json_response(list[CategoryWithCounts] if with_counts else list[CategoryOut], rows_as_dicts(categories))
 
 
-@admin_routes.get("/category/{category_id}", response_model=CategoryOut, status_code=status.HTTP_200_OK)
-async def get_category(category_id: UUID, db: Session = Depends(get_db)):
-    category = db.query(Category).filter(Category.id == category_id).first()  # type:ignore
+@admin_routes.get("/category/{category_id}", response_model=CategoryWithCounts | CategoryOut,
+                  status_code=status.HTTP_200_OK)
+@query_budget(2)
+async def get_category(category_id: UUID, with_counts: bool = False, db: AsyncSession = Depends(get_read_db)):
+    query = category_counts_query() if with_counts else select(*CATEGORY_COLUMNS)
+    category = (await db.execute(query.filter(Category.id == category_id))).first()  # type:ignore
     if category is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
     return category
@@ -51,13 +138,17 @@ async def get_category(category_id: UUID, db: Session = Depends(get_db)):
 
 # product router ->
 @admin_routes.post("/product/add_product", status_code=status.HTTP_201_CREATED)
-async def add_new_product(new_product: ProductCreate, db: Session = Depends(get_db)):
-    is_category_exist = db.query(Category).filter(Category.id == new_product.category_id).first()  # type:ignore
+@query_budget(5)
+async def add_new_product(new_product: ProductCreate, db: AsyncSession = Depends(get_write_db)):
+    is_category_exist = await db.scalar(
+        select(Category.id).filter(Category.id == new_product.category_id)  # type:ignore
+    )
     if is_category_exist is None:
         logger.warning(f"Category doesn't exist! please register first")
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Category doesn't Exist! please re-check id!")
 
     new_product = Product(
+        sku=new_product.sku,
         name=new_product.name,
         description=new_product.description,
         price=new_product.price,
@@ -67,19 +158,24 @@ async def add_new_product(new_product: ProductCreate, db: Session = Depends(get_
     )
     try:
         db.add(new_product)
-        db.commit()
+        await db.flush()
+        await search_index.upsert(db, new_product)
+        await db.commit()
+        await invalidate("catalog")
         logger.info(f"Product {new_product.name} has been successfully created!")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create new product {e}")
 
 
 @admin_routes.put("/product/update/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def update_product(new_product: ProductCreate, product_id: UUID, db: Session = Depends(get_db)):
-    is_product_exist = db.query(Product).filter(Product.id == product_id).first()  # type:ignore
+@query_budget(5)
+async def update_product(new_product: ProductCreate, product_id: UUID, db: AsyncSession = Depends(get_write_db)):
+    is_product_exist = await db.scalar(select(Product).filter(Product.id == product_id))  # type:ignore
     if is_product_exist is None:
         logger.warning(f"Product doesn't exist! please register first")
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Product doesn't Exist! please re-check id!")
+    is_product_exist.sku = new_product.sku
     is_product_exist.name = new_product.name
     is_product_exist.description = new_product.description
     is_product_exist.price = new_product.price
@@ -88,44 +184,180 @@ async def update_product(new_product: ProductCreate, product_id: UUID, db: Sessi
     is_product_exist.image_url = new_product.image_url
 
     try:
-        db.commit()
+        await search_index.upsert(db, is_product_exist)
+        await db.commit()
+        await invalidate("catalog")
         logger.info(f"Product {new_product.name} has been updated Successfully!")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error("Failed to update existing product!")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to update Product {e}")
 
 
 @admin_routes.delete("/product/remove/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def remove_product(product_id: UUID, db: Session = Depends(get_db)):
-    is_product_exist = db.query(Product).filter(Product.id == product_id).first()  # type:ignore
+@query_budget(4)
+async def remove_product(product_id: UUID, db: AsyncSession = Depends(get_write_db)):
+    is_product_exist = await db.scalar(select(Product).filter(Product.id == product_id))  # type:ignore
     if is_product_exist is None:
         logger.warning(f"Product {product_id} doesn't exist! please verify product id.")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Product doesn't exist")
     try:
-        db.delete(is_product_exist)
-        db.commit()
+        await search_index.remove(db, is_product_exist.id)
+        await db.delete(is_product_exist)
+        await db.commit()
+        await invalidate("catalog")
         logger.info(f"Product {is_product_exist.name} has been removed successfully!")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         logger.error(f"Failed to remove product {product_id}")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to remove product {e}")
 
 
+async def _upsert_products(db: AsyncSession, rows: list[dict]) -> None:
+    stmt = dialect_insert(db)(Product)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Product.sku],
+        set_={column: stmt.excluded[column] for column in
+              ("name", "description", "price", "stock", "category_id", "image_url", "updated_at")},
+    ).returning(Product.id, Product.name, Product.description)
+
+    # executemany, rows carrying a known sku update the existing product in place
+    upserted = (await db.execute(stmt, rows)).all()
+    await search_index.upsert_many(db, upserted)
+    await db.commit()
+
+
+@admin_routes.post("/product/import", status_code=status.HTTP_200_OK, response_model=ProductImportReport)
+@query_budget(None, repeats=None)
+async def import_products(request: Request, batch_size: int = Query(PRODUCT_IMPORT_BATCH_SIZE, gt=0, le=10000),
+                          db: AsyncSession = Depends(get_write_db)):
+    content_type = request.headers.get("content-type", "")
+    if "csv" in content_type:
+        file_format = "csv"
+    elif "ndjson" in content_type or "jsonl" in content_type:
+        file_format = "ndjson"
+    else:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Send text/csv or application/x-ndjson")
+
+    categories = (await db.execute(select(Category.id, Category.name))).all()
+    category_ids = {category.id for category in categories}
+    category_ids_by_name = {category.name: category.id for category in categories}
+
+    report = ProductImportReport()
+    batch: dict[object, dict] = {}
+    batch_lines: dict[object, int] = {}  # the line every row of the batch comes from
+    batch_first_line = 0
+
+    def add_error(line_no: int, error: str, count: int = 1):
+        report.failed += count
+        if len(report.errors) < PRODUCT_IMPORT_MAX_ERRORS:
+            report.errors.append(ProductImportError(line=line_no, error=error))
+
+    async def flush():
+        nonlocal batch, batch_lines
+        if not batch:
+            return
+        try:
+            await _upsert_products(db, list(batch.values()))
+            report.imported += len(batch)
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Product import batch starting at line {batch_first_line} failed: {str(e)}")
+            add_error(batch_first_line, f"Batch failed: {e}", count=len(batch))
+        report.batches += 1
+        batch, batch_lines = {}, {}
+        logger.info(f"Product import progress: {report.imported} imported, {report.failed} failed")
+
+    async for line_no, row in iter_import_rows(request.stream(), file_format):
+        if isinstance(row, str):
+            add_error(line_no, row)
+            continue
+
+        if "category_id" not in row and "category" in row:
+            row["category_id"] = category_ids_by_name.get(row.pop("category"))
+        try:
+            product = ProductCreate.model_validate(row)
+        except ValidationError as e:
+            add_error(line_no, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+            continue
+        if product.category_id not in category_ids:
+            add_error(line_no, f"Category {product.category_id} doesn't exist")
+            continue
+
+        if not batch:
+            batch_first_line = line_no
+        # a sku repeated within one batch keeps its last row, a single upsert statement can't touch a row twice, the
+        # row it replaces is reported as not imported
+        key = product.sku or ("line", line_no)
+        if key in batch:
+            add_error(batch_lines[key], f"Duplicate sku {product.sku}, replaced by line {line_no}")
+        batch[key] = product.model_dump()
+        batch_lines[key] = line_no
+        if len(batch) >= batch_size:
+            await flush()
+
+    await flush()
+    await invalidate("catalog")
+    logger.info(f"Product import finished: {report.imported} imported, {report.failed} failed")
+    return report
+
+
 # order router ->
+@admin_routes.get("/order/all", status_code=status.HTTP_200_OK, response_model=OrderPage)
+@query_budget(3)
+async def get_orders_by_status(order_status: OrderStatusEnum = Query(alias="status"), cursor: str | None = None,
+                               limit: int = Query(50, gt=0, le=200), db: AsyncSession = Depends(get_read_db)):
+    """
+        Newest orders first for one status, paged with the cursor from the previous page.
+    """
+    query = select(Order).filter(Order.status == order_status)  # type:ignore
+    if cursor is not None:
+        try:
+            created_at, last_id = decode_cursor(cursor)
+            key = (datetime.fromisoformat(created_at), UUID(last_id))
+        except (InvalidCursor, ValueError, TypeError) as e:
+            logger.warning(f"Invalid order cursor {cursor}: {e}")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        query = query.filter(tuple_(Order.created_at, Order.id) < key)
+
+    # one extra row tells us whether there is a next page
+    orders = (await db.scalars(query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1].created_at.isoformat(), orders[-1].id.hex)
+
+    logger.info(f"{len(orders)} {order_status.value} orders have been fetched")
+    return json_response(OrderPage, {"items": orders, "next_cursor": next_cursor})
+
+
+@admin_routes.get("/order/export", status_code=status.HTTP_200_OK)
+@query_budget(2)
+async def export_orders(file_format: ExportFormatEnum = Query(ExportFormatEnum.NDJSON, alias="format")):
+    query = select(Order.id, Order.user_id, Order.total_price, Order.status, Order.created_at,
+                   Order.updated_at).order_by(Order.created_at, Order.id)
+    return export_response(query, file_format, "orders")
+
+
 @admin_routes.put("/order/update_status/{order_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def update_status_in_order(order_id: UUID, new_status: OrderStatusEnum, db: Session = Depends(get_db)):
-    is_order = db.query(Order).filter(Order.id == order_id).first()  # type:ignore
+@query_budget(5)
+async def update_status_in_order(order_id: UUID, new_status: OrderStatusEnum, db: AsyncSession = Depends(get_write_db)):
+    is_order = await db.scalar(select(Order).filter(Order.id == order_id))  # type:ignore
     if is_order is None:
         logger.warning(f"Order {order_id} doesn't Found!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Order {order_id} doesn't Found!")
 
     try:
+        if is_order.status != new_status:
+            enqueue_status_changed(db, order_id, is_order.status, new_status)
         is_order.status = new_status
         logger.info(f"Order {order_id} has been updated!")
-        db.commit()
+        await db.commit()
+        notify()
     except SQLAlchemyError as e:
         logger.error(f"Failed to update order {order_id}: {str(e)}")
-        db.rollback()  # Rollback in case of error
+        await db.rollback()  # Rollback in case of error
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                             detail=f"Failed to update order {order_id}: {str(e)}")
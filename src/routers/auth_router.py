@@ -1,28 +1,34 @@
 from fastapi import APIRouter, HTTPException, status
 from fastapi.params import Depends
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
-from src.utils.looger_handler import logger
+from src.utils.looger_handler import logger, bind_user
 from src.utils.jwt_handler import get_jwt_token, verify_jwt_token
-from src.utils.password_handler import hash_password, verify_password
-from src.config.db_setup import get_db
+from src.utils.password_handler import hash_password_async, verify_password_async
+from src.utils.user_cache import user_cache
+from src.config.db_setup import get_read_db, get_write_db
 from src.models.app_model import User
 from src.schemas.user_schema import UserOut, UserIn
+from src.utils.query_budget import query_budget
+from src.utils.rate_limit import rate_limit, concurrency_limit
 
 auth_routes = APIRouter(prefix="/api/auth", tags=["Auth Routers"])
 
 oAuthBear = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
-@auth_routes.post("/register", status_code=status.HTTP_201_CREATED)
-async def signup(new_user: UserIn, db: Session = Depends(get_db)):
-    is_user_exist = db.query(User).filter(User.email == new_user.email).first()  # type:ignore
+@auth_routes.post("/register", status_code=status.HTTP_201_CREATED,
+                  dependencies=[Depends(rate_limit("register")), Depends(concurrency_limit("password"))])
+@query_budget(2)
+async def signup(new_user: UserIn, db: AsyncSession = Depends(get_write_db)):
+    is_user_exist = await db.scalar(select(User).filter(User.email == new_user.email))  # type:ignore
     if is_user_exist:
         logger.warning("User doesn't exists! please signup")
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Email already exists!")
 
-    hashed_password = hash_password(new_user.password)
+    hashed_password = await hash_password_async(new_user.password)
     user = User(
         username=new_user.username,
         email=new_user.email,
@@ -31,21 +37,23 @@ async def signup(new_user: UserIn, db: Session = Depends(get_db)):
 
     try:
         db.add(user)
-        db.commit()
+        await db.commit()
         logger.info(f"User {user.username} has been created successfully!")
     except Exception as e:
         logger.error(f"Failed to create new user {user.username}")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to add new user: {e}")
 
 
-@auth_routes.post("/login", status_code=status.HTTP_200_OK)
-async def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)) -> dict:
-    is_user_exist = db.query(User).filter(User.email == form.username).first()  # type:ignore
+@auth_routes.post("/login", status_code=status.HTTP_200_OK,
+                  dependencies=[Depends(rate_limit("login")), Depends(concurrency_limit("password"))])
+@query_budget(1)
+async def login(form: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_read_db)) -> dict:
+    is_user_exist = await db.scalar(select(User).filter(User.email == form.username))  # type:ignore
     if is_user_exist is None:
         logger.exception("User doesn't exists! please signup")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User doesn't exist! please signup")
 
-    if not verify_password(form.password, is_user_exist.password):
+    if not await verify_password_async(form.password, is_user_exist.password):
         logger.exception(f"Incorrect password attempt for user {is_user_exist.username}")
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Incorrect email or password!")
 
@@ -55,7 +63,12 @@ async def login(form: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
     return {"access_token": access_token, "token_type": "bearer"}
 
 
-def get_user(token: str = Depends(oAuthBear), db: Session = Depends(get_db)) -> UserOut:
+async def get_user(token: str = Depends(oAuthBear), db: AsyncSession = Depends(get_read_db)) -> UserOut:
+    cached_user = user_cache.get(token)
+    if cached_user is not None:
+        bind_user(cached_user.username)
+        return cached_user
+
     payload = verify_jwt_token(token)
 
     if not payload:
@@ -63,13 +76,16 @@ def get_user(token: str = Depends(oAuthBear), db: Session = Depends(get_db)) ->
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
 
     email = payload.get("sub")
-    user = db.query(User).filter(User.email == email).first()  # type:ignore
+    user = await db.scalar(select(User).filter(User.email == email))  # type:ignore
 
     if user is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User does not found")
 
-    return UserOut(id=user.id, username=user.username, email=user.email, is_admin=user.is_admin,
-                   created_at=user.created_at, updated_at=user.updated_at)
+    current_user = UserOut(id=user.id, username=user.username, email=user.email, is_admin=user.is_admin,
+                           created_at=user.created_at, updated_at=user.updated_at)
+    user_cache.set(token, current_user, payload.get("exp"))
+    bind_user(current_user.username)
+    return current_user
 
 
 def is_admin_user(current_user: UserOut = Depends(get_user)) -> UserOut:
@@ -79,5 +95,5 @@ def is_admin_user(current_user: UserOut = Depends(get_user)) -> UserOut:
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have admin privileges",
         )
-    logger.info(f"Admin access granted to {current_user.username}")
+    logger.debug(f"Admin access granted to {current_user.username}")
     return current_user
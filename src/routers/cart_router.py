@@ -1,21 +1,30 @@
+from collections import defaultdict
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from uuid import UUID
+from sqlalchemy import select, delete, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import noload
+from uuid import UUID, uuid4
 
-from src.schemas.cart_schema import CartOut, CartItemOut, CartCreate
+from src.schemas.cart_schema import (CartOut, CartItemOut, CartCreate, CartBatchIn, CartBatchLineResult,
+                                     CartOperationEnum)
 from src.utils.looger_handler import logger
-from src.config.db_setup import get_db
+from src.config.db_setup import get_read_db, get_write_db, run_with_retry
 from src.routers.user_router import get_current_user
 from src.schemas.user_schema import UserOut
 from src.models.app_model import Cart, Product, CartItem
+from src.utils.reservations import reserved_quantities, active_holds, claim, release
+from src.utils.query_budget import query_budget
+from src.utils.serialization import json_response, rows_as_dicts
 
 cart_routes = APIRouter(prefix="/api/cart", tags=["cart"])
 
 
 # CART ->
 @cart_routes.get("/get_cart", status_code=status.HTTP_200_OK, response_model=CartOut)
-async def get_cart(db: Session = Depends(get_db), current_user: UserOut = Depends(get_current_user)):
-    is_cart_exist = db.query(Cart).filter(Cart.user_id == current_user.id).first()  # type:ignore
+@query_budget(2)
+async def get_cart(db: AsyncSession = Depends(get_read_db), current_user: UserOut = Depends(get_current_user)):
+    is_cart_exist = await db.scalar(select(Cart).filter(Cart.user_id == current_user.id))  # type:ignore
     if is_cart_exist is None:
         logger.info(f"Cart {current_user.username} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
@@ -24,34 +33,44 @@ async def get_cart(db: Session = Depends(get_db), current_user: UserOut = Depend
 
 
 @cart_routes.post("/add_cart", status_code=status.HTTP_200_OK)
-async def add_cart(db: Session = Depends(get_db), current_user: UserOut = Depends(get_current_user)):
-    is_cart_exist = db.query(Cart).filter(Cart.user_id == current_user.id).first()  # type:ignore
+@query_budget(3)
+async def add_cart(db: AsyncSession = Depends(get_write_db), current_user: UserOut = Depends(get_current_user)):
+    is_cart_exist = await db.scalar(select(Cart).filter(Cart.user_id == current_user.id))  # type:ignore
     if is_cart_exist:
         logger.info(f"Cart {current_user.id} already exists!")
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Cart already exists")
 
-    cart = Cart(user_id=current_user.id)
-    try:
+    async def create_cart():
+        cart = Cart(id=uuid4(), user_id=current_user.id)
         db.add(cart)
-        db.commit()
-        db.refresh(cart)  # Make sure to refresh to get the ID after commit
+        await db.commit()
+        return cart
+
+    try:
+        cart = await run_with_retry(db, create_cart)
         logger.info(f"Cart {current_user.id} has been created!")
         return cart  # Ensure you are returning the cart object
     except Exception as e:
         logger.error(f"Failed to create cart {current_user.id}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=f"Failed to create cart: {e}")
 
 
 @cart_routes.delete("/remove_cart", status_code=status.HTTP_204_NO_CONTENT)
-async def remove_cart(db: Session = Depends(get_db), current_user: UserOut = Depends(get_current_user)):
-    is_cart_exist = db.query(Cart).filter(Cart.user_id == current_user.id).first()  # type:ignore
+@query_budget(7)
+async def remove_cart(db: AsyncSession = Depends(get_write_db), current_user: UserOut = Depends(get_current_user)):
+    is_cart_exist = await db.scalar(select(Cart).filter(Cart.user_id == current_user.id))  # type:ignore
     if is_cart_exist is None:
         logger.info(f"Cart {current_user.username} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
     try:
-        db.delete(is_cart_exist)
-        db.commit()
+        cart_item_ids = (await db.scalars(
+            select(CartItem.id).filter(CartItem.cart_id == is_cart_exist.id)  # type:ignore
+        )).all()
+        await release(db, cart_item_ids)
+        await db.execute(delete(CartItem).filter(CartItem.cart_id == is_cart_exist.id))  # type:ignore
+        await db.delete(is_cart_exist)
+        await db.commit()
         logger.info(f"User {current_user.username}'s cart has been removed successfully!")
     except Exception as e:
         logger.error(f"Failed to remove cart {current_user.id}")
@@ -60,90 +79,209 @@ async def remove_cart(db: Session = Depends(get_db), current_user: UserOut = Dep
 
 # CART_ITEM ->
 @cart_routes.get("/get_cart_items", status_code=status.HTTP_200_OK, response_model=list[CartItemOut])
-async def get_cart_items(db: Session = Depends(get_db), current_user: UserOut = Depends(get_current_user)):
-    is_cart_exist = db.query(Cart).filter(Cart.user_id == current_user.id).first()  # type:ignore
+@query_budget(3)
+async def get_cart_items(db: AsyncSession = Depends(get_read_db), current_user: UserOut = Depends(get_current_user)):
+    is_cart_exist = await db.scalar(select(Cart).filter(Cart.user_id == current_user.id))  # type:ignore
     if is_cart_exist is None:
         logger.info(f"Cart {current_user.username} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
 
     logger.info(f"Cart items has been successfully retrieved for user {current_user.username}!")
-    cart_items = db.query(CartItem).filter(CartItem.cart_id == is_cart_exist.id).all()  # type:ignore
-    return cart_items
+    # columns only, a CartItem entity would also join its product in
+    cart_items = (await db.execute(
+        select(CartItem.id, CartItem.cart_id, CartItem.product_id, CartItem.quantity)
+        .filter(CartItem.cart_id == is_cart_exist.id)  # type:ignore
+    )).all()
+    return json_response(list[CartItemOut], rows_as_dicts(cart_items))
 
 
 @cart_routes.post("/add_cart_item", status_code=status.HTTP_201_CREATED)
-async def add_cart_item(cart_item: CartCreate, db: Session = Depends(get_db),
+@query_budget(7)
+async def add_cart_item(cart_item: CartCreate, db: AsyncSession = Depends(get_write_db),
                         current_user: UserOut = Depends(get_current_user)):
-    is_cart_exist = db.query(Cart).filter(Cart.user_id == current_user.id).first()  # type:ignore
+    is_cart_exist = await db.scalar(select(Cart).filter(Cart.user_id == current_user.id))  # type:ignore
     if is_cart_exist is None:
         logger.info(f"Cart {current_user.username} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
 
-    is_product_exist = db.query(Product).filter(Product.id == cart_item.product_id).first()  # type:ignore
-    if is_product_exist is None:
+    product_stock = await db.scalar(select(Product.stock).filter(Product.id == cart_item.product_id))  # type:ignore
+    if product_stock is None:
         logger.info(f"Product {cart_item.product_id} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-    if is_product_exist.stock < cart_item.quantity:
+    reserved = (await reserved_quantities(db, [cart_item.product_id])).get(cart_item.product_id, 0)
+    if product_stock - reserved < cart_item.quantity:
         logger.warning(f"Product {cart_item.product_id} doesn't have enough stock!")
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Product doesn't have enough stock!")
 
-    is_product_exist.stock -= cart_item.quantity
-    new_cart_item = CartItem(
-        cart_id=is_cart_exist.id,
-        product_id=cart_item.product_id,
-        quantity=cart_item.quantity
-    )
-    db.add(new_cart_item)
-    db.commit()  # Save changes to the database
+    # the check above only turns away requests that can't fit without taking the write lock, claim() is the
+    # authoritative one. Stock is only held here, checkout turns the hold into a real decrement
+    cart_id = is_cart_exist.id
+
+    async def add_and_claim():
+        new_cart_item = CartItem(
+            id=uuid4(),
+            cart_id=cart_id,
+            product_id=cart_item.product_id,
+            quantity=cart_item.quantity
+        )
+        db.add(new_cart_item)
+        await db.flush()
+        await claim(db, [new_cart_item])
+        await db.commit()  # Save changes to the database
+
+    await run_with_retry(db, add_and_claim)
 
     logger.info(f"Product {cart_item.product_id} added to cart for user {current_user.username}")
 
 
 @cart_routes.put("/update_cart_item/{cart_item_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def edit_cart_item(cart_item_id: UUID, quantity: int = Query(gt=0), db: Session = Depends(get_db),
+@query_budget(7)
+async def edit_cart_item(cart_item_id: UUID, quantity: int = Query(gt=0), db: AsyncSession = Depends(get_write_db),
                          current_user: UserOut = Depends(get_current_user)):
-    is_cart_exist = db.query(CartItem).filter(CartItem.id == cart_item_id).first()  # type:ignore
+    is_cart_exist = await db.scalar(select(CartItem).filter(CartItem.id == cart_item_id))  # type:ignore
     if is_cart_exist is None:
         logger.info(f"Cart item {cart_item_id} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
 
-    is_product_exist = db.query(Product).filter(Product.id == is_cart_exist.product_id).first()  # type:ignore
-    if not is_product_exist:
+    product_stock = await db.scalar(select(Product.stock).filter(Product.id == is_cart_exist.product_id))  # type:ignore
+    if product_stock is None:
         logger.warning(f"Product {is_cart_exist.product_id} doesn't exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
 
-    if is_product_exist.stock + is_cart_exist.quantity < quantity:
+    reserved = (await reserved_quantities(db, [is_cart_exist.product_id], exclude_cart_item_ids=[cart_item_id])).get(
+        is_cart_exist.product_id, 0)
+    if product_stock - reserved < quantity:
         logger.warning(f"Product {is_cart_exist.product_id} doesn't have enough stock!")
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Product doesn't have enough stock!")
 
-    is_product_exist.stock += is_cart_exist.quantity - quantity
-    is_cart_exist.quantity = quantity
-    db.commit()
+    async def update_and_claim():
+        cart_line = (await db.execute(
+            update(CartItem).filter(CartItem.id == cart_item_id).values(quantity=quantity)  # type:ignore
+            .returning(CartItem.id, CartItem.product_id, CartItem.quantity)
+        )).one()
+        await claim(db, [cart_line])
+        await db.commit()
+
+    await run_with_retry(db, update_and_claim)
     logger.info(f"Cart item {cart_item_id} has been updated successfully!")
-    return is_cart_exist
 
 
 @cart_routes.delete("/remove_cart_item/{cart_item_id}", status_code=status.HTTP_204_NO_CONTENT)
-async def remove_cart_item(cart_item_id: UUID, db: Session = Depends(get_db),
+@query_budget(4)
+async def remove_cart_item(cart_item_id: UUID, db: AsyncSession = Depends(get_write_db),
                            current_user: UserOut = Depends(get_current_user)):
-    is_cart_item_exist = db.query(CartItem).filter(CartItem.id == cart_item_id).first()  # type:ignore
+    is_cart_item_exist = await db.scalar(select(CartItem).filter(CartItem.id == cart_item_id))  # type:ignore
     if is_cart_item_exist is None:
         logger.info(f"Cart item {cart_item_id} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart item not found")
 
-    is_product = db.query(Product).filter(Product.id == is_cart_item_exist.product_id).first()  # type:ignore
-    if is_product is None:
-        logger.warning(f"Product {is_cart_item_exist.product_id} doesn't exist!")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product not found")
-
-    is_product.stock += is_cart_item_exist.quantity
-    db.commit()
     try:
-        db.delete(is_cart_item_exist)
-        db.commit()
+        await release(db, [cart_item_id])
+        await db.delete(is_cart_item_exist)
+        await db.commit()
         logger.info(f"Cart item {cart_item_id} has been removed successfully!")
 
     except Exception as e:
         logger.error(f"Failed to remove cart item {cart_item_id}")
         raise Exception(f"Failed to remove cart item: {e}")
+
+
+@cart_routes.post("/batch_cart_items", status_code=status.HTTP_200_OK, response_model=list[CartBatchLineResult])
+@query_budget(10)
+async def batch_cart_items(batch: CartBatchIn, db: AsyncSession = Depends(get_write_db),
+                           current_user: UserOut = Depends(get_current_user)):
+    is_cart_exist = await db.scalar(select(Cart).filter(Cart.user_id == current_user.id))  # type:ignore
+    if is_cart_exist is None:
+        logger.info(f"Cart {current_user.username} does not exist!")
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cart not found")
+
+    cart_id = is_cart_exist.id
+
+    # the whole batch is rebuilt from fresh reads if its transaction has to be retried
+    async def apply_batch() -> list[CartBatchLineResult]:
+        cart_item_ids = {operation.cart_item_id for operation in batch.operations if operation.cart_item_id}
+        cart_items = {}
+        if cart_item_ids:
+            cart_items = {item.id: item for item in await db.scalars(
+                select(CartItem).filter(CartItem.cart_id == cart_id, CartItem.id.in_(cart_item_ids))  # type:ignore
+                .options(noload(CartItem.product))
+            )}
+
+        # every product touched by the batch, validated against with a single query
+        product_ids = {operation.product_id for operation in batch.operations if operation.product_id}
+        product_ids |= {item.product_id for item in cart_items.values()}
+        stock = {}
+        if product_ids:
+            stock = dict((await db.execute(
+                select(Product.id, Product.stock).filter(Product.id.in_(product_ids))
+            )).all())
+        reserved_by_others = await reserved_quantities(db, product_ids, exclude_cart_item_ids=cart_items.keys())
+        held = await active_holds(db, cart_items.keys())
+
+        # what the lines of this batch hold per product, kept up to date as operations apply
+        claimed = defaultdict(int)
+        for item in cart_items.values():
+            claimed[item.product_id] += held.get(item.id, 0)
+
+        def available(product_id: UUID) -> int:
+            return stock[product_id] - reserved_by_others.get(product_id, 0) - claimed[product_id]
+
+        to_hold = {}
+        results = []
+        for index, operation in enumerate(batch.operations):
+            result = CartBatchLineResult(index=index, op=operation.op, ok=False, cart_item_id=operation.cart_item_id)
+            results.append(result)
+
+            if operation.op == CartOperationEnum.ADD:
+                if operation.product_id not in stock:
+                    result.detail = "Product not found"
+                elif available(operation.product_id) < operation.quantity:
+                    result.detail = "Product doesn't have enough stock!"
+                else:
+                    new_cart_item = CartItem(id=uuid4(), cart_id=cart_id, product_id=operation.product_id,
+                                             quantity=operation.quantity)
+                    db.add(new_cart_item)
+                    cart_items[new_cart_item.id] = to_hold[new_cart_item.id] = new_cart_item
+                    held[new_cart_item.id] = operation.quantity
+                    claimed[operation.product_id] += operation.quantity
+                    result.ok, result.cart_item_id = True, new_cart_item.id
+                continue
+
+            cart_item = cart_items.get(operation.cart_item_id)
+            if cart_item is None:
+                result.detail = "Cart item not found"
+                continue
+            if cart_item.product_id not in stock:
+                result.detail = "Product not found"
+                continue
+
+            if operation.op == CartOperationEnum.UPDATE:
+                if available(cart_item.product_id) + held.get(cart_item.id, 0) < operation.quantity:
+                    result.detail = "Product doesn't have enough stock!"
+                    continue
+                claimed[cart_item.product_id] += operation.quantity - held.get(cart_item.id, 0)
+                held[cart_item.id] = cart_item.quantity = operation.quantity
+                to_hold[cart_item.id] = cart_item
+            else:
+                claimed[cart_item.product_id] -= held.pop(cart_item.id, 0)
+                await db.delete(cart_item)
+                del cart_items[cart_item.id]
+                to_hold.pop(cart_item.id, None)
+            result.ok = True
+
+        await db.flush()
+        await release(db, cart_item_ids - cart_items.keys())
+        await claim(db, to_hold.values())
+        await db.commit()
+        return results
+
+    try:
+        results = await run_with_retry(db, apply_batch)
+        logger.info(f"Cart batch of {len(batch.operations)} operations applied for user {current_user.username}")
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"Failed to apply cart batch for user {current_user.username}: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to apply cart batch: {e}")
+
+    return results
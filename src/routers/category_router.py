@@ -1,23 +1,66 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Query
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
-from src.config.db_setup import get_db
-from src.schemas.categories import CategoryOut
-from src.models.app_model import Category
+from src.config.db_setup import get_read_db
+from src.schemas.categories import CategoryOut, CategoryWithCounts
+from src.models.app_model import Category, Product
+from src.utils.catalog_cache import catalog_cache, IN_STOCK_TAG
+from src.utils.serialization import rows_as_dicts
+from src.utils.export import export_response, ExportFormatEnum
+from src.utils.query_budget import query_budget
 
 category_routes = APIRouter(prefix="/api/category", tags=["Category Route"])
 
+# project only what CategoryOut needs instead of loading Category entities
+CATEGORY_COLUMNS = (Category.id, Category.name, Category.description)
 
-@category_routes.get("/all", response_model=list[CategoryOut], status_code=status.HTTP_200_OK)
-async def get_categories(db: Session = Depends(get_db)):
-    categories = db.query(Category).all()
-    return categories
 
+def category_counts_query():
+    return (
+        select(*CATEGORY_COLUMNS,
+               func.count(Product.id).label("product_count"),
+               func.count(case((Product.stock > 0, Product.id))).label("in_stock_count"))
+        .outerjoin(Product, Product.category_id == Category.id)  # type:ignore
+        .group_by(Category.id)
+    )
 
-@category_routes.get("/{category_id}", response_model=CategoryOut, status_code=status.HTTP_200_OK)
-async def get_category(category_id: UUID, db: Session = Depends(get_db)):
-    category = db.query(Category).filter(Category.id == category_id).first()  # type:ignore
+
+@category_routes.get("/all", response_model=list[CategoryWithCounts] | list[CategoryOut],
+                     status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def get_categories(request: Request, with_counts: bool = False, db: AsyncSession = Depends(get_read_db)):
+    cached = catalog_cache.lookup(request)
+    if cached is not None:
+        return cached
+
+    if with_counts:
+        categories = (await db.execute(category_counts_query())).all()
+        return catalog_cache.store(request, list[CategoryWithCounts], rows_as_dicts(categories), [IN_STOCK_TAG])
+
+    categories = (await db.execute(select(*CATEGORY_COLUMNS))).all()
+    return catalog_cache.store(request, list[CategoryOut], rows_as_dicts(categories))
+
+
+@category_routes.get("/export", status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def export_categories(file_format: ExportFormatEnum = Query(ExportFormatEnum.NDJSON, alias="format")):
+    return export_response(select(*CATEGORY_COLUMNS).order_by(Category.id), file_format, "categories")
+
+
+@category_routes.get("/{category_id}", response_model=CategoryWithCounts | CategoryOut, status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def get_category(request: Request, category_id: UUID, with_counts: bool = False,
+                       db: AsyncSession = Depends(get_read_db)):
+    cached = catalog_cache.lookup(request)
+    if cached is not None:
+        return cached
+
+    query = category_counts_query() if with_counts else select(*CATEGORY_COLUMNS)
+    category = (await db.execute(query.filter(Category.id == category_id))).first()  # type:ignore
     if category is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Category not found")
-    return category
+    if with_counts:
+        return catalog_cache.store(request, CategoryWithCounts, category, [IN_STOCK_TAG])
+    return catalog_cache.store(request, CategoryOut, category)
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, status
+from fastapi.responses import PlainTextResponse
+
+from src.utils.metrics import metrics
+from src.utils.query_budget import query_budget
+
+metrics_routes = APIRouter(tags=["Metrics"])
+
+
+@metrics_routes.get("/metrics", status_code=status.HTTP_200_OK, response_class=PlainTextResponse)
+@query_budget(0)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,68 +1,133 @@
+from collections import defaultdict
 from datetime import datetime
 from fastapi import APIRouter, status, Depends, HTTPException
-from sqlalchemy.orm import Session
-from uuid import UUID
+from sqlalchemy import select, delete, insert, update, bindparam, func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from uuid import UUID, uuid4
 
 from src.schemas.order_schema import OrderOut
 from src.utils.looger_handler import logger
-from src.models.app_model import Cart, CartItem, Order, Product, OrderStatusEnum
-from src.config.db_setup import get_db
+from src.models.app_model import Cart, CartItem, Order, OrderItem, Product, OrderStatusEnum
+from src.config.db_setup import get_read_db, get_write_db, run_with_retry
 from src.routers.user_router import get_current_user
 from src.schemas.user_schema import UserOut
+from src.utils.cache_backend import invalidate
+from src.utils.catalog_cache import IN_STOCK_TAG
+from src.utils.reservations import reserved_quantities, release, active_hold_total, InsufficientStock
+from src.utils.query_budget import query_budget
+from src.utils.serialization import json_response
+from src.utils.rate_limit import rate_limit, concurrency_limit
+from src.utils.jobs import notify
+from src.utils.order_jobs import enqueue_order_placed
 
 order_routes = APIRouter(prefix="/api/order", tags=["Orders Routes"])
 
 
-@order_routes.post("/create_order", status_code=status.HTTP_201_CREATED)
-async def create_order(db: Session = Depends(get_db), current_user: UserOut = Depends(get_current_user)):
-    is_cart = db.query(Cart).filter(Cart.user_id == current_user.id).first()  # type:ignore
-    if is_cart is None or not is_cart.cart_items:
+@order_routes.post("/create_order", status_code=status.HTTP_201_CREATED,
+                   dependencies=[Depends(rate_limit("create_order")), Depends(concurrency_limit("checkout"))])
+@query_budget(12)
+async def create_order(db: AsyncSession = Depends(get_write_db), current_user: UserOut = Depends(get_current_user)):
+    is_cart = await db.scalar(select(Cart).filter(Cart.user_id == current_user.id))  # type:ignore
+    cart_items = []
+    if is_cart is not None:
+        cart_items = (await db.execute(
+            select(CartItem.id, CartItem.product_id, CartItem.quantity)
+            .filter(CartItem.cart_id == is_cart.id)  # type:ignore
+        )).all()
+    if not cart_items:
         logger.warning(f"Cart is empty for user {current_user.username}")
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cart is empty")
 
-    total_price = 0
-    for cart_item in is_cart.cart_items:
-        is_product = db.query(Product).filter(Product.id == cart_item.product_id).first()  # type:ignore
-        if is_product is None:
+    # one IN query for every product in the cart instead of one SELECT per line
+    products = {product.id: product for product in (await db.execute(
+        select(Product.id, Product.price, Product.stock)
+        .filter(Product.id.in_({item.product_id for item in cart_items}))
+    )).all()}
+    needed = defaultdict(int)
+    for cart_item in cart_items:
+        if cart_item.product_id not in products:
             logger.warning(f"Product {cart_item.product_id} does not exist!")
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product does not exist")
-        total_price += is_product.price * cart_item.quantity
-    new_order = Order(
-        user_id=current_user.id,
-        total_price=total_price,
-        status=OrderStatusEnum.PENDING,
-    )
-    db.add(new_order)
-    db.commit()
-    db.refresh(new_order)
-
-    db.query(CartItem).filter(CartItem.cart_id == is_cart.id).delete()  # type:ignore
-    db.commit()
-
-    db.query(Cart).filter(Cart.user_id == current_user.id).delete()  # type:ignore
-    db.commit()
+        needed[cart_item.product_id] += cart_item.quantity
 
+    # this cart's own holds (even expired ones) are what it is converting, only other carts' holds count against it
+    cart_item_ids = [item.id for item in cart_items]
+    reserved_by_others = await reserved_quantities(db, needed.keys(), exclude_cart_item_ids=cart_item_ids)
+    for product_id, quantity in needed.items():
+        if products[product_id].stock - reserved_by_others.get(product_id, 0) < quantity:
+            logger.warning(f"Product {product_id} doesn't have enough stock!")
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Product doesn't have enough stock!")
+
+    cart_id = is_cart.id
+    total_price = sum(products[item.product_id].price * item.quantity for item in cart_items)
+    products_table = Product.__table__
+    sold_out = 0
+
+    async def place_order():
+        nonlocal sold_out
+        new_order = Order(id=uuid4(), user_id=current_user.id, total_price=total_price, status=OrderStatusEnum.PENDING)
+        db.add(new_order)
+        await db.flush()
+        await db.execute(insert(OrderItem), [
+            {"order_id": new_order.id, "product_id": item.product_id, "unit_price": products[item.product_id].price,
+             "quantity": item.quantity}
+            for item in cart_items
+        ])
+        # the holds become a real decrement, conditional so that stock held by other carts is never sold
+        decremented = await db.execute(
+            update(products_table)
+            .where(products_table.c.id == bindparam("product_id"),
+                   products_table.c.stock - active_hold_total(exclude_cart_id=cart_id) >= bindparam("quantity"))
+            .values(stock=products_table.c.stock - bindparam("quantity")),
+            [{"product_id": product_id, "quantity": quantity} for product_id, quantity in needed.items()]
+        )
+        if decremented.rowcount != len(needed):
+            raise InsufficientStock("Products in the cart don't have enough stock")
+        # a product running out also changes the in stock filters and counts, not only the responses showing it
+        sold_out = await db.scalar(
+            select(func.count(Product.id)).filter(Product.id.in_(needed.keys()), Product.stock <= 0)  # type:ignore
+        )
+        await release(db, cart_item_ids)
+        # a second checkout of the same cart finds it gone, its lines are removed by the cart_cleanup job
+        if (await db.execute(delete(Cart).filter(Cart.id == cart_id))).rowcount != 1:  # type:ignore
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Cart has already been checked out")
+        enqueue_order_placed(db, new_order.id, cart_id, needed.keys())
+        await db.commit()
+
+    try:
+        await run_with_retry(db, place_order)
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.error(f"Failed to create order for user {current_user.username}: {str(e)}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to create order: {e}")
+
+    notify()
+    # only the cached responses showing the ordered products (or in stock filters when one sold out) are stale
+    await invalidate("catalog", ",".join([str(product_id) for product_id in needed] + [IN_STOCK_TAG] * bool(sold_out)))
     logger.info(f"Order has been created for user {current_user.username}")
 
 
 @order_routes.get("/all", status_code=status.HTTP_200_OK, response_model=list[OrderOut])
-async def get_orders(db: Session = Depends(get_db), current_user: UserOut = Depends(get_current_user)):
+@query_budget(3)
+async def get_orders(db: AsyncSession = Depends(get_read_db), current_user: UserOut = Depends(get_current_user)):
     """
         Retrieve all orders for the currently authenticated user.
     """
-    orders = db.query(Order).filter(Order.user_id == current_user.id).all()  # type:ignore
+    orders = (await db.scalars(select(Order).filter(Order.user_id == current_user.id))).all()  # type:ignore
     if not orders:
         logger.info(f"No orders found for user {current_user.username}")
         return []
 
     logger.info(f"{len(orders)} orders retrieved for user {current_user.username}")
-    return orders
+    return json_response(list[OrderOut], orders)
 
 
 @order_routes.get("/by_id/{order_id}", status_code=status.HTTP_200_OK, response_model=OrderOut)
-async def get_order_by_id(order_id: UUID, db: Session = Depends(get_db),
+@query_budget(3)
+async def get_order_by_id(order_id: UUID, db: AsyncSession = Depends(get_read_db),
                           current_user: UserOut = Depends(get_current_user)):
-    is_order = db.query(Order).filter(Order.id == order_id, Order.user_id == current_user.id).first()
+    is_order = await db.scalar(select(Order).filter(Order.id == order_id, Order.user_id == current_user.id))
     if is_order is None:
         logger.warning(f"Order {order_id} not found for user {current_user.username}")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Order doesn't Exists!")
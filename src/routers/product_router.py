@@ -1,27 +1,148 @@
-from fastapi import APIRouter, Depends, status, HTTPException
-from sqlalchemy.orm import Session
+from datetime import datetime
+from fastapi import APIRouter, Depends, status, HTTPException, Query, Request
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import UUID
 
 from src.utils.looger_handler import logger
-from src.config.db_setup import get_db
+from src.utils.pagination import encode_cursor, decode_cursor, InvalidCursor
+from src.utils.search_index import search_index
+from src.utils.catalog_cache import catalog_cache, IN_STOCK_TAG
+from src.utils.serialization import rows_as_dicts
+from src.utils.export import export_response, ExportFormatEnum
+from src.config.db_setup import get_read_db
 from src.models.app_model import Product
-from src.schemas.product_schema import ProductOut
+from src.schemas.product_schema import ProductOut, ProductPage, ProductSortEnum, SortOrderEnum
+from src.utils.query_budget import query_budget
 
 product_routes = APIRouter(prefix="/api/product", tags=["Product Route"])
 
+# rows instead of Product entities: no identity map, no relationship loaders, plain dicts for the serializer
+PRODUCT_COLUMNS = tuple(getattr(Product, field) for field in ProductOut.model_fields)
+
+SORT_COLUMNS = {
+    ProductSortEnum.PRICE: Product.price,
+    ProductSortEnum.CREATED_AT: Product.created_at,
+    ProductSortEnum.NAME: Product.name,
+}
+
+
+def _parse_cursor(cursor: str, sort_by: ProductSortEnum, order: SortOrderEnum) -> tuple:
+    try:
+        cursor_sort, cursor_order, value, last_id = decode_cursor(cursor)
+        if cursor_sort != sort_by.value or cursor_order != order.value:
+            raise InvalidCursor("Cursor was issued for a different sort order")
+        if sort_by == ProductSortEnum.CREATED_AT:
+            value = datetime.fromisoformat(value)
+        return value, UUID(last_id)
+    except (InvalidCursor, ValueError, TypeError) as e:
+        logger.warning(f"Invalid product cursor {cursor}: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+@product_routes.get("/all", status_code=status.HTTP_200_OK, response_model=ProductPage)
+@query_budget(1)
+async def all_products(request: Request, cursor: str | None = None, limit: int = Query(50, gt=0, le=200),
+                       category_id: UUID | None = None, min_price: float | None = Query(None, ge=0),
+                       max_price: float | None = Query(None, ge=0), in_stock: bool = False,
+                       sort_by: ProductSortEnum = ProductSortEnum.CREATED_AT, order: SortOrderEnum = SortOrderEnum.ASC,
+                       db: AsyncSession = Depends(get_read_db)):
+    cached = catalog_cache.lookup(request)
+    if cached is not None:
+        return cached
+
+    sort_column = SORT_COLUMNS[sort_by]
+    query = select(*PRODUCT_COLUMNS)
+
+    if category_id is not None:
+        query = query.filter(Product.category_id == category_id)  # type:ignore
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    if in_stock:
+        query = query.filter(Product.stock > 0)
+
+    if cursor is not None:
+        key = _parse_cursor(cursor, sort_by, order)
+        if order == SortOrderEnum.ASC:
+            query = query.filter(tuple_(sort_column, Product.id) > key)
+        else:
+            query = query.filter(tuple_(sort_column, Product.id) < key)
+
+    if order == SortOrderEnum.ASC:
+        query = query.order_by(sort_column.asc(), Product.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), Product.id.desc())
+
+    # one extra row tells us whether there is a next page
+    products = (await db.execute(query.limit(limit + 1))).all()
+    tags = [str(product.id) for product in products] + ([IN_STOCK_TAG] if in_stock else [])
+
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        next_cursor = encode_cursor(sort_by.value, order.value, getattr(last, sort_column.key), last.id.hex)
 
-@product_routes.get("/all", status_code=status.HTTP_200_OK, response_model=list[ProductOut])
-async def all_products(db: Session = Depends(get_db)):
-    products = db.query(Product).all()
     logger.info(f"All products has been fetched successfully!")
-    return products
+    return catalog_cache.store(request, ProductPage, {"items": rows_as_dicts(products), "next_cursor": next_cursor},
+                               tags)
+
+
+@product_routes.get("/search", status_code=status.HTTP_200_OK, response_model=ProductPage)
+@query_budget(1)
+async def search_products(request: Request, q: str = Query(..., min_length=1, max_length=128),
+                          cursor: str | None = None, limit: int = Query(20, gt=0, le=100),
+                          db: AsyncSession = Depends(get_read_db)):
+    cached = catalog_cache.lookup(request)
+    if cached is not None:
+        return cached
+
+    offset = 0
+    if cursor is not None:
+        try:
+            offset, = decode_cursor(cursor)
+            offset = int(offset)
+        except (InvalidCursor, ValueError, TypeError) as e:
+            logger.warning(f"Invalid search cursor {cursor}: {e}")
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+    product_ids = await search_index.search(db, q, limit=limit + 1, offset=offset)
+    next_cursor = encode_cursor(offset + limit) if len(product_ids) > limit else None
+    product_ids = product_ids[:limit]
+
+    products = {}
+    if product_ids:
+        products = {product["id"]: product for product in rows_as_dicts(
+            (await db.execute(select(*PRODUCT_COLUMNS).filter(Product.id.in_(product_ids)))).all())}
+
+    # keep the index ranking, skip ids that were removed in the meantime
+    return catalog_cache.store(request, ProductPage, {
+        "items": [products[product_id] for product_id in product_ids if product_id in products],
+        "next_cursor": next_cursor,
+    }, [str(product_id) for product_id in product_ids])
+
+
+@product_routes.get("/export", status_code=status.HTTP_200_OK)
+@query_budget(1)
+async def export_products(file_format: ExportFormatEnum = Query(ExportFormatEnum.NDJSON, alias="format")):
+    query = select(*PRODUCT_COLUMNS).order_by(Product.id)
+    return export_response(query, file_format, "products")
 
 
 @product_routes.get("/{product_id}", status_code=status.HTTP_200_OK, response_model=ProductOut)
-async def get_product_by_id(product_id: UUID, db: Session = Depends(get_db)):
-    is_product_exist = db.query(Product).filter(Product.id == product_id).first()  # type:ignore
+@query_budget(1)
+async def get_product_by_id(request: Request, product_id: UUID, db: AsyncSession = Depends(get_read_db)):
+    cached = catalog_cache.lookup(request)
+    if cached is not None:
+        return cached
+
+    is_product_exist = (await db.execute(
+        select(*PRODUCT_COLUMNS).filter(Product.id == product_id)  # type:ignore
+    )).first()
     if not is_product_exist:
         logger.warning(f"Product {product_id} does not exist!")
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Product does not found")
 
-    return is_product_exist
+    return catalog_cache.store(request, ProductOut, is_product_exist, [str(product_id)])
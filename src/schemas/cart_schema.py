@@ -1,4 +1,5 @@
-from pydantic import BaseModel, Field
+from enum import Enum
+from pydantic import BaseModel, Field, model_validator
 from uuid import UUID
 
 
@@ -23,3 +24,38 @@ class CartOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class CartOperationEnum(str, Enum):
+    ADD = "add"
+    UPDATE = "update"
+    REMOVE = "remove"
+
+
+class CartBatchOperation(BaseModel):
+    op: CartOperationEnum
+    product_id: UUID | None = Field(None, description="Product to add, required for `add`")
+    cart_item_id: UUID | None = Field(None, description="Cart item to change, required for `update` and `remove`")
+    quantity: int | None = Field(None, gt=0, description="Required for `add` and `update`")
+
+    @model_validator(mode="after")
+    def check_fields_for_op(self):
+        if self.op == CartOperationEnum.ADD and (self.product_id is None or self.quantity is None):
+            raise ValueError("`add` needs product_id and quantity")
+        if self.op == CartOperationEnum.UPDATE and (self.cart_item_id is None or self.quantity is None):
+            raise ValueError("`update` needs cart_item_id and quantity")
+        if self.op == CartOperationEnum.REMOVE and self.cart_item_id is None:
+            raise ValueError("`remove` needs cart_item_id")
+        return self
+
+
+class CartBatchIn(BaseModel):
+    operations: list[CartBatchOperation] = Field(..., min_length=1, max_length=200)
+
+
+class CartBatchLineResult(BaseModel):
+    index: int
+    op: CartOperationEnum
+    ok: bool
+    cart_item_id: UUID | None = None
+    detail: str | None = None
@@ -15,3 +15,8 @@ class CategoryOut(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class CategoryWithCounts(CategoryOut):
+    product_count: int
+    in_stock_count: int
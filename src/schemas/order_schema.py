@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import datetime
 
@@ -11,6 +11,15 @@ class OrderCreate(BaseModel):
     status: OrderStatusEnum | None = OrderStatusEnum.PENDING
 
 
+class OrderItemOut(BaseModel):
+    product_id: UUID | None
+    unit_price: float
+    quantity: int
+
+    class Config:
+        from_attributes = True
+
+
 class OrderOut(BaseModel):
     id: UUID
     user_id: UUID
@@ -18,6 +27,12 @@ class OrderOut(BaseModel):
     status: OrderStatusEnum
     created_at: datetime
     updated_at: datetime
+    items: list[OrderItemOut] = []
 
     class Config:
         from_attributes = True
+
+
+class OrderPage(BaseModel):
+    items: list[OrderOut]
+    next_cursor: str | None = Field(None, description="Pass as `cursor` to fetch the next page, null on the last one")
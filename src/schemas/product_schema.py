@@ -1,9 +1,11 @@
 from pydantic import BaseModel, Field
 from uuid import UUID
 from datetime import datetime
+from enum import Enum
 
 
 class ProductCreate(BaseModel):
+    sku: str | None = Field(None, min_length=1, max_length=64, description="Merchant SKU, bulk imports upsert on it")
     name: str = Field(..., min_length=3, max_length=32, description="The name of the product")
     description: str | None = Field(None, min_length=12, max_length=1024,
                                     description="Detailed description of the product")
@@ -15,14 +17,43 @@ class ProductCreate(BaseModel):
 
 class ProductOut(BaseModel):
     id: UUID
+    sku: str | None = None
     name: str
-    description: str
+    description: str | None = None
     price: float
     stock: int
     category_id: UUID | None = None
-    image_url: str
+    image_url: str | None = None
     created_at: datetime
     updated_at: datetime
 
     class Config:
         from_attributes = True
+
+
+class ProductSortEnum(str, Enum):
+    PRICE = "price"
+    CREATED_AT = "created_at"
+    NAME = "name"
+
+
+class SortOrderEnum(str, Enum):
+    ASC = "asc"
+    DESC = "desc"
+
+
+class ProductPage(BaseModel):
+    items: list[ProductOut]
+    next_cursor: str | None = Field(None, description="Pass as `cursor` to fetch the next page, null on the last one")
+
+
+class ProductImportError(BaseModel):
+    line: int
+    error: str
+
+
+class ProductImportReport(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    batches: int = 0
+    errors: list[ProductImportError] = Field([], description="First errors only, `failed` has the full count")
@@ -0,0 +1,146 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from os import getenv
+from typing import Callable
+from uuid import uuid4
+
+from src.utils.looger_handler import logger
+
+CACHE_BACKEND = getenv("CACHE_BACKEND", "memory")  # "memory" for one process, "sqlite" for workers sharing a host
+CACHE_BACKEND_PATH = getenv("CACHE_BACKEND_PATH", "./cache_invalidations.db")
+# the longest a worker keeps serving an entry another worker has invalidated, give or take one poll
+CACHE_SYNC_INTERVAL = float(getenv("CACHE_SYNC_INTERVAL", "0.5"))
+CACHE_SYNC_RETENTION = float(getenv("CACHE_SYNC_RETENTION", "60"))
+
+# channel -> how this process drops the entries named by a key, or all of the channel's entries for None
+_handlers: dict[str, Callable[[str | None], None]] = {}
+_counters = {"published": 0, "publish_failures": 0, "received": 0, "receive_failures": 0, "full_clears": 0}
+
+
+class CacheBackend:
+    """
+        Carries cache invalidations between the processes serving the app. The caches themselves stay in each
+        process's memory, the backend decides which other processes learn that an entry has to go.
+    """
+
+    def publish(self, channel: str, key: str | None) -> None:
+        raise NotImplementedError
+
+    def receive(self) -> list[tuple[str, str | None]]:
+        """Invalidations published by other processes since the last call."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """A single process: invalidating the local caches is all there is to do."""
+
+    def publish(self, channel: str, key: str | None) -> None:
+        pass
+
+    def receive(self) -> list[tuple[str, str | None]]:
+        return []
+
+
+class SqliteBackend(CacheBackend):
+    """
+        Invalidations appended to a table in a SQLite file every worker on the host opens, each worker reads the
+        rows past the last one it has seen. Rows older than CACHE_SYNC_RETENTION are pruned by the readers.
+    """
+
+    def __init__(self, path: str, retention: float):
+        self.retention = retention
+        self.origin = uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_invalidations (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                           "origin TEXT NOT NULL, channel TEXT NOT NULL, key TEXT, created_at REAL NOT NULL)")
+        # the local caches start out empty, so nothing published before this process started concerns it
+        self._last_id = self._conn.execute("SELECT coalesce(max(id), 0) FROM cache_invalidations").fetchone()[0]
+        self._pruned_at = time.time()
+
+    def publish(self, channel: str, key: str | None) -> None:
+        with self._lock:
+            self._conn.execute("INSERT INTO cache_invalidations (origin, channel, key, created_at) VALUES (?, ?, ?, ?)",
+                               (self.origin, channel, key, time.time()))
+
+    def receive(self) -> list[tuple[str, str | None]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT id, origin, channel, key FROM cache_invalidations WHERE id > ? "
+                                      "ORDER BY id", (self._last_id,)).fetchall()
+            if rows:
+                self._last_id = rows[-1][0]
+            if time.time() - self._pruned_at > self.retention:
+                self._pruned_at = time.time()
+                self._conn.execute("DELETE FROM cache_invalidations WHERE created_at < ?",
+                                   (self._pruned_at - self.retention,))
+        return [(channel, key) for _, origin, channel, key in rows if origin != self.origin]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _make_backend() -> CacheBackend:
+    if CACHE_BACKEND == "sqlite":
+        return SqliteBackend(CACHE_BACKEND_PATH, CACHE_SYNC_RETENTION)
+    if CACHE_BACKEND == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown CACHE_BACKEND {CACHE_BACKEND!r}, expected memory or sqlite")
+
+
+cache_backend = _make_backend()
+
+
+def on_invalidation(channel: str, apply: Callable[[str | None], None]) -> None:
+    _handlers[channel] = apply
+
+
+async def invalidate(channel: str, key: str | None = None) -> None:
+    """Drop the entries here at once and publish the invalidation for the other workers, call it after the commit."""
+    _handlers[channel](key)
+    if isinstance(cache_backend, MemoryBackend):
+        return
+    try:
+        await asyncio.to_thread(cache_backend.publish, channel, key)
+        _counters["published"] += 1
+    except Exception as e:
+        _counters["publish_failures"] += 1
+        logger.error(f"Failed to publish the {channel} cache invalidation, other workers may serve stale entries: {e}")
+
+
+def _apply_all(invalidations) -> None:
+    for channel, key in invalidations:
+        apply = _handlers.get(channel)
+        if apply is not None:
+            apply(key)
+
+
+async def run_cache_sync() -> None:
+    """Apply other workers' invalidations every CACHE_SYNC_INTERVAL seconds."""
+    last_received = time.monotonic()
+    while True:
+        await asyncio.sleep(CACHE_SYNC_INTERVAL)
+        try:
+            received = await asyncio.to_thread(cache_backend.receive)
+        except Exception as e:
+            _counters["receive_failures"] += 1
+            logger.error(f"Receiving cache invalidations failed: {e}")
+            continue
+        _apply_all(received)
+        _counters["received"] += len(received)
+        # after a gap longer than the retention some invalidations may have been pruned unseen, start over empty
+        if time.monotonic() - last_received > CACHE_SYNC_RETENTION:
+            _counters["full_clears"] += 1
+            logger.warning("Cache invalidations were not received for too long, clearing every cache")
+            _apply_all((channel, None) for channel in _handlers)
+        last_received = time.monotonic()
+
+
+def cache_sync_stats() -> dict:
+    return {"backend": type(cache_backend).__name__, "interval": CACHE_SYNC_INTERVAL, **_counters}
@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from hashlib import blake2b
+from os import getenv
+
+from fastapi import Request, Response, status
+
+from src.utils.cache_backend import on_invalidation
+from src.utils.serialization import dump_json, gzip_etag, identity_etag, gzipped
+
+CATALOG_CACHE_MAX_BYTES = int(getenv("CATALOG_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# tag of the responses that depend on which products are in stock, not only on the products they list
+IN_STOCK_TAG = "in_stock"
+
+
+class CatalogCache:
+    """
+        Serialized catalog responses keyed by path + query, evicted LRU once max_bytes is reached. Every entry carries
+        tags, the ids of the products it shows, so a write to a few products drops only the responses showing them.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[str, bytes, tuple[str, ...]]] = OrderedDict()
+        self._keys_by_tag: dict[str, set[str]] = {}
+
+    @staticmethod
+    def _key(request: Request) -> str:
+        return f"{request.url.path}?{'&'.join(sorted(f'{k}={v}' for k, v in request.query_params.multi_items()))}"
+
+    @staticmethod
+    def _etag_matches(request: Request, etag: str) -> bool:
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is None:
+            return False
+        candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+        return "*" in candidates or etag in map(identity_etag, candidates)
+
+    def _response(self, request: Request, etag: str, body: bytes) -> Response:
+        if self._etag_matches(request, etag):
+            # a 304 has no body to compress, it carries the ETag of the representation the client would have got
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED,
+                            headers={"ETag": gzip_etag(etag) if gzipped(request, len(body)) else etag})
+        return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+    def lookup(self, request: Request) -> Response | None:
+        key = self._key(request)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._response(request, entry[0], entry[1])
+
+    def store(self, request: Request, response_type, content, tags=()) -> Response:
+        body = dump_json(response_type, content)
+        etag = f'"{blake2b(body, digest_size=16).hexdigest()}"'
+
+        if len(body) <= self.max_bytes:
+            key = self._key(request)
+            self._remove(key)
+            self._entries[key] = (etag, body, tuple(tags))
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+        return self._response(request, etag, body)
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+        self._keys_by_tag.clear()
+        self.size = 0
+
+    def invalidate_tags(self, tags) -> None:
+        for tag in tags:
+            for key in self._keys_by_tag.pop(tag, set()):
+                self._remove(key)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "tags": len(self._keys_by_tag), "size": self.size,
+                "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= len(entry[1])
+        for tag in entry[2]:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+
+catalog_cache = CatalogCache(max_bytes=CATALOG_CACHE_MAX_BYTES)
+# a key is the comma separated tags to drop, None drops everything
+on_invalidation("catalog", lambda key: catalog_cache.invalidate() if key is None
+                else catalog_cache.invalidate_tags(key.split(",")))
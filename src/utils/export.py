@@ -0,0 +1,55 @@
+import csv
+import io
+import json
+from datetime import datetime
+from enum import Enum
+from os import getenv
+from uuid import UUID
+
+from fastapi.responses import StreamingResponse
+from sqlalchemy import Select
+
+from src.config.db_setup import read_session_local
+
+EXPORT_CHUNK_SIZE = int(getenv("EXPORT_CHUNK_SIZE", "1000"))
+
+
+class ExportFormatEnum(str, Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+
+def _plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _encode_rows(columns: list[str], rows, file_format: ExportFormatEnum) -> str:
+    if file_format == ExportFormatEnum.NDJSON:
+        return "".join(json.dumps({column: _plain(value) for column, value in zip(columns, row)}) + "\n"
+                       for row in rows)
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_plain(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+def export_response(query: Select, file_format: ExportFormatEnum, filename: str) -> StreamingResponse:
+    async def chunks():
+        # the request's session is closed before the body streams, so the export owns its session
+        async with read_session_local() as db:
+            result = await db.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+            columns = list(result.keys())
+            if file_format == ExportFormatEnum.CSV:
+                yield _encode_rows(columns, [columns], file_format)
+            async for rows in result.partitions():
+                yield _encode_rows(columns, rows, file_format)
+
+    media_type = "application/x-ndjson" if file_format == ExportFormatEnum.NDJSON else "text/csv"
+    return StreamingResponse(chunks(), media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}.{file_format.value}"'})
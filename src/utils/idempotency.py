@@ -0,0 +1,308 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+from os import getenv
+
+from jose import JWTError
+
+from src.utils.jwt_handler import verify_jwt_token
+from src.utils.looger_handler import logger
+
+IDEMPOTENCY_BACKEND = getenv("IDEMPOTENCY_BACKEND", getenv("CACHE_BACKEND", "memory"))  # "memory" or "sqlite"
+IDEMPOTENCY_BACKEND_PATH = getenv("IDEMPOTENCY_BACKEND_PATH", "./idempotency_keys.db")
+IDEMPOTENCY_TTL = float(getenv("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_ENTRIES = int(getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+# how long a retry waits for the first request with its key to finish before it gets a 409
+IDEMPOTENCY_WAIT_TIMEOUT = float(getenv("IDEMPOTENCY_WAIT_TIMEOUT", "30"))
+IDEMPOTENCY_POLL_INTERVAL = 0.05  # how often a retry on another worker checks whether the first run has finished
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+# the writes a client may safely retry with an Idempotency-Key, both take no path parameters
+IDEMPOTENT_ROUTES = {("POST", "/api/order/create_order"), ("POST", "/api/cart/add_cart_item")}
+
+RUN, STORED, RUNNING = "run", "stored", "running"
+
+
+class IdempotencyStore:
+    """
+        Responses per idempotency key, each kept for ttl seconds, plus the keys whose first request is still running,
+        so that a retry can wait for it instead of running again.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.replays = 0
+
+    async def claim(self, key: str, fingerprint: str) -> tuple[str, tuple | None]:
+        """
+            (RUN, None) when the caller now owns `key` and runs the request, (STORED, (fingerprint, status_code,
+            headers, body)) when a response is stored for it, (RUNNING, None) when another request is running it.
+        """
+        raise NotImplementedError
+
+    async def complete(self, key: str, fingerprint: str, status_code: int, headers: list, body: bytes) -> None:
+        raise NotImplementedError
+
+    async def release(self, key: str) -> None:
+        """Give up a claimed key without storing a response, a retry runs the request again."""
+        raise NotImplementedError
+
+    async def wait(self, key: str, timeout: float) -> bool:
+        """Wait for the request running `key` to complete or release it, False on timeout."""
+        raise NotImplementedError
+
+    async def stats(self) -> dict:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """A single process: entries evicted oldest first past max_entries, retries wait on an event."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self._entries: OrderedDict[str, tuple[float, str, int, list, bytes]] = OrderedDict()
+        self._in_flight: dict[str, asyncio.Event] = {}
+
+    async def claim(self, key: str, fingerprint: str) -> tuple[str, tuple | None]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            entry = None
+        if entry is not None:
+            return STORED, entry[1:]
+        if key in self._in_flight:
+            return RUNNING, None
+        self._in_flight[key] = asyncio.Event()
+        return RUN, None
+
+    async def complete(self, key: str, fingerprint: str, status_code: int, headers: list, body: bytes) -> None:
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, fingerprint, status_code, headers, body)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._in_flight.pop(key).set()
+
+    async def release(self, key: str) -> None:
+        self._in_flight.pop(key).set()
+
+    async def wait(self, key: str, timeout: float) -> bool:
+        running = self._in_flight.get(key)
+        if running is None:
+            return True
+        try:
+            await asyncio.wait_for(running.wait(), timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    async def stats(self) -> dict:
+        return {"backend": "memory", "entries": len(self._entries), "in_flight": len(self._in_flight),
+                "max_entries": self.max_entries, "replays": self.replays}
+class SqliteIdempotencyStore(IdempotencyStore):
+    """
+        Keys in a table of a SQLite file every worker on the host opens, so a retry that lands on another worker still
+        finds the stored response or the run in flight. A key being run holds a row without a response whose lease
+        runs out after IDEMPOTENCY_WAIT_TIMEOUT, after which a worker that died mid-request no longer blocks it.
+        Expired rows are pruned and the oldest dropped past max_entries once a minute.
+    """
+
+    PRUNE_EVERY = 60
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS idempotency_keys (key TEXT PRIMARY KEY, fingerprint TEXT NOT "
+                           "NULL, status_code INTEGER, headers TEXT, body BLOB, expires_at REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_expires_at ON idempotency_keys "
+                           "(expires_at)")
+        self._pruned_at = time.time()
+
+    def _claim(self, key: str, fingerprint: str) -> tuple[str, tuple | None]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT fingerprint, status_code, headers, body FROM idempotency_keys "
+                                         "WHERE key = ? AND expires_at > ?", (key, now)).fetchone()
+                if row is None:
+                    self._conn.execute("INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, expires_at) "
+                                       "VALUES (?, ?, ?)", (key, fingerprint, now + IDEMPOTENCY_WAIT_TIMEOUT))
+            finally:
+                self._conn.execute("COMMIT")
+        if row is None:
+            return RUN, None
+        if row[1] is None:
+            return RUNNING, None
+        headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in json.loads(row[2])]
+        return STORED, (row[0], row[1], headers, row[3])
+
+    def _complete(self, key: str, fingerprint: str, status_code: int, headers: list, body: bytes) -> None:
+        stored_headers = json.dumps([(name.decode("latin-1"), value.decode("latin-1")) for name, value in headers])
+        with self._lock:
+            self._conn.execute("UPDATE idempotency_keys SET fingerprint = ?, status_code = ?, headers = ?, body = ?, "
+                               "expires_at = ? WHERE key = ?",
+                               (fingerprint, status_code, stored_headers, body, time.time() + self.ttl, key))
+            if time.time() - self._pruned_at > self.PRUNE_EVERY:
+                self._pruned_at = time.time()
+                self._conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (self._pruned_at,))
+                self._conn.execute("DELETE FROM idempotency_keys WHERE key IN (SELECT key FROM idempotency_keys "
+                                   "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND status_code IS NULL", (key,))
+
+    def _running(self, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM idempotency_keys WHERE key = ? AND status_code IS NULL AND "
+                                      "expires_at > ?", (key, time.time())).fetchone() is not None
+
+    def _stats(self) -> dict:
+        with self._lock:
+            entries, in_flight = self._conn.execute("SELECT count(status_code), count(*) - count(status_code) FROM "
+                                                    "idempotency_keys WHERE expires_at > ?", (time.time(),)).fetchone()
+        return {"backend": "sqlite", "entries": entries, "in_flight": in_flight, "max_entries": self.max_entries,
+                "replays": self.replays}
+
+    async def claim(self, key: str, fingerprint: str) -> tuple[str, tuple | None]:
+        return await asyncio.to_thread(self._claim, key, fingerprint)
+
+    async def complete(self, key: str, fingerprint: str, status_code: int, headers: list, body: bytes) -> None:
+        await asyncio.to_thread(self._complete, key, fingerprint, status_code, headers, body)
+
+    async def release(self, key: str) -> None:
+        await asyncio.to_thread(self._release, key)
+
+    async def wait(self, key: str, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while await asyncio.to_thread(self._running, key):
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+        return True
+
+    async def stats(self) -> dict:
+        return await asyncio.to_thread(self._stats)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _make_store() -> IdempotencyStore:
+    if IDEMPOTENCY_BACKEND == "sqlite":
+        return SqliteIdempotencyStore(IDEMPOTENCY_BACKEND_PATH, IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_TTL)
+    if IDEMPOTENCY_BACKEND == "memory":
+        return MemoryIdempotencyStore(IDEMPOTENCY_MAX_ENTRIES, IDEMPOTENCY_TTL)
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND {IDEMPOTENCY_BACKEND!r}, expected memory or sqlite")
+
+
+idempotency_store = _make_store()
+
+
+def _subject(headers: dict) -> str | None:
+    scheme, _, token = headers.get(b"authorization", b"").decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        return verify_jwt_token(token).get("sub")
+    except JWTError:
+        return None
+
+
+async def _send_json(send, status_code: int, detail: str) -> None:
+    body = f'{{"detail":"{detail}"}}'.encode()
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """
+        Runs a request to an IDEMPOTENT_ROUTES write once per (user, Idempotency-Key): a retry gets the stored
+        response of the first successful run without touching the database, a retry that arrives while the first
+        run is in flight waits for it, and the same key sent with a different body is refused. Failed runs are not
+        stored, so they can be retried. Keys are shared between workers with IDEMPOTENCY_BACKEND=sqlite.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in IDEMPOTENT_ROUTES:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        idempotency_key = headers.get(b"idempotency-key")
+        subject = _subject(headers) if idempotency_key is not None else None
+        if subject is None:
+            return await self.app(scope, receive, send)
+        if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+            return await _send_json(send, 400, "Idempotency-Key must be 1 to 255 characters long")
+
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+        key = sha256(f"{subject}\0{scope['path']}\0{idempotency_key.decode('latin-1')}".encode()).hexdigest()
+        fingerprint = sha256(scope.get("query_string", b"") + b"\0" + body).hexdigest()
+
+        while True:
+            state, stored = await idempotency_store.claim(key, fingerprint)
+            if state == STORED:
+                stored_fingerprint, status_code, response_headers, response_body = stored
+                if stored_fingerprint != fingerprint:
+                    logger.warning(f"Idempotency-Key of {scope['path']} reused with a different request")
+                    return await _send_json(send, 422, "Idempotency-Key was already used with a different request")
+                idempotency_store.replays += 1
+                logger.info(f"Replaying the stored response of {scope['path']} for a retried Idempotency-Key")
+                await send({"type": "http.response.start", "status": status_code,
+                            "headers": [*response_headers, (b"idempotent-replayed", b"true")]})
+                return await send({"type": "http.response.body", "body": response_body})
+
+            if state == RUN:
+                break
+            if not await idempotency_store.wait(key, IDEMPOTENCY_WAIT_TIMEOUT):
+                return await _send_json(send, 409, "A request with this Idempotency-Key is still in progress")
+            # the first run either stored its response or failed, in which case this one runs the request itself
+
+        body_sent = False
+
+        async def receive_body():
+            nonlocal body_sent
+            if body_sent:
+                return await receive()
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        response = {"status": 500, "headers": [], "body": []}
+
+        async def send_and_capture(message):
+            if message["type"] == "http.response.start":
+                response["status"], response["headers"] = message["status"], list(message.get("headers", []))
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        completed = False
+        try:
+            await self.app(scope, receive_body, send_and_capture)
+            if 200 <= response["status"] < 300:
+                await idempotency_store.complete(key, fingerprint, response["status"], response["headers"],
+                                                 b"".join(response["body"]))
+                completed = True
+        finally:
+            if not completed:
+                await idempotency_store.release(key)
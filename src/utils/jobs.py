@@ -0,0 +1,154 @@
+import asyncio
+import random
+from datetime import datetime, timedelta
+from os import getenv
+from typing import Awaitable, Callable
+
+from sqlalchemy import select, update, delete, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config.db_setup import session_local
+from src.models.app_model import Job, JobStatusEnum
+from src.utils.looger_handler import logger
+
+JOB_WORKERS = int(getenv("JOB_WORKERS", "4"))  # jobs run at once by this process, 0 leaves them to other processes
+JOB_MAX_ATTEMPTS = int(getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_BACKOFF = float(getenv("JOB_RETRY_BACKOFF", "2"))  # seconds before the first retry, doubled on every next
+JOB_POLL_INTERVAL = float(getenv("JOB_POLL_INTERVAL", "1"))
+JOB_LEASE_SECONDS = float(getenv("JOB_LEASE_SECONDS", "300"))
+JOB_SHUTDOWN_TIMEOUT = float(getenv("JOB_SHUTDOWN_TIMEOUT", "10"))
+
+# kind -> handler, which runs in the same transaction that removes its job row
+handlers: dict[str, Callable[[AsyncSession, dict], Awaitable[None]]] = {}
+_wakeup: asyncio.Event | None = None
+_stopping = False
+
+
+def job_handler(kind: str):
+    def register(handler):
+        handlers[kind] = handler
+        return handler
+    return register
+
+
+def enqueue(db: AsyncSession, kind: str, payload: dict, delay: float = 0) -> None:
+    """
+        Add a job to `db`'s transaction, so it is stored if and only if the work that asked for it commits.
+        Call notify() after the commit to start it without waiting for the next poll.
+    """
+    db.add(Job(kind=kind, payload=payload, run_at=datetime.now() + timedelta(seconds=delay)))
+
+
+def notify() -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _claim(limit: int) -> list:
+    now = datetime.now()
+    # a running job whose lease ran out belongs to a worker that died, it is due again like a pending one
+    due = (
+        select(Job.id)
+        .filter(Job.status.in_([JobStatusEnum.PENDING, JobStatusEnum.RUNNING]), Job.run_at <= now)
+        .order_by(Job.run_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    async with session_local() as db:
+        claimed = (await db.execute(
+            update(Job).filter(Job.id.in_(due))
+            .values(status=JobStatusEnum.RUNNING, attempts=Job.attempts + 1,
+                    run_at=now + timedelta(seconds=JOB_LEASE_SECONDS))
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts)
+        )).all()
+        await db.commit()
+    return claimed
+
+
+async def _run(job) -> None:
+    async with session_local() as db:
+        try:
+            handler = handlers.get(job.kind)
+            if handler is None:
+                raise LookupError(f"no handler for job kind {job.kind}")
+            await handler(db, job.payload)
+            await db.execute(delete(Job).filter(Job.id == job.id))  # type:ignore
+            await db.commit()
+            return
+        except Exception as e:
+            await db.rollback()
+            error = f"{type(e).__name__}: {e}"
+
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            logger.error(f"Job {job.kind} {job.id} failed for good after {job.attempts} attempts: {error}")
+            values = {"status": JobStatusEnum.FAILED}
+        else:
+            delay = JOB_RETRY_BACKOFF * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5)
+            logger.warning(f"Job {job.kind} {job.id} failed on attempt {job.attempts}, retry in {delay:.1f}s: {error}")
+            values = {"status": JobStatusEnum.PENDING, "run_at": datetime.now() + timedelta(seconds=delay)}
+        await db.execute(update(Job).filter(Job.id == job.id).values(last_error=error[:1000], **values))  # type:ignore
+        await db.commit()
+
+
+async def run_job_queue() -> None:
+    """
+        Claim due jobs and run them, at most JOB_WORKERS at a time, until stop_job_queue() is called. It is never
+        cancelled: a task cancelled in the middle of a statement on an aiosqlite connection can hang the shutdown.
+    """
+    global _wakeup, _stopping
+    _wakeup = asyncio.Event()
+    running: set[asyncio.Task] = set()
+
+    def finished(task: asyncio.Task) -> None:
+        running.discard(task)
+        _wakeup.set()
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Job bookkeeping failed: {task.exception()}")
+
+    while not _stopping:
+        _wakeup.clear()
+        free = JOB_WORKERS - len(running)
+        try:
+            claimed = await _claim(free) if free > 0 else []
+        except Exception as e:
+            logger.error(f"Claiming jobs failed: {e}")
+            claimed = []
+        for job in claimed:
+            task = asyncio.create_task(_run(job))
+            running.add(task)
+            task.add_done_callback(finished)
+        if claimed and len(claimed) == free:
+            continue  # there may be more due, take them as soon as a worker is free
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOB_POLL_INTERVAL)
+        except TimeoutError:
+            pass
+
+    # a job that doesn't finish in time keeps its lease and is picked up again once the lease runs out
+    if running:
+        await asyncio.wait(running, timeout=JOB_SHUTDOWN_TIMEOUT)
+    _wakeup, _stopping = None, False
+
+
+def stop_job_queue() -> None:
+    global _stopping
+    _stopping = True
+    notify()
+
+
+async def queue_stats(db: AsyncSession) -> dict:
+    """Jobs per status, how many pending ones are due, and how long the oldest due one has been waiting."""
+    now = datetime.now()
+    rows = (await db.execute(
+        select(Job.status, func.count(Job.id), func.sum(case((Job.run_at <= now, 1), else_=0)),
+               func.min(Job.run_at))
+        .group_by(Job.status)
+    )).all()
+    stats = {"pending": 0, "due": 0, "running": 0, "failed": 0, "lag_seconds": 0.0, "workers": JOB_WORKERS}
+    for job_status, count, due, oldest in rows:
+        stats[job_status.value] = count
+        if job_status == JobStatusEnum.PENDING:
+            stats["due"] = due
+            if due:
+                stats["lag_seconds"] = round((now - oldest).total_seconds(), 3)
+    return stats
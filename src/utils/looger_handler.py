@@ -1,3 +1,113 @@
+import json
+import random
+import sys
+import time
+import traceback
+from contextvars import ContextVar
+from os import getenv
+from uuid import uuid4
+
 from loguru import logger
 
-logger.add("app.log", rotation="1 MB", retention="7 days", compression="zip")
+LOG_FILE = getenv("LOG_FILE", "app.log")
+LOG_LEVEL = getenv("LOG_LEVEL", "INFO")
+LOG_ROTATION = getenv("LOG_ROTATION", "1 MB")
+LOG_STDERR = getenv("LOG_STDERR", "1") == "1"
+LOG_JSON = getenv("LOG_JSON", "1") == "1"
+# sinks write from a background thread, a slow disk or a rotation never stalls the event loop
+LOG_ENQUEUE = getenv("LOG_ENQUEUE", "1") == "1"
+# "METHOD /route=rate" pairs: the share of a route's requests whose INFO lines (access line included) are written,
+# warnings and errors are always written
+LOG_SAMPLE_RATES = getenv("LOG_SAMPLE_RATES", ",".join(f"GET {route}=0.1" for route in (
+    "/api/product/all", "/api/product/search", "/api/product/{product_id}", "/api/category/all",
+    "/api/category/{category_id}")))
+
+log_context: ContextVar[dict | None] = ContextVar("log_context", default=None)
+
+
+def _parse_sample_rates(spec: str) -> dict[str, float]:
+    rates = {}
+    for pair in filter(None, (pair.strip() for pair in spec.split(","))):
+        route, rate = pair.rsplit("=", 1)
+        rates[route.strip()] = float(rate)
+    return rates
+
+
+sample_rates = _parse_sample_rates(LOG_SAMPLE_RATES)
+WARNING_LEVEL = logger.level("WARNING").no
+
+
+def _route(scope: dict) -> str:
+    # the route template once the router has matched one, so every product id shares one key
+    route = scope.get("route")
+    return f"{scope['method']} {route.path if route is not None else scope['path']}"
+
+
+def _sampled(record) -> bool:
+    if record["level"].no >= WARNING_LEVEL:
+        return True
+    context = log_context.get()
+    if context is None:
+        return True
+    if context["sampled"] is None:
+        # decided once per request so a request's lines are written all together or not at all
+        rate = sample_rates.get(_route(context["scope"]), 1.0)
+        context["sampled"] = rate >= 1 or random.random() < rate
+    return context["sampled"]
+
+
+def _json_format(record) -> str:
+    line = {"time": record["time"].isoformat(), "level": record["level"].name, "message": record["message"],
+            "source": f"{record['name']}:{record['function']}:{record['line']}"}
+    context = log_context.get()
+    if context is not None:
+        line.update(request_id=context["request_id"], route=_route(context["scope"]), user=context["user"])
+    line.update((key, value) for key, value in record["extra"].items() if key != "json")
+    if record["exception"]:
+        line["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    record["extra"]["json"] = json.dumps(line, default=str)
+    return "{extra[json]}\n"
+
+
+def bind_user(username: str) -> None:
+    context = log_context.get()
+    if context is not None:
+        context["user"] = username
+
+
+class RequestLogMiddleware:
+    """Tags every log line of a request with its id, route and user and ends the request with one access line."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")[:64] or uuid4().hex
+        token = log_context.set({"request_id": request_id, "scope": scope, "user": None, "sampled": None})
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_request_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            logger.log("ERROR" if status_code >= 500 else "INFO", f"{scope['method']} {scope['path']} {status_code}",
+                       status=status_code, latency_ms=round((time.perf_counter() - started) * 1000, 2))
+            log_context.reset(token)
+
+
+logger.remove()
+if LOG_STDERR:
+    logger.add(sys.stderr, level=LOG_LEVEL, filter=_sampled, enqueue=LOG_ENQUEUE)
+if LOG_FILE:
+    logger.add(LOG_FILE, level=LOG_LEVEL, filter=_sampled, enqueue=LOG_ENQUEUE, rotation=LOG_ROTATION,
+               retention="7 days", compression="zip", **({"format": _json_format} if LOG_JSON else {}))
@@ -0,0 +1,150 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from os import getenv
+
+from sqlalchemy import event
+
+from src.config.db_setup import engine, read_engine
+
+METRICS_ENABLED = getenv("METRICS_ENABLED", "1") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+KNOWN_METHODS = {"GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"}
+
+# [statements, seconds] of the request being served, filled in by the engine events
+request_db_usage: ContextVar[list | None] = ContextVar("request_db_usage", default=None)
+
+
+class Histogram:
+    """Counts per fixed bucket plus a running sum, so memory doesn't grow with the number of observations."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name: str, labels: str) -> list[str]:
+        lines, cumulative = [], 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+        Per-process request and database metrics. Series are keyed by method and route template (404s share one
+        "unmatched" route), so their number is bounded by the routes the app declares.
+    """
+
+    def __init__(self):
+        self.requests: dict[tuple, int] = defaultdict(int)
+        self.in_flight: dict[str, int] = defaultdict(int)
+        self.latency: dict[tuple, Histogram] = {}
+        self.statements: dict[tuple, Histogram] = {}
+        self.db_time: dict[tuple, Histogram] = {}
+        self.db_totals: dict[str, list] = {"primary": [0, 0.0], "replica": [0, 0.0]}
+
+    @staticmethod
+    def _histogram(series: dict, key: tuple, buckets: tuple) -> Histogram:
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram(buckets)
+        return histogram
+
+    def observe_request(self, method: str, route: str, status_code: int, seconds: float, db_usage: list) -> None:
+        key = (method, route)
+        self.requests[(method, route, status_code)] += 1
+        self._histogram(self.latency, key, LATENCY_BUCKETS).observe(seconds)
+        self._histogram(self.statements, key, STATEMENT_BUCKETS).observe(db_usage[0])
+        self._histogram(self.db_time, key, LATENCY_BUCKETS).observe(db_usage[1])
+
+    def render(self) -> str:
+        lines = ["# TYPE http_requests_total counter"]
+        lines += [f'http_requests_total{{method="{method}",route="{route}",status="{status_code}"}} {count}'
+                  for (method, route, status_code), count in sorted(self.requests.items())]
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines += [f'http_requests_in_flight{{method="{method}"}} {count}'
+                  for method, count in sorted(self.in_flight.items())]
+        for name, series in (("http_request_duration_seconds", self.latency),
+                             ("http_request_db_statements", self.statements),
+                             ("http_request_db_seconds", self.db_time)):
+            lines.append(f"# TYPE {name} histogram")
+            for (method, route), histogram in sorted(series.items()):
+                lines += histogram.render(name, f'method="{method}",route="{route}"')
+        lines.append("# TYPE db_statements_total counter")
+        lines += [f'db_statements_total{{engine="{name}"}} {count}' for name, (count, _) in self.db_totals.items()]
+        lines.append("# TYPE db_statement_seconds_total counter")
+        lines += [f'db_statement_seconds_total{{engine="{name}"}} {seconds}'
+                  for name, (_, seconds) in self.db_totals.items()]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_started"] = time.perf_counter()
+
+
+def _after_cursor_execute(name: str):
+    totals = metrics.db_totals[name]
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"]
+        totals[0] += 1
+        totals[1] += elapsed
+        usage = request_db_usage.get()
+        if usage is not None:
+            usage[0] += 1
+            usage[1] += elapsed
+
+    return after_cursor_execute
+
+
+if METRICS_ENABLED:
+    instrumented_engines = {"primary": engine} if read_engine is engine else {"primary": engine, "replica": read_engine}
+    for engine_name, instrumented in instrumented_engines.items():
+        event.listen(instrumented.sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(instrumented.sync_engine, "after_cursor_execute", _after_cursor_execute(engine_name))
+
+
+class MetricsMiddleware:
+    """Latency, status, in-flight count and the SQL statements and time of every HTTP request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        method = scope["method"] if scope["method"] in KNOWN_METHODS else "OTHER"
+        usage = [0, 0.0]
+        token = request_db_usage.set(usage)
+        metrics.in_flight[method] += 1
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight[method] -= 1
+            route = scope.get("route")
+            metrics.observe_request(method, route.path if route is not None else "unmatched", status_code,
+                                    time.perf_counter() - started, usage)
+            request_db_usage.reset(token)
@@ -0,0 +1,64 @@
+from os import getenv
+from uuid import UUID
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models.app_model import Order, User, CartItem, Product, OrderStatusEnum
+from src.utils.jobs import job_handler, enqueue
+from src.utils.looger_handler import logger
+
+LOW_STOCK_THRESHOLD = int(getenv("LOW_STOCK_THRESHOLD", "5"))
+
+
+def enqueue_order_placed(db: AsyncSession, order_id: UUID, cart_id: UUID, product_ids) -> None:
+    """The follow-up work of a checkout, stored with the order and run after the response has gone out."""
+    enqueue(db, "order_placed", {"order_id": str(order_id), "cart_id": str(cart_id),
+                                 "product_ids": [str(product_id) for product_id in product_ids]})
+
+
+def enqueue_status_changed(db: AsyncSession, order_id: UUID, old_status: OrderStatusEnum,
+                           new_status: OrderStatusEnum) -> None:
+    enqueue(db, "order_status_changed", {"order_id": str(order_id), "old_status": old_status.value,
+                                         "new_status": new_status.value})
+
+
+async def send_order_confirmation(db: AsyncSession, order_id: UUID) -> None:
+    order = (await db.execute(
+        select(Order.id, Order.total_price, User.email)
+        .join(User, User.id == Order.user_id)
+        .filter(Order.id == order_id)  # type:ignore
+    )).first()
+    if order is None:
+        logger.warning(f"Order {order_id} is gone, no confirmation sent")
+        return
+    logger.info(f"Order confirmation for {order.id} ({order.total_price:.2f}) sent to {order.email}")
+
+
+async def clean_up_cart(db: AsyncSession, cart_id: UUID) -> None:
+    # the checkout deleted the cart itself, which is what stops a second checkout, its lines are left for here
+    result = await db.execute(delete(CartItem).filter(CartItem.cart_id == cart_id))  # type:ignore
+    logger.info(f"{result.rowcount} lines of checked out cart {cart_id} have been removed")
+
+
+async def alert_low_stock(db: AsyncSession, product_ids: list[UUID]) -> None:
+    low = (await db.execute(
+        select(Product.id, Product.name, Product.stock)
+        .filter(Product.id.in_(product_ids), Product.stock <= LOW_STOCK_THRESHOLD)
+    )).all()
+    for product in low:
+        logger.warning(f"Product {product.name} ({product.id}) is down to {product.stock} in stock, replenish it")
+
+
+# one job per order rather than one per step: on SQLite every job is another write transaction competing with checkouts
+# for the database lock. A retry runs every step again, so each of them has to be safe to repeat.
+@job_handler("order_placed")
+async def order_placed(db: AsyncSession, payload: dict) -> None:
+    await clean_up_cart(db, UUID(payload["cart_id"]))
+    await alert_low_stock(db, [UUID(product_id) for product_id in payload["product_ids"]])
+    await send_order_confirmation(db, UUID(payload["order_id"]))
+
+
+@job_handler("order_status_changed")
+async def notify_status_change(db: AsyncSession, payload: dict) -> None:
+    logger.info(f"Order {payload['order_id']} moved from {payload['old_status']} to {payload['new_status']}")
@@ -0,0 +1,23 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(*values) -> str:
+    raw = json.dumps(values, separators=(",", ":"), default=str).encode()
+    return urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        raw = urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError as e:
+        raise InvalidCursor(f"Malformed cursor: {e}")
+
+    if not isinstance(values, list):
+        raise InvalidCursor("Malformed cursor")
+    return values
@@ -1,7 +1,30 @@
+from asyncio import get_running_loop
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from os import getenv
+
 from passlib.context import CryptContext
 
 pass_context = CryptContext(schemes="bcrypt")
 
+# bcrypt is slow on purpose, so the async variants run it on a worker pool instead of the event loop
+PASSWORD_HASH_EXECUTOR = getenv("PASSWORD_HASH_EXECUTOR", "thread")  # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(getenv("PASSWORD_HASH_WORKERS", "4"))
+PASSWORD_HASH_QUEUE_SIZE = int(getenv("PASSWORD_HASH_QUEUE_SIZE", "64"))
+
+
+class PasswordHasherBusy(Exception):
+    pass
+
+
+def _make_executor() -> Executor:
+    if PASSWORD_HASH_EXECUTOR == "process":
+        return ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+hash_executor = _make_executor()
+_pending = 0
+
 
 def hash_password(passwd: str) -> str:
     return pass_context.hash(passwd)
@@ -9,3 +32,27 @@ def hash_password(passwd: str) -> str:
 
 def verify_password(passwd: str, hash_passwd: str) -> bool:
     return pass_context.verify(passwd, hash_passwd)
+
+
+async def _run_in_pool(func, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE:
+        raise PasswordHasherBusy("Password hashing queue is full")
+
+    _pending += 1
+    try:
+        return await get_running_loop().run_in_executor(hash_executor, func, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password_async(passwd: str) -> str:
+    return await _run_in_pool(hash_password, passwd)
+
+
+async def verify_password_async(passwd: str, hash_passwd: str) -> bool:
+    return await _run_in_pool(verify_password, passwd, hash_passwd)
+
+
+def shutdown_hash_executor() -> None:
+    hash_executor.shutdown(wait=False, cancel_futures=True)
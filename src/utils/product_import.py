@@ -0,0 +1,46 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+async def iter_import_rows(chunks: AsyncIterator[bytes], file_format: str) -> AsyncIterator[tuple[int, dict | str]]:
+    """Yield (line number, row) for every non-empty line, or (line number, error message) for unparsable ones."""
+    header = None
+    line_no = 0
+    async for line in iter_lines(chunks):
+        line_no += 1
+        if not line.strip():
+            continue
+
+        if file_format == "ndjson":
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, f"Invalid JSON: {e}"
+                continue
+            yield (line_no, row) if isinstance(row, dict) else (line_no, "Expected a JSON object")
+            continue
+
+        values = next(csv.reader([line]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            yield line_no, f"Expected {len(header)} columns, got {len(values)}"
+            continue
+        # empty csv cells mean "not set", not an empty string
+        yield line_no, {name: value for name, value in zip(header, values) if value != ""}
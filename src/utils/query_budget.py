@@ -0,0 +1,101 @@
+from collections import Counter
+from contextvars import ContextVar
+from os import getenv
+
+from sqlalchemy import event
+
+from src.config.db_setup import engine, read_engine
+from src.utils.looger_handler import logger
+
+QUERY_BUDGET_MODE = getenv("QUERY_BUDGET_MODE", "warn")  # "warn" logs overruns, "raise" fails the request, "off"
+
+# statement text -> executions, for the request being served
+request_statements: ContextVar[Counter | None] = ContextVar("request_statements", default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(statements: int | None, repeats: int | None = 1):
+    """
+        Declare the most SQL statements a route may send per request and how many times one statement may be sent,
+        so a query inside a loop over cart items or order lines shows up as soon as it's written. None is for the
+        routes whose work grows with the request body, like a bulk import sending one statement per batch.
+    """
+    def declare(endpoint):
+        endpoint.query_budget = (statements, repeats)
+        return endpoint
+    return declare
+
+
+def over_budget(budget: tuple[int | None, int | None], counts: Counter) -> list[str]:
+    statements, repeats = budget
+    problems = []
+    if statements is not None and counts.total() > statements:
+        problems.append(f"{counts.total()} statements, budget is {statements}")
+    for statement, count in counts.most_common():
+        if repeats is None or count <= repeats:
+            break
+        problems.append(f"{count}x {' '.join(statement.split())[:200]}")
+    return problems
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counts = request_statements.get()
+    if counts is not None:
+        counts[statement] += 1
+        conn.info.setdefault("budget_transaction", []).append(statement)
+
+
+def _begin(conn):
+    conn.info["budget_transaction"] = []
+
+
+def _failed(exception_context):
+    if exception_context.connection is not None:
+        exception_context.connection.info["budget_failed"] = True
+
+
+def _rollback(conn):
+    # a transaction rolled back on an error is about to be run again by run_with_retry, only the attempt that goes
+    # through counts against the budget
+    statements = conn.info.pop("budget_transaction", [])
+    counts = request_statements.get()
+    if conn.info.pop("budget_failed", False) and counts is not None:
+        counts.subtract(statements)
+
+
+if QUERY_BUDGET_MODE != "off":
+    for instrumented in {engine, read_engine}:
+        event.listen(instrumented.sync_engine, "before_cursor_execute", _count_statement)
+        event.listen(instrumented.sync_engine, "begin", _begin)
+        event.listen(instrumented.sync_engine, "handle_error", _failed)
+        event.listen(instrumented.sync_engine, "rollback", _rollback)
+
+
+class QueryBudgetMiddleware:
+    """Counts the statements of every request and checks them against the budget its route declared."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or QUERY_BUDGET_MODE == "off":
+            return await self.app(scope, receive, send)
+
+        counts = Counter()
+        token = request_statements.set(counts)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_statements.reset(token)
+
+        route = scope.get("route")
+        budget = getattr(getattr(route, "endpoint", None), "query_budget", None)
+        problems = over_budget(budget, counts) if budget is not None else []
+        if problems:
+            message = f"{scope['method']} {route.path} is over its query budget: {'; '.join(problems)}"
+            if QUERY_BUDGET_MODE == "raise":
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
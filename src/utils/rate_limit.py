@@ -0,0 +1,185 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from os import getenv
+
+from fastapi import HTTPException, Request, status
+from jose import JWTError
+
+from src.utils.jwt_handler import verify_jwt_token
+from src.utils.looger_handler import logger
+
+RATE_LIMIT_ENABLED = getenv("RATE_LIMIT_ENABLED", "1") == "1"
+# "<policy>:<ip|user|route>=<tokens>/<second|minute|hour>", a bucket holds `tokens` and refills them over the period
+RATE_LIMITS = getenv("RATE_LIMITS", "login:ip=20/minute,login:route=50/second,register:ip=10/minute,"
+                                    "create_order:user=30/minute")
+RATE_LIMIT_MAX_KEYS = int(getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# only behind a proxy that sets it, otherwise every client can pick its own address
+RATE_LIMIT_TRUST_FORWARDED = getenv("RATE_LIMIT_TRUST_FORWARDED", "0") == "1"
+# "<route class>=<requests in flight>", requests over the cap wait in a bounded queue and are shed with a 503 after
+CONCURRENCY_LIMITS = getenv("CONCURRENCY_LIMITS", "password=8,checkout=4")
+CONCURRENCY_QUEUE_SIZE = int(getenv("CONCURRENCY_QUEUE_SIZE", "32"))
+CONCURRENCY_QUEUE_TIMEOUT = float(getenv("CONCURRENCY_QUEUE_TIMEOUT", "5"))
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+
+
+class RateLimitStore:
+    """Where the token buckets live. A store shared by every worker (Redis, a database) makes the limits global."""
+
+    async def take(self, key: str, capacity: float, refill_per_second: float) -> float:
+        """Take a token from the bucket at `key`, return 0 if there was one and else the seconds until there is."""
+        raise NotImplementedError
+
+
+class MemoryStore(RateLimitStore):
+    """Buckets of this process only, the least recently used one is dropped (so it starts full again) past max_keys."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    async def take(self, key: str, capacity: float, refill_per_second: float) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / refill_per_second
+
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+def _parse_rate_limits(spec: str) -> dict[str, list[tuple[str, float, float]]]:
+    policies = {}
+    for pair in filter(None, (pair.strip() for pair in spec.split(","))):
+        target, rate = pair.split("=", 1)
+        name, per = target.strip().split(":", 1)
+        tokens, period = rate.strip().split("/", 1)
+        policies.setdefault(name, []).append((per, float(tokens), float(tokens) / PERIODS[period]))
+    return policies
+
+
+rate_limits = _parse_rate_limits(RATE_LIMITS)
+rate_limit_store: RateLimitStore = MemoryStore(max_keys=RATE_LIMIT_MAX_KEYS)
+rejected: dict[str, int] = {}
+
+
+def use_store(store: RateLimitStore) -> None:
+    global rate_limit_store
+    rate_limit_store = store
+
+
+def _client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",", 1)[0].strip()
+    return request.client.host if request.client is not None else "unknown"
+
+
+def _client_key(request: Request, per: str) -> str:
+    if per == "route":
+        return "*"
+    if per == "user":
+        # the token's subject, checked here already so a flood is turned away before it reaches the database
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() == "bearer" and token:
+            try:
+                return f"user:{verify_jwt_token(token).get('sub')}"
+            except JWTError:
+                pass
+    return f"ip:{_client_ip(request)}"
+
+
+def _reject(policy: str, status_code: int, detail: str, retry_after: float):
+    rejected[policy] = rejected.get(policy, 0) + 1
+    raise HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+def rate_limit(name: str):
+    """Dependency checking every bucket of the `name` policy, a request over any of them gets a 429."""
+    policies = rate_limits.get(name, [])
+
+    async def check_rate_limit(request: Request):
+        if not RATE_LIMIT_ENABLED:
+            return
+        for per, capacity, refill_per_second in policies:
+            client = _client_key(request, per)
+            retry_after = await rate_limit_store.take(f"{name}:{per}:{client}", capacity, refill_per_second)
+            if retry_after:
+                logger.warning(f"Rate limit {name} per {per} exceeded by {client}")
+                _reject(name, status.HTTP_429_TOO_MANY_REQUESTS, "Too many requests", retry_after)
+
+    return check_rate_limit
+
+
+class ConcurrencyLimit:
+    """At most `limit` requests of one route class at a time, a bounded queue of waiters and a 503 past it."""
+
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(limit)
+
+    def _shed(self):
+        logger.warning(f"{self.name} requests are over their concurrency limit, shedding one")
+        _reject(self.name, status.HTTP_503_SERVICE_UNAVAILABLE, "Server is busy, retry shortly", 1)
+
+    async def __call__(self):
+        if not self._slots.locked():
+            await self._slots.acquire()
+        elif self.waiting >= self.queue_size:
+            self._shed()
+        else:
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except TimeoutError:
+                self._shed()
+            finally:
+                self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting,
+                "queue_size": self.queue_size}
+
+
+concurrency_limits = {name.strip(): ConcurrencyLimit(name.strip(), int(limit), CONCURRENCY_QUEUE_SIZE,
+                                                     CONCURRENCY_QUEUE_TIMEOUT)
+                      for name, limit in (pair.split("=", 1) for pair in CONCURRENCY_LIMITS.split(",") if pair.strip())}
+
+
+async def _unlimited():
+    yield
+
+
+def concurrency_limit(name: str):
+    """Dependency holding a slot of the `name` route class for the whole request, a no-op for unconfigured classes."""
+    return concurrency_limits.get(name) or _unlimited
+
+
+def admission_stats() -> dict:
+    return {"enabled": RATE_LIMIT_ENABLED, "rejected": rejected,
+            "buckets": len(rate_limit_store) if isinstance(rate_limit_store, MemoryStore) else None,
+            "concurrency": {name: limit.stats() for name, limit in concurrency_limits.items()}}
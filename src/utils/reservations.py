@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime, timedelta
+from os import getenv
+from typing import Iterable
+from uuid import UUID
+
+from sqlalchemy import select, delete, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.config.db_setup import session_local, dialect_insert
+from src.models.app_model import StockReservation, CartItem, Product
+from src.utils.looger_handler import logger
+
+RESERVATION_TTL = timedelta(minutes=int(getenv("RESERVATION_TTL_MINUTES", "15")))
+RESERVATION_SWEEP_INTERVAL = float(getenv("RESERVATION_SWEEP_INTERVAL", "30"))
+RESERVATION_SWEEP_BATCH_SIZE = int(getenv("RESERVATION_SWEEP_BATCH_SIZE", "500"))
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+async def reserved_quantities(db: AsyncSession, product_ids: Iterable[UUID],
+                              exclude_cart_item_ids: Iterable[UUID] = ()) -> dict[UUID, int]:
+    """Active (unexpired) holds per product, leaving out the holds of the given cart lines."""
+    query = (
+        select(StockReservation.product_id, func.sum(StockReservation.quantity))
+        .filter(StockReservation.product_id.in_(set(product_ids)), StockReservation.expires_at > datetime.now())
+        .group_by(StockReservation.product_id)
+    )
+    exclude_cart_item_ids = set(exclude_cart_item_ids)
+    if exclude_cart_item_ids:
+        query = query.filter(StockReservation.cart_item_id.not_in(exclude_cart_item_ids))
+    return dict((await db.execute(query)).all())
+
+
+async def active_holds(db: AsyncSession, cart_item_ids: Iterable[UUID]) -> dict[UUID, int]:
+    """Quantity still held by each of the given cart lines, expired holds are left out."""
+    rows = await db.execute(
+        select(StockReservation.cart_item_id, StockReservation.quantity)
+        .filter(StockReservation.cart_item_id.in_(set(cart_item_ids)), StockReservation.expires_at > datetime.now())
+    )
+    return dict(rows.all())
+
+
+async def hold(db: AsyncSession, cart_items: Iterable[CartItem]) -> None:
+    """Create or refresh the holds of flushed cart lines for their current quantity."""
+    expires_at = datetime.now() + RESERVATION_TTL
+    rows = [{"cart_item_id": cart_item.id, "product_id": cart_item.product_id, "quantity": cart_item.quantity,
+             "expires_at": expires_at} for cart_item in cart_items]
+    if not rows:
+        return
+
+    stmt = dialect_insert(db)(StockReservation)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[StockReservation.cart_item_id],
+        set_={"quantity": stmt.excluded.quantity, "expires_at": stmt.excluded.expires_at},
+    )
+    await db.execute(stmt, rows)
+
+
+def active_hold_total(exclude_cart_id: UUID | None = None):
+    """Correlated subquery summing the active holds on the enclosing statement's Product row."""
+    query = select(func.coalesce(func.sum(StockReservation.quantity), 0)).filter(
+        StockReservation.product_id == Product.id, StockReservation.expires_at > datetime.now()
+    )
+    if exclude_cart_id is not None:
+        query = query.filter(StockReservation.cart_item_id.not_in(
+            select(CartItem.id).filter(CartItem.cart_id == exclude_cart_id)  # type:ignore
+        ))
+    return query.scalar_subquery()
+
+
+async def claim(db: AsyncSession, cart_items: Iterable[CartItem]) -> None:
+    """
+        hold() for flushed cart lines, raising InsufficientStock if a product no longer covers all of its active holds.
+        The check runs after the write, so on SQLite it sees every committed hold (writers are serialized) and on
+        other dialects the product rows are locked first.
+    """
+    cart_items = list(cart_items)
+    product_ids = {cart_item.product_id for cart_item in cart_items}
+    if not product_ids:
+        return
+
+    if db.bind.dialect.name != "sqlite":
+        await db.execute(select(Product.id).filter(Product.id.in_(product_ids)).with_for_update())
+    await hold(db, cart_items)
+    oversold = (await db.scalars(
+        select(Product.id).filter(Product.id.in_(product_ids), Product.stock < active_hold_total())
+    )).all()
+    if oversold:
+        raise InsufficientStock(f"Products {', '.join(map(str, oversold))} don't have enough stock")
+
+
+async def release(db: AsyncSession, cart_item_ids: Iterable[UUID]) -> None:
+    cart_item_ids = set(cart_item_ids)
+    if cart_item_ids:
+        await db.execute(delete(StockReservation).filter(StockReservation.cart_item_id.in_(cart_item_ids)))
+
+
+async def expire_reservations(batch_size: int = RESERVATION_SWEEP_BATCH_SIZE) -> int:
+    """Delete expired holds in batches of `batch_size`, each batch in its own short transaction."""
+    expired = 0
+    async with session_local() as db:
+        while True:
+            expired_ids = select(StockReservation.id).filter(
+                StockReservation.expires_at <= datetime.now()
+            ).limit(batch_size)
+            result = await db.execute(delete(StockReservation).filter(StockReservation.id.in_(expired_ids)))
+            await db.commit()
+            expired += result.rowcount
+            if result.rowcount < batch_size:
+                return expired
+
+
+async def run_reservation_sweeper() -> None:
+    while True:
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
+        try:
+            expired = await expire_reservations()
+            if expired:
+                logger.info(f"{expired} expired stock reservations have been released")
+        except Exception as e:
+            logger.error(f"Stock reservation sweep failed: {e}")
@@ -0,0 +1,149 @@
+import re
+from os import getenv
+from uuid import UUID
+
+from sqlalchemy import text, select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from src.config.db_setup import engine
+from src.models.app_model import Product
+from src.utils.looger_handler import logger
+
+SEARCH_INDEX = getenv("SEARCH_INDEX", "")  # "fts" (SQLite only) or "like", empty picks by the database dialect
+
+
+def _terms(query: str) -> list[str]:
+    return re.findall(r"\w+", query.lower())
+
+
+class SearchIndex:
+    """Full-text index over Product.name/description, kept in sync by the admin product routes."""
+
+    async def setup(self, conn: AsyncConnection) -> None:
+        raise NotImplementedError
+
+    async def upsert(self, db: AsyncSession, product: Product) -> None:
+        await self.upsert_many(db, [product])
+
+    async def upsert_many(self, db: AsyncSession, products) -> None:
+        """`products` are Product entities or rows with id, name and description."""
+        raise NotImplementedError
+
+    async def remove(self, db: AsyncSession, product_id: UUID) -> None:
+        raise NotImplementedError
+
+    async def search(self, db: AsyncSession, query: str, limit: int, offset: int) -> list[UUID]:
+        raise NotImplementedError
+
+
+class SqliteFtsIndex(SearchIndex):
+    table = "products_fts"
+    backfill_batch_size = 5000
+
+    @staticmethod
+    def _rowid(product_id: UUID) -> int:
+        # stable 63-bit rowid derived from the uuid, so updates and deletes hit the fts b-tree directly
+        return int.from_bytes(product_id.bytes[:8], "big") >> 1
+
+    @staticmethod
+    def _match_expression(query: str) -> str | None:
+        terms = _terms(query)
+        if not terms:
+            return None
+        # exact match on every term but the last, which is a prefix so results follow what the user is typing
+        return " ".join([f'"{term}"' for term in terms[:-1]] + [f'"{terms[-1]}"*'])
+
+    async def setup(self, conn: AsyncConnection) -> None:
+        is_exist = (await conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table,)
+        )).first()
+        if is_exist:
+            return
+
+        await conn.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {self.table} USING fts5("
+            f"product_id UNINDEXED, name, description, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+
+        indexed = 0
+        result = await conn.stream(select(Product.id, Product.name, Product.description))
+        async for rows in result.partitions(self.backfill_batch_size):
+            await conn.exec_driver_sql(
+                f"INSERT INTO {self.table} (rowid, product_id, name, description) VALUES (?, ?, ?, ?)",
+                [(self._rowid(row.id), row.id.hex, row.name, row.description) for row in rows],
+            )
+            indexed += len(rows)
+        logger.info(f"Search index {self.table} has been created with {indexed} products")
+
+    async def upsert_many(self, db: AsyncSession, products) -> None:
+        params = [{"rowid": self._rowid(product.id), "product_id": product.id.hex, "name": product.name,
+                   "description": product.description} for product in products]
+        if not params:
+            return
+        await db.execute(text(f"DELETE FROM {self.table} WHERE rowid = :rowid"), params)
+        await db.execute(
+            text(f"INSERT INTO {self.table} (rowid, product_id, name, description) "
+                 f"VALUES (:rowid, :product_id, :name, :description)"),
+            params,
+        )
+
+    async def remove(self, db: AsyncSession, product_id: UUID) -> None:
+        await db.execute(text(f"DELETE FROM {self.table} WHERE rowid = :rowid"), {"rowid": self._rowid(product_id)})
+
+    async def search(self, db: AsyncSession, query: str, limit: int, offset: int) -> list[UUID]:
+        match = self._match_expression(query)
+        if match is None:
+            return []
+
+        # bm25 column weights: product_id (unindexed), name, description
+        rows = await db.execute(
+            text(f"SELECT product_id FROM {self.table} WHERE {self.table} MATCH :match "
+                 f"ORDER BY bm25({self.table}, 0.0, 10.0, 1.0) LIMIT :limit OFFSET :offset"),
+            {"match": match, "limit": limit, "offset": offset},
+        )
+        return [UUID(product_id) for product_id, in rows]
+
+
+class LikeSearchIndex(SearchIndex):
+    """
+        Fallback for databases without FTS5: no index to keep, every term has to appear in the name or description
+        (case-insensitive LIKE, a scan of the products table), name matches first. Fine for small catalogs only.
+    """
+
+    async def setup(self, conn: AsyncConnection) -> None:
+        pass
+
+    async def upsert_many(self, db: AsyncSession, products) -> None:
+        pass
+
+    async def remove(self, db: AsyncSession, product_id: UUID) -> None:
+        pass
+
+    async def search(self, db: AsyncSession, query: str, limit: int, offset: int) -> list[UUID]:
+        terms = _terms(query)
+        if not terms:
+            return []
+
+        # \w matches "_", a LIKE wildcard
+        patterns = [f"%{term.replace('_', '/_')}%" for term in terms]
+        in_name = and_(*[Product.name.ilike(pattern, escape="/") for pattern in patterns])
+        rows = await db.scalars(
+            select(Product.id)
+            .filter(*[or_(Product.name.ilike(pattern, escape="/"), Product.description.ilike(pattern, escape="/"))
+                      for pattern in patterns])
+            .order_by(in_name.desc(), Product.name, Product.id)
+            .limit(limit).offset(offset)
+        )
+        return list(rows)
+
+
+def _make_search_index() -> SearchIndex:
+    kind = SEARCH_INDEX or ("fts" if engine.dialect.name == "sqlite" else "like")
+    if kind == "fts":
+        return SqliteFtsIndex()
+    if kind == "like":
+        return LikeSearchIndex()
+    raise ValueError(f"Unknown SEARCH_INDEX {SEARCH_INDEX!r}, expected fts or like")
+
+
+search_index = _make_search_index()
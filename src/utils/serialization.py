@@ -0,0 +1,82 @@
+from os import getenv
+
+from fastapi import Request, Response, status
+from fastapi.middleware.gzip import GZipMiddleware
+from pydantic import TypeAdapter
+from starlette.datastructures import MutableHeaders
+
+# responses at least this big are gzipped for clients that accept it, 0 turns compression off
+GZIP_MINIMUM_SIZE = int(getenv("GZIP_MINIMUM_SIZE", "1024"))
+GZIP_COMPRESS_LEVEL = int(getenv("GZIP_COMPRESS_LEVEL", "5"))
+# appended inside the quotes of a strong ETag when the body is gzipped, the compressed bytes are another representation
+GZIP_ETAG_SUFFIX = "-gzip"
+
+_adapters: dict[object, TypeAdapter] = {}
+
+
+def adapter_for(response_type) -> TypeAdapter:
+    # building a TypeAdapter compiles a validator and a serializer, so there is one per response type per process
+    adapter = _adapters.get(response_type)
+    if adapter is None:
+        adapter = _adapters[response_type] = TypeAdapter(response_type)
+    return adapter
+
+
+def rows_as_dicts(rows) -> list[dict]:
+    """Column rows as plain dicts, the cheapest input a pydantic validator takes (attribute lookups on Row are slow)."""
+    if not rows:
+        return []
+    fields = rows[0]._fields
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def dump_json(response_type, content) -> bytes:
+    """
+        Validate `content` (column rows, ORM objects or dicts) against response_type and encode it in one pydantic-core
+        pass, instead of FastAPI's response_model validation, jsonable_encoder and json.dumps.
+    """
+    adapter = adapter_for(response_type)
+    return adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+
+
+def json_response(response_type, content, status_code: int = status.HTTP_200_OK) -> Response:
+    return Response(content=dump_json(response_type, content), status_code=status_code,
+                    media_type="application/json")
+
+
+def gzip_etag(etag: str) -> str:
+    return f'{etag[:-1]}{GZIP_ETAG_SUFFIX}"'
+
+
+def identity_etag(etag: str) -> str:
+    """The ETag of the uncompressed body, for comparing an If-None-Match candidate whichever encoding it was sent with."""
+    etag = etag.removeprefix("W/")
+    return f'{etag[:-len(GZIP_ETAG_SUFFIX) - 1]}"' if etag.endswith(f'{GZIP_ETAG_SUFFIX}"') else etag
+
+
+def gzipped(request: Request, size: int) -> bool:
+    """Whether GZipETagMiddleware compresses a response body of `size` bytes to this request."""
+    return 0 < GZIP_MINIMUM_SIZE <= size and "gzip" in request.headers.get("accept-encoding", "")
+
+
+class GZipETagMiddleware(GZipMiddleware):
+    """
+        GZipMiddleware that also gives a compressed response its own strong ETag, a strong ETag promises the same
+        bytes and a cache holding the gzipped body must not answer a request for the plain one with it.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await super().__call__(scope, receive, send)
+            return
+
+        async def send_with_etag(message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                etag = headers.get("etag")
+                if etag is not None and headers.get("content-encoding") == "gzip" and not etag.startswith("W/") \
+                        and not etag.endswith(f'{GZIP_ETAG_SUFFIX}"'):
+                    headers["ETag"] = gzip_etag(etag)
+            await send(message)
+
+        await super().__call__(scope, receive, send_with_etag)
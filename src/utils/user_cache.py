@@ -0,0 +1,74 @@
+from collections import OrderedDict
+from os import getenv
+from time import time
+
+from src.schemas.user_schema import UserOut
+from src.utils.cache_backend import on_invalidation
+
+USER_CACHE_SIZE = int(getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(getenv("USER_CACHE_TTL", "300"))
+
+
+class UserCache:
+    """LRU of verified token -> UserOut, each entry lives until min(ttl, token expiry)."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, UserOut]] = OrderedDict()
+        self._tokens_by_email: dict[str, set[str]] = {}
+
+    def get(self, token: str) -> UserOut | None:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time():
+            self._remove(token)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return user
+
+    def set(self, token: str, user: UserOut, token_expires_at: float | None = None) -> None:
+        expires_at = time() + self.ttl
+        if token_expires_at is not None:
+            expires_at = min(expires_at, token_expires_at)
+
+        self._remove(token)
+        self._entries[token] = (expires_at, user)
+        self._tokens_by_email.setdefault(user.email, set()).add(token)
+
+        while len(self._entries) > self.max_size:
+            self._remove(next(iter(self._entries)))
+
+    def invalidate_user(self, email: str) -> None:
+        for token in self._tokens_by_email.pop(email, set()):
+            self._entries.pop(token, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tokens_by_email.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+    def _remove(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_email.get(entry[1].email)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_email[entry[1].email]
+
+
+user_cache = UserCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+on_invalidation("user", lambda email: user_cache.clear() if email is None else user_cache.invalidate_user(email))